@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# =====================================================
+# Dashboard API client
+# =====================================================
+# One client per Streamlit server process, shared by every browser session
+# (app.py keeps it in st.cache_resource):
+#   - a keep-alive requests.Session with a pool sized for the fan-out, so a
+#     rerun reuses open connections instead of connecting for every fetch
+#   - get_many() sends a rerun's independent GETs side by side
+#   - shared GETs (heatmap, history, exercises) are coalesced: callers that
+#     arrive while one is in flight wait for it, and its result is reused for
+#     COALESCE_SECONDS, so N sessions refreshing in the same second cost one
+#     backend call. Revalidation sends the last ETag, so an unchanged catalog
+#     comes back as an empty 304.
+# Failures and non-200 answers come back as None.
+
+POOL_SIZE = 16
+TIMEOUT = 5  # seconds
+COALESCE_SECONDS = 1.0
+
+
+class _Flight:
+    __slots__ = ("done", "data", "etag", "fetched_at")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.etag = None
+        self.fetched_at = 0.0
+
+
+class ApiClient:
+    def __init__(self, base_url, pool_size=POOL_SIZE, timeout=TIMEOUT, coalesce_seconds=COALESCE_SECONDS):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.coalesce_seconds = coalesce_seconds
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="api-fetch")
+        self._lock = threading.Lock()
+        self._shared = {}  # (path, params) -> latest _Flight
+
+    # -------------------- reads --------------------
+    def get_json(self, path, params=None, shared=False, token=None):
+        """GET `path` and decode it, or None. shared=True coalesces across sessions, so takes no `token`."""
+        if not shared:
+            return self._get(path, params, token=token)[0]
+
+        key = (path, tuple(sorted((params or {}).items())))
+        with self._lock:
+            flight = self._shared.get(key)
+            if flight is not None and not flight.done.is_set():
+                leader = False
+            elif flight is not None and time.monotonic() - flight.fetched_at < self.coalesce_seconds:
+                return flight.data
+            else:
+                previous, flight = flight, _Flight()
+                self._shared[key] = flight
+                leader = True
+        if not leader:
+            flight.done.wait()
+            return flight.data
+
+        try:
+            flight.data, flight.etag = self._get(path, params, previous)
+        finally:
+            flight.fetched_at = time.monotonic()
+            flight.done.set()
+        return flight.data
+
+    def get_many(self, calls):
+        """{name: get_json kwargs} -> {name: result}, fetched concurrently."""
+        futures = {name: self._executor.submit(self.get_json, **kwargs) for name, kwargs in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _get(self, path, params=None, previous=None, token=None):
+        headers = {}
+        if previous is not None and previous.etag:
+            headers["If-None-Match"] = previous.etag
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        try:
+            r = self.session.get(self.base_url + path, params=params, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            return None, None
+        if r.status_code == 304:
+            return previous.data, previous.etag
+        if r.status_code != 200:
+            return None, None
+        try:
+            return r.json(), r.headers.get("ETag")
+        except ValueError:
+            return None, None
+
+    # -------------------- writes --------------------
+    def post_json(self, path, payload=None, timeout=None, token=None, params=None):
+        """POST `payload`, as the holder of ID `token` if given; the response, or None if unreachable."""
+        return self._send("POST", path, payload, timeout, token, params)
+
+    def delete(self, path, timeout=None, token=None, params=None):
+        """DELETE `path`, as the holder of ID `token` if given; the response, or None if unreachable."""
+        return self._send("DELETE", path, None, timeout, token, params)
+
+    def _send(self, method, path, payload, timeout, token, params):
+        headers = {"Authorization": f"Bearer {token}"} if token else None
+        try:
+            return self.session.request(method, self.base_url + path, json=payload, params=params, headers=headers,
+                                        timeout=timeout or self.timeout)
+        except requests.RequestException:
+            return None
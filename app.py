@@ -1,9 +1,11 @@
+import os
+import time
 import streamlit as st
-import requests
 from datetime import datetime, timezone
+from urllib.parse import quote
 import pandas as pd
-from streamlit_autorefresh import st_autorefresh
-from firebase_auth import signup_user, signin_user
+from api_client import ApiClient
+from firebase_auth import refresh_id_token, signup_user, signin_user
 
 # =====================================================
 # PAGE CONFIG
@@ -42,35 +44,28 @@ h1, h2, h3 { letter-spacing:.2px; }
   border:1px solid rgba(255,255,255,0.08);
   border-radius:14px; padding:14px 16px; margin:8px 0;
 }
-.disabled-btn {
-  opacity:0.4; pointer-events:none;
-}
 </style>
 """, unsafe_allow_html=True)
 
 # =====================================================
 # CONSTANTS
 # =====================================================
-API_URL = "http://127.0.0.1:8000/analytics/heatmap"
-EQUIPMENTS_URL = "http://127.0.0.1:8000/equipments"
-USAGE_UPDATE_URL = "http://127.0.0.1:8000/usage_logs/update"
-EXERCISES_URL = "http://127.0.0.1:8000/exercises"
-REFRESH_INTERVAL = 10  # seconds
-
-AVG_SESSION_TIME_BY_ZONE = {
-    "cardio": 20, "dumbbells": 12, "benches": 15,
-    "squat racks": 25, "back machines": 18,
-    "bicep machines": 10, "tricep machines": 12,
-    "shoulder machines": 14, "quad machines": 16,
-    "glute machines": 18, "leg machines": 20
-}
-DEFAULT_SESSION = 20
+API_BASE = os.getenv("UREC_API_URL", "http://127.0.0.1:8000")
+HEATMAP_PATH = "/analytics/heatmap"
+HISTORY_PATH = "/analytics/history"
+USAGE_UPDATE_PATH = "/usage_logs/update"
+EXERCISES_PATH = "/exercises/"
+RECOMMEND_PATH = "/recommendations"
+USERS_PATH = "/users"
+WAITLIST_PATH = "/waitlist"
+REFRESH_INTERVAL = 10  # seconds; how often the live fragments rerun
 
 # =====================================================
 # SESSION STATE
 # =====================================================
 defaults = {
     "user_id": None, "user_name": None,
+    "id_token": None, "refresh_token": None, "token_expires": 0,
     "auth_complete": False, "stage": "login",
     "selected_group": None, "switch_target": None,
     "show_modal": False,
@@ -89,12 +84,31 @@ def rerun_safe():
     except Exception:
         st.experimental_rerun()
 
-def fetch_json(url):
-    try:
-        r = requests.get(url, timeout=5)
-        return r.json() if r.status_code == 200 else None
-    except:
-        return None
+@st.cache_resource
+def get_api():
+    """One pooled, coalescing API client for every session on this server."""
+    return ApiClient(API_BASE)
+
+
+def api_user():
+    """Who the backend knows us as: the Firebase uid our ID token carries, like index.html."""
+    return st.session_state.user_id or "demo_user"
+
+
+def keep_token(res):
+    st.session_state.id_token = res.get("idToken") or res.get("id_token")
+    st.session_state.refresh_token = res.get("refreshToken") or res.get("refresh_token")
+    st.session_state.token_expires = time.time() + int(res.get("expiresIn") or res.get("expires_in") or 3600)
+
+
+def id_token():
+    """A current ID token, refreshed shortly before the old one expires."""
+    if st.session_state.refresh_token and st.session_state.token_expires - time.time() < 60:
+        try:
+            keep_token(refresh_id_token(st.session_state.refresh_token))
+        except Exception:
+            pass  # the backend answers 401 and the user signs in again
+    return st.session_state.id_token
 
 
 def post_usage_update(zone, status):
@@ -102,35 +116,28 @@ def post_usage_update(zone, status):
     payload = {
         "zone": zone,
         "status": status,
-        "user": st.session_state.user_name or "demo_user",
+        "user": api_user(),
         "timestamp": datetime.now(timezone.utc).isoformat(),
     }
-    try:
-        return requests.post(USAGE_UPDATE_URL, json=payload, timeout=10)
-    except:
-        return None
+    return get_api().post_json(USAGE_UPDATE_PATH, payload, timeout=10, token=id_token())
 
 
-def get_eta_for_zone(zone, utilization):
-    avg_time = AVG_SESSION_TIME_BY_ZONE.get(zone.lower(), DEFAULT_SESSION)
-    return int((utilization / 100.0) * avg_time)
+def waitlist_call(method, zone):
+    """Join (post_json) or leave (delete) a zone's waitlist."""
+    return method(f"{WAITLIST_PATH}/{quote(zone, safe='')}", params={"user": api_user()}, token=id_token())
 
 
 @st.cache_data(ttl=120)
 def fetch_workout_library():
-    """Fetch all exercises once from backend"""
+    """Fetch all exercises once from backend, grouped by muscle"""
     try:
-        data = fetch_json(EXERCISES_URL)
-        if not data or "exercises" not in data:
+        data = get_api().get_json(EXERCISES_PATH, shared=True)
+        if not data or "groups" not in data:
             return {}
-        workout_library = {}
-        for ex in data["exercises"]:
-            muscle = ex.get("primary_muscle", "Other")
-            workout_library.setdefault(muscle, []).append({
-                "name": ex.get("exercise_name"),
-                "zone": ex.get("equipment_type"),
-            })
-        return workout_library
+        return {
+            muscle: [{"name": ex.get("exercise_name"), "zone": ex.get("equipment_type")} for ex in exercises]
+            for muscle, exercises in data["groups"].items()
+        }
     except Exception as e:
         print("Error fetching workout library:", e)
         return {}
@@ -162,6 +169,7 @@ def login_screen():
                     res = signin_user(email, password)
                     st.session_state.user_name = email.split("@")[0]
                     st.session_state.user_id = res["localId"]
+                    keep_token(res)
                     st.session_state.auth_complete = True
                     st.session_state.stage = "welcome"
                     rerun_safe()
@@ -173,9 +181,18 @@ def login_screen():
 # =====================================================
 # HEATMAP PANEL
 # =====================================================
-def render_heatmap_panel():
+@st.fragment(run_every=REFRESH_INTERVAL)
+def live_heatmap_panel():
+    """Reruns on its own every REFRESH_INTERVAL; shares its fetches with the other sessions."""
+    data = get_api().get_many({
+        "heatmap": {"path": HEATMAP_PATH, "shared": True},
+        "history": {"path": HISTORY_PATH, "params": {"granularity": "hour"}, "shared": True},
+    })
+    render_heatmap_panel(data["heatmap"], data["history"])
+
+
+def render_heatmap_panel(data, history):
     st.markdown("### 🌡️ Live Gym Occupancy Overview")
-    data = fetch_json(API_URL)
     if not data or "zones" not in data:
         st.warning("No live data available.")
         return
@@ -184,30 +201,33 @@ def render_heatmap_panel():
     df = pd.DataFrame([{"Zone": k, "Utilization": v.get("utilization_percent", 0)} for k, v in zones.items()])
     st.bar_chart(df.set_index("Zone"))
 
-    # Historical mock trend
-    st.markdown("#### ⏱ Historical Utilization Trend (Simulated)")
-    times = pd.date_range(end=datetime.now(), periods=12, freq="H")
-    mock_data = pd.DataFrame({
-        "Time": times,
-        "Occupancy %": [min(100, abs(60 + 30 * (i % 4 - 2))) for i in range(len(times))],
+    # Historical trend from the hourly rollups
+    st.markdown("#### ⏱ Historical Utilization Trend")
+    if not history or not history.get("buckets"):
+        st.caption("No usage history yet.")
+        return
+    trend = pd.DataFrame({
+        "Time": pd.to_datetime([b["bucket_start"] for b in history["buckets"]]),
+        "Occupancy %": [b.get("utilization_percent", 0) for b in history["buckets"]],
     }).set_index("Time")
-    st.area_chart(mock_data)
-    st.caption("💡 Scroll through hours to find less active times (simulated trend).")
+    st.area_chart(trend)
+    st.caption("💡 Scroll through hours to find less active times.")
 
 # =====================================================
 # CHECK-IN STATUS
 # =====================================================
-def get_current_checkin():
-    user = st.session_state.user_name or "demo_user"
-    data = fetch_json(EQUIPMENTS_URL)
-    if not data:
-        return None
+def session_call():
+    """get_json kwargs for the user's active session, which only its owner may read."""
+    return {"path": f"{USERS_PATH}/{quote(api_user(), safe='')}/session", "token": id_token()}
+
 
-    user = user.strip().lower()
-    for e in data:
-        if e.get("current_user", "").strip().lower() == user and e.get("status", "").lower() in ["in_use", "occupied"]:
-            return e
-    return None
+def recommend_call(group):
+    """get_json kwargs for the group's ranking; the same for every session, so it's shared."""
+    return {"path": RECOMMEND_PATH, "params": {"muscle_group": group}, "shared": True}
+
+
+def current_checkin(data):
+    return data if data and data.get("checked_in") else None
 
 
 def render_current_status(current):
@@ -218,6 +238,9 @@ def render_current_status(current):
     zone = current.get("zone") or current.get("equipment_type")
     eq_id = current.get("equipment_id")
     st.markdown(f"### 🧍 Checked into: **{zone} ({eq_id})**")
+    if current.get("projected_end"):
+        end = datetime.fromisoformat(current["projected_end"]).replace(tzinfo=timezone.utc).astimezone()
+        st.caption(f"⏱ {current['elapsed_minutes']:.0f} min in · usually done by {end:%H:%M}")
 
     if st.button(f"🏁 Check Out from {zone}", key=f"checkout_{eq_id}"):
         with st.spinner("Processing checkout..."):
@@ -231,49 +254,81 @@ def render_current_status(current):
         else:
             st.error("❌ Something went wrong while checking out.")
 
+# =====================================================
+# WAITLIST
+# =====================================================
+# A full zone puts the user in line instead of asking them to retry; the
+# session endpoint reports their place, and the unit held for them once it's
+# their turn.
+def render_waitlist(queued):
+    if not queued:
+        return
+    zone = queued["zone"]
+    if queued["state"] == "offered":
+        st.success(f"🎟️ A unit in **{zone}** is held for you for {queued['hold_seconds']}s.")
+        if st.button(f"✅ Claim {zone}", key=f"claim_{zone}"):
+            r = post_usage_update(zone, "in_use")
+            if r is not None and r.status_code in (200, 201):
+                rerun_safe()
+            else:
+                st.error("❌ The hold ran out before we could check you in.")
+        return
+
+    st.info(f"⏳ You're #{queued['position']} in line for **{zone}** · about {queued['eta_minutes']} min")
+    if st.button(f"🚪 Leave the {zone} line", key=f"leave_{zone}"):
+        waitlist_call(get_api().delete, zone)
+        rerun_safe()
+
 # =====================================================
 # SMART SUGGESTIONS
 # =====================================================
-def render_suggestions(data, group, current):
-    zones = data.get("zones", {})
-    suggestions = []
-    for item in WORKOUT_LIBRARY.get(group, []):
-        z = item["zone"].lower()
-        stats = zones.get(z, {"utilization_percent": 0})
-        util = float(stats.get("utilization_percent", 0))
-        eta = get_eta_for_zone(z, util)
-        suggestions.append({"name": item["name"], "zone": z, "eta": eta, "util": util})
-
-    suggestions.sort(key=lambda x: x["eta"])
+def render_suggestions(data, current_zone=None):
     st.markdown("### 🧠 <span class='urec-gradient'>Smart Workout Suggestions</span>", unsafe_allow_html=True)
+    if not data:
+        st.warning("⚠️ No suggestions available.")
+        return
 
-    for s in suggestions:
-        dot = "🟢" if s["util"] < 30 else ("🟡" if s["util"] < 70 else "🔴")
+    for s in data["recommendations"]:
+        if s["zone"] == current_zone:
+            continue  # where we already are
+        util = s["utilization_percent"]
+        dot = "🟢" if util < 30 else ("🟡" if util < 70 else "🔴")
         st.markdown(f"""
         <div class='sugg-card'>
-          <b>{s['name']}</b> ({s['zone']})<br>
-          ETA: {s['eta']} min | {dot}
+          <b>{s['exercise']}</b> ({s['zone']})<br>
+          ETA: {s['eta_minutes']} min | {dot}
         </div>
         """, unsafe_allow_html=True)
 
-        if current and current.get("zone", "").lower() == s["zone"]:
-            st.markdown("<div class='disabled-btn'>Already checked in</div>", unsafe_allow_html=True)
-            continue
-
-        if st.button(f"✅ Check In to {s['zone']}", key=f"sugg_{s['zone']}_{s['name']}"):
+        if st.button(f"✅ Check In to {s['zone']}", key=f"sugg_{s['zone']}_{s['exercise']}"):
             with st.spinner(f"Checking into {s['zone']}..."):
                 r = post_usage_update(s["zone"], "in_use")
-            if r and r.status_code in (200, 201):
+            if r is not None and r.status_code in (200, 201):
                 st.success(f"✅ Checked into {s['zone']} successfully!")
                 rerun_safe()
+            elif r is not None and r.status_code == 404:
+                # Full: take a place in line rather than retrying.
+                waitlist_call(get_api().post_json, s["zone"])
+                rerun_safe()
             else:
-                st.error("❌ Could not check in. Please retry.")
+                st.error("❌ Could not check in.")
+
+@st.fragment(run_every=REFRESH_INTERVAL)
+def live_plan_panel(group):
+    """Check-in status and suggestion ETAs, refreshed without rerunning the page."""
+    data = get_api().get_many({"session": session_call(), "suggestions": recommend_call(group)})
+    current = current_checkin(data["session"])
+    render_current_status(current)
+    render_waitlist((data["session"] or {}).get("waitlist"))
+    st.markdown("<hr style='opacity:0.2;'>", unsafe_allow_html=True)
+    render_suggestions(data["suggestions"], current and current.get("zone"))
 
 # =====================================================
 # MAIN FLOW
 # =====================================================
+# The page itself only reruns on interaction (login, picking a group, a check
+# in or out); the live panels are fragments that refresh themselves.
 st.markdown("<h1 class='urec-gradient'>🏋️ UREC Live Equipment Dashboard</h1>", unsafe_allow_html=True)
-st_autorefresh(interval=REFRESH_INTERVAL * 1000, key="autorefresh")
 
 if not st.session_state.auth_complete:
     login_screen()
@@ -290,14 +345,7 @@ with col1:
             rerun_safe()
 
     elif st.session_state.stage == "recommend":
-        data = fetch_json(API_URL)
-        if not data:
-            st.warning("⚠️ No data available.")
-        else:
-            current = get_current_checkin()
-            render_current_status(current)
-            st.markdown("<hr style='opacity:0.2;'>", unsafe_allow_html=True)
-            render_suggestions(data, st.session_state.selected_group, current)
+        live_plan_panel(st.session_state.selected_group)
 
 with col2:
-    render_heatmap_panel()
+    live_heatmap_panel()
@@ -0,0 +1,313 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import jwt
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+# =====================================================
+# Firebase ID Token Verification
+# =====================================================
+# Callers send the ID token from sign-in as "Authorization: Bearer <token>".
+# Tokens are verified here, not by asking Firebase: the RS256 signature is
+# checked against Google's public signing certs, which are fetched once, kept
+# for as long as their Cache-Control max-age allows and refreshed by a
+# background thread before they expire. Verified tokens go into a small LRU
+# (token -> caller, until the token's own exp), so a client sending the same
+# token again costs a dictionary lookup. Only a cache miss (a new token, a few
+# dozen microseconds of RSA) or an unknown key id (one refetch) leaves the
+# event loop.
+#
+# A verified caller is known by their Firebase uid (the token's `sub`), which
+# is also the key of their active_sessions document; both dashboards sign in
+# with Firebase and use it as the user id. Emails and display names are not
+# identities: anyone can sign up with any address.
+#
+# UREC_AUTH picks the policy:
+#   required (default)  401 without a valid token
+#   optional            verify a token when one is sent; without one, routes
+#                       fall back to the user named in the request, i.e. an
+#                       unauthenticated caller can act as anyone (logged as
+#                       auth.missing_token, sampled). For local demos only.
+#   off                 ignore Authorization entirely
+#
+# Offline, UREC_AUTH_KEYS points at a stand-in key set made by
+# `python auth.py keys <file>`; `python auth.py token <file> <uid>` mints
+# tokens for it, and the simulator and stress test mint their own from it.
+# The project id comes from UREC_FIREBASE_PROJECT, else the service account
+# key (or LOCAL_PROJECT with stand-in keys).
+
+AUTH_MODE = os.getenv("UREC_AUTH", "required")
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+LOCAL_KEYS_PATH = os.getenv("UREC_AUTH_KEYS")
+LOCAL_PROJECT = "urec-live-local"
+TOKEN_CACHE_SIZE = 10000
+CLOCK_SKEW = 60  # seconds of leeway on iat/exp
+REFRESH_MARGIN = 300  # refetch the certs this long before they expire
+RETRY_AFTER = 60  # seconds between attempts while the cert endpoint fails
+MIN_REFETCH = 30  # seconds between refetches triggered by unknown key ids
+TIMEOUT = 5  # seconds
+
+log = logging.getLogger(__name__)
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _public_key(pem):
+    pem = pem.encode()
+    if b"BEGIN CERTIFICATE" in pem:
+        return x509.load_pem_x509_certificate(pem).public_key()
+    return serialization.load_pem_public_key(pem)
+
+
+# -------------------- signing keys --------------------
+class GoogleCerts:
+    """Google's token signing keys by key id, refreshed per their Cache-Control."""
+
+    def __init__(self, url=CERTS_URL):
+        self.url = url
+        self.session = requests.Session()
+        self._keys = {}
+        self._expires = 0.0
+        self._fetched = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self, kid):
+        """The public key for `kid`; fetches on first use or when `kid` is new."""
+        key = self._keys.get(kid)
+        if key is None and self._refetch_allowed():
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    def _refetch_allowed(self):
+        return not self._keys or time.monotonic() - self._fetched >= MIN_REFETCH
+
+    def refresh(self):
+        with self._lock:
+            r = self.session.get(self.url, timeout=TIMEOUT)
+            r.raise_for_status()
+            self._keys = {kid: _public_key(pem) for kid, pem in r.json().items()}
+            self._fetched = time.monotonic()
+            self._expires = self._fetched + _max_age(r.headers.get("Cache-Control", ""))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="auth-certs-refresh", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(max(self._expires - time.monotonic() - REFRESH_MARGIN, 0) or RETRY_AFTER)
+            try:
+                self.refresh()
+            except Exception:
+                pass  # keep the current keys; try again in RETRY_AFTER
+
+
+def _max_age(cache_control):
+    for directive in cache_control.split(","):
+        name, _, value = directive.strip().partition("=")
+        if name == "max-age" and value.isdigit():
+            return int(value)
+    return 3600
+
+
+class LocalKeys:
+    """A stand-in key set for offline runs: the same kid -> PEM mapping, plus a private key to sign with."""
+
+    def __init__(self, certs, private_key=None):
+        self.certs = certs
+        self.private_key = private_key
+        self._keys = {kid: _public_key(pem) for kid, pem in certs.items()}
+
+    def get(self, kid):
+        return self._keys.get(kid)
+
+    @classmethod
+    def generate(cls):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+        ).decode()
+        return cls({uuid.uuid4().hex: public_pem}, private_key)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        private_key = data.get("private_key")
+        if private_key:
+            private_key = serialization.load_pem_private_key(private_key.encode(), password=None)
+        return cls(data["certs"], private_key)
+
+    def save(self, path):
+        private_pem = self.private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+        ).decode()
+        with open(path, "w") as f:
+            json.dump({"certs": self.certs, "private_key": private_pem}, f, indent=2)
+
+    def mint(self, uid, project_id, ttl=3600, email=None, **claims):
+        """A token shaped like a Firebase ID token for `uid` (email "<uid>@local" by default)."""
+        now = int(time.time())
+        payload = {
+            "iss": f"https://securetoken.google.com/{project_id}",
+            "aud": project_id,
+            "auth_time": now,
+            "user_id": uid,
+            "sub": uid,
+            "email": email or f"{uid}@local",
+            "iat": now,
+            "exp": now + ttl,
+            **claims,
+        }
+        return jwt.encode(payload, self.private_key, algorithm="RS256", headers={"kid": next(iter(self.certs))})
+
+
+def stand_in_headers(path=LOCAL_KEYS_PATH, ttl=24 * 3600):
+    """uid -> Authorization header minted from the stand-in keys at `path`, or -> None without them."""
+    if not path:
+        return lambda uid: None
+    keys, project, headers = LocalKeys.load(path), project_id(), {}
+
+    def header(uid):
+        if uid not in headers:
+            headers[uid] = {"Authorization": f"Bearer {keys.mint(uid, project, ttl)}"}
+        return headers[uid]
+    return header
+
+
+# -------------------- verification --------------------
+class TokenVerifier:
+    def __init__(self, project_id, keys, cache_size=TOKEN_CACHE_SIZE):
+        self.project_id = project_id
+        self.keys = keys
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # token -> (uid, exp)
+        self._lock = threading.Lock()
+
+    def cached(self, token):
+        """The caller of a token verified before and not yet expired, else None."""
+        with self._lock:
+            hit = self._cache.get(token)
+            if hit is None:
+                return None
+            if hit[1] + CLOCK_SKEW <= time.time():
+                del self._cache[token]
+                return None
+            self._cache.move_to_end(token)
+            return hit[0]
+
+    def verify(self, token):
+        """The uid `token` was issued to; raises InvalidToken. Blocks when keys need fetching."""
+        uid = self.cached(token)
+        if uid is not None:
+            return uid
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise InvalidToken(str(e))
+        if header.get("alg") != "RS256":
+            raise InvalidToken("Unexpected token algorithm")
+        key = self.keys.get(header.get("kid"))
+        if key is None:
+            raise InvalidToken("Unknown signing key")
+        try:
+            claims = jwt.decode(
+                token, key, algorithms=["RS256"], audience=self.project_id,
+                issuer=f"https://securetoken.google.com/{self.project_id}",
+                leeway=CLOCK_SKEW, options={"require": ["exp", "iat", "sub"]},
+            )
+        except jwt.PyJWTError as e:
+            raise InvalidToken(str(e))
+        if not claims["sub"] or len(claims["sub"]) > 128 or claims.get("auth_time", 0) > time.time() + CLOCK_SKEW:
+            raise InvalidToken("Invalid token subject or auth_time")
+        uid = claims["sub"]
+
+        with self._lock:
+            self._cache[token] = (uid, claims["exp"])
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return uid
+
+
+def project_id():
+    project = os.getenv("UREC_FIREBASE_PROJECT")
+    if project:
+        return project
+    if LOCAL_KEYS_PATH:
+        return LOCAL_PROJECT
+    from firebase_config import CREDENTIALS_PATH
+    with open(CREDENTIALS_PATH) as f:
+        return json.load(f)["project_id"]
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """Shared verifier for this process, created on first use."""
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            keys = LocalKeys.load(LOCAL_KEYS_PATH) if LOCAL_KEYS_PATH else GoogleCerts()
+            _verifier = TokenVerifier(project_id(), keys)
+    return _verifier
+
+
+# -------------------- FastAPI dependency --------------------
+async def verified_user(authorization: str | None = Header(None)):
+    """The uid of a valid bearer token's caller, or None when none was sent (unless required)."""
+    if AUTH_MODE == "off":
+        return None
+    if not authorization:
+        if AUTH_MODE == "required":
+            raise HTTPException(status_code=401, detail="Missing bearer token", headers={"WWW-Authenticate": "Bearer"})
+        log.warning("no bearer token; trusting the user named in the request", extra={"event": "auth.missing_token"})
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Expected a bearer token", headers={"WWW-Authenticate": "Bearer"})
+
+    verifier = _verifier or await run_in_threadpool(get_verifier)
+    uid = verifier.cached(token)
+    if uid is not None:
+        return uid
+    try:
+        return await run_in_threadpool(verifier.verify, token)
+    except InvalidToken as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}", headers={"WWW-Authenticate": "Bearer"})
+    except requests.RequestException:
+        raise HTTPException(status_code=503, detail="Token signing keys are unavailable")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Offline stand-in keys for Firebase ID tokens")
+    commands = parser.add_subparsers(dest="command", required=True)
+    keys_cmd = commands.add_parser("keys", help="write a new stand-in key set")
+    keys_cmd.add_argument("path")
+    token_cmd = commands.add_parser("token", help="mint a token from a stand-in key set")
+    token_cmd.add_argument("path")
+    token_cmd.add_argument("uid")
+    token_cmd.add_argument("--project", default=os.getenv("UREC_FIREBASE_PROJECT", LOCAL_PROJECT))
+    token_cmd.add_argument("--ttl", type=int, default=3600)
+    token_cmd.add_argument("--email", default=None, help="email claim (default <uid>@local)")
+    args = parser.parse_args()
+
+    if args.command == "keys":
+        LocalKeys.generate().save(args.path)
+        print(f"✅ Stand-in keys written to {args.path}; run the API with UREC_AUTH_KEYS={args.path}")
+    else:
+        print(LocalKeys.load(args.path).mint(args.uid, args.project, args.ttl, args.email))
@@ -0,0 +1,255 @@
+"""
+Load-test suite for the UREC Live API.
+
+Scenarios mirror the real clients:
+  streamlit_rerun  one refresh tick of app.py's live fragments on the plan
+                   page: heatmap, hourly history, the user's session and
+                   recommendations, fetched side by side (each client stands for a separate Streamlit
+                   server, so nothing is coalesced)
+  web_dashboard    index.html opening: exercises, then heatmap + session
+                   together, then recommendations for a muscle group
+  checkin_flow     check in and out through /usage_logs/update, refetching
+                   heatmap + session after each step like index.html does
+
+Each point of the sweep (scenario x concurrency x equipment scale) runs for
+`--duration` seconds and reports p50/p95/p99 latency, throughput and document
+reads/writes per request as JSON. By default every equipment scale runs in a
+fresh subprocess on the memory backend, seeded with UREC_SEED_DEMO=<scale>
+(about 127 units per step), and requests go through httpx's ASGI transport
+with no sockets in between. Reads and writes come from the local database's
+op counters, counted as Firestore would bill them.
+
+    python -m benchmarks.load_test --scales 1,8,16 --concurrency 1,10,50 --output bench.json
+
+`--api` runs the same scenarios against a running server instead, e.g. one
+backed by the Firestore emulator; reads and writes are then not reported.
+The scenarios send no tokens, so that server needs UREC_AUTH=optional.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+import httpx
+
+SCENARIOS = ("streamlit_rerun", "web_dashboard", "checkin_flow")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def latency_summary(values):
+    return {f"p{int(q * 100)}": round(percentile(values, q) * 1000, 2) if values else None for q in (0.5, 0.95, 0.99)}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.iterations = []
+        self.statuses = Counter()
+
+
+async def timed(client, stats, method, path, **kwargs):
+    start = time.perf_counter()
+    r = await client.request(method, path, **kwargs)
+    stats.latencies.append(time.perf_counter() - start)
+    stats.statuses[r.status_code] += 1
+    return r
+
+
+# =====================================================
+# Scenarios
+# =====================================================
+# `state` is per simulated client and carries the versions it has seen, so
+# delta requests (?since=) look like a long-lived session's.
+async def streamlit_rerun(client, stats, user, zone, state):
+    await asyncio.gather(
+        timed(client, stats, "GET", "/analytics/heatmap"),
+        timed(client, stats, "GET", "/analytics/history?granularity=hour"),
+        timed(client, stats, "GET", f"/users/{user}/session"),
+        recommend(client, stats, user, state),
+    )
+
+
+async def web_dashboard(client, stats, user, zone, state):
+    r = await timed(client, stats, "GET", "/exercises/")
+    await refresh(client, stats, user, state)
+    if "groups" not in state and r.status_code == 200:
+        state["groups"] = sorted(r.json()["groups"])
+    await recommend(client, stats, user, state)
+
+
+async def checkin_flow(client, stats, user, zone, state):
+    r = await timed(client, stats, "POST", "/usage_logs/update", json={"zone": zone, "status": "in_use", "user": user})
+    await refresh(client, stats, user, state)
+    if r.status_code == 200:
+        await timed(client, stats, "POST", "/usage_logs/update", json={"zone": zone, "status": "available", "user": user})
+        await refresh(client, stats, user, state)
+
+
+async def refresh(client, stats, user, state):
+    # index.html's fetchData(): both requests in parallel
+    await asyncio.gather(
+        versioned(client, stats, state, "/analytics/heatmap"),
+        timed(client, stats, "GET", f"/users/{user}/session"),
+    )
+
+
+async def recommend(client, stats, user, state):
+    # Cycle through the muscle groups so every ranking gets exercised. Like
+    # the clients, leave our own zone out locally rather than have the server
+    # read the session.
+    groups = state.get("groups") or ["Chest"]
+    state["picks"] = state.get("picks", -1) + 1
+    params = {"muscle_group": groups[state["picks"] % len(groups)]}
+    await timed(client, stats, "GET", "/recommendations", params=params)
+
+
+async def versioned(client, stats, state, path):
+    r = await timed(client, stats, "GET", path, params={"since": state.get(path, 0)})
+    if r.status_code == 200:
+        state[path] = r.json()["version"]
+
+
+# =====================================================
+# Runner
+# =====================================================
+async def run_point(client, scenario, concurrency, duration, zones, ops=None):
+    stats = Stats()
+    before = Counter(ops) if ops is not None else None
+    deadline = time.perf_counter() + duration
+
+    async def worker(w):
+        i = 0
+        state = {}
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await scenario(client, stats, f"bench_{w:04d}", zones[(w + i) % len(zones)], state)
+            stats.iterations.append(time.perf_counter() - start)
+            i += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    requests = len(stats.latencies)
+    result = {
+        "scenario": scenario.__name__,
+        "concurrency": concurrency,
+        "requests": requests,
+        "iterations": len(stats.iterations),
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(requests / elapsed, 1),
+        "iterations_per_sec": round(len(stats.iterations) / elapsed, 1),
+        "latency_ms": latency_summary(stats.latencies),
+        "iteration_ms": latency_summary(stats.iterations),
+        "statuses": {str(code): n for code, n in sorted(stats.statuses.items())},
+        "reads_per_request": None,
+        "writes_per_request": None,
+    }
+    if ops is not None and requests:
+        delta = Counter(ops)
+        delta.subtract(before)
+        result["reads_per_request"] = round(delta["reads"] / requests, 2)
+        result["writes_per_request"] = round((delta["writes"] + delta["deletes"]) / requests, 2)
+    return result
+
+
+async def sweep(client, scenarios, concurrencies, duration, ops=None):
+    units = (await client.get("/equipments")).json()
+    zones = sorted({u.get("zone") for u in units if u.get("zone")})
+    results = []
+    for name in scenarios:
+        for concurrency in concurrencies:
+            point = await run_point(client, globals()[name], concurrency, duration, zones, ops)
+            point["equipment"] = len(units)
+            print(f"⏱ {name} x{concurrency} on {len(units)} units: {point['throughput_rps']} req/s, "
+                  f"p99 {point['latency_ms']['p99']} ms", file=sys.stderr)
+            results.append(point)
+    return results
+
+
+async def run_in_process(scenarios, concurrencies, duration):
+    """One equipment scale, against this process's memory backend."""
+    # ASGITransport doesn't run the lifespan, so the usage-log buffer is closed
+    # here, and it journals to a scratch file that goes away with the memory
+    # database instead of next to whatever runs in this directory later.
+    with tempfile.TemporaryDirectory(prefix="urec-bench-") as scratch:
+        os.environ["UREC_USAGE_JOURNAL"] = os.path.join(scratch, "usage_logs.journal")
+        os.environ.setdefault("UREC_AUTH", "optional")  # scenarios act as named users, without tokens
+        import main
+        from occupancy import get_index
+        from storage import get_stores
+        from usage_buffer import get_usage_buffer
+        get_index()
+        buffer = get_usage_buffer()
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                return await sweep(client, scenarios, concurrencies, duration, get_stores().equipments.db.ops)
+        finally:
+            buffer.close()
+
+
+async def run_remote(api, scenarios, concurrencies, duration):
+    limits = httpx.Limits(max_connections=max(concurrencies) * 2)
+    async with httpx.AsyncClient(base_url=api, limits=limits, timeout=60) as client:
+        return await sweep(client, scenarios, concurrencies, duration)
+
+
+def run_scale(scale, args):
+    env = {**os.environ, "UREC_STORAGE": "memory", "UREC_SEED_DEMO": str(scale)}
+    cmd = [sys.executable, "-m", "benchmarks.load_test", "--worker",
+           "--scenarios", args.scenarios, "--concurrency", args.concurrency, "--duration", str(args.duration)]
+    out = subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UREC Live API load tests")
+    parser.add_argument("--api", default=None, help="benchmark a running server instead of in-process")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,10,50")
+    parser.add_argument("--scales", default="1,8", help="equipment scales for in-process runs")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per point")
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {sorted(unknown)}")
+    concurrencies = [int(c) for c in args.concurrency.split(",")]
+
+    if args.worker:
+        # Seeding and the routes print progress; keep stdout for the JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            results = asyncio.run(run_in_process(scenarios, concurrencies, args.duration))
+        print(json.dumps(results))
+        sys.exit()
+
+    if args.api:
+        results = asyncio.run(run_remote(args.api, scenarios, concurrencies, args.duration))
+    else:
+        results = [point for scale in args.scales.split(",") for point in run_scale(int(scale), args)]
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "target": args.api or "memory (in-process)",
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ {len(results)} results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,132 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions as gexc
+
+# =====================================================
+# Bulk Firestore Writes
+# =====================================================
+# Buffers set/update/delete operations into WriteBatches of at most 500 ops
+# (Firestore's per-commit limit), commits them on a thread pool, and retries
+# transient failures with exponential backoff and jitter. At most
+# 2 x `workers` batches are in flight, so memory stays flat however many
+# operations are queued.
+#
+# A timeout or server error leaves it unknown whether a commit landed.
+# Replaying plain sets and deletes is harmless, but replaying Increments
+# counts them twice, so writers built with idempotent=False only retry
+# errors that mean the batch was not applied and raise on the rest.
+#
+#     with BulkWriter(db, progress=log_progress("equipments")) as writer:
+#         for eq in equipments:
+#             writer.set(db.collection("equipments").document(eq["equipment_id"]), eq)
+
+MAX_BATCH_OPS = 500
+log = logging.getLogger(__name__)
+RETRYABLE = (
+    gexc.Aborted,
+    gexc.DeadlineExceeded,
+    gexc.InternalServerError,
+    gexc.ResourceExhausted,
+    gexc.ServiceUnavailable,
+)
+NOT_APPLIED = (gexc.Aborted, gexc.ResourceExhausted)  # rejected before anything was written
+
+
+def log_progress(label, every=5000):
+    """Progress callback that logs roughly every `every` committed writes."""
+    last = [0]
+
+    def report(done, total):
+        if done - last[0] >= every or done == total:
+            last[0] = done
+            log.info("   %s: %s/%s writes committed", label, f"{done:,}", f"{total:,}",
+                     extra={"event": "bulk_write.progress", "collection": label, "done": done, "total": total})
+    return report
+
+
+class BulkWriter:
+    def __init__(self, db, workers=8, max_retries=5, progress=None, chunk_size=MAX_BATCH_OPS, idempotent=True):
+        self.db = db
+        self.retryable = RETRYABLE if idempotent else NOT_APPLIED
+        self.chunk_size = min(chunk_size, MAX_BATCH_OPS)
+        self.max_retries = max_retries
+        self.progress = progress
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.Semaphore(workers * 2)
+        self._lock = threading.Lock()
+        self._ops = []
+        self._futures = []
+        self.queued = 0
+        self.committed = 0
+
+    # -------------------- queueing --------------------
+    def set(self, ref, data, merge=False):
+        self._queue(("set", ref, data, merge))
+
+    def update(self, ref, data):
+        self._queue(("update", ref, data, None))
+
+    def delete(self, ref):
+        self._queue(("delete", ref, None, None))
+
+    def _queue(self, op):
+        self._ops.append(op)
+        self.queued += 1
+        if len(self._ops) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Hand the buffered operations to the pool as one batch."""
+        if not self._ops:
+            return
+        ops, self._ops = self._ops, []
+        self._slots.acquire()
+        self._futures.append(self._pool.submit(self._commit, ops))
+
+    # -------------------- committing --------------------
+    def _commit(self, ops):
+        try:
+            for attempt in range(self.max_retries + 1):
+                batch = self.db.batch()
+                for kind, ref, data, merge in ops:
+                    if kind == "set":
+                        batch.set(ref, data, merge=merge)
+                    elif kind == "update":
+                        batch.update(ref, data)
+                    else:
+                        batch.delete(ref)
+                try:
+                    batch.commit()
+                    break
+                except self.retryable:
+                    if attempt == self.max_retries:
+                        raise
+                    time.sleep(min(30, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+            with self._lock:
+                self.committed += len(ops)
+                if self.progress:
+                    self.progress(self.committed, self.queued)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Commit whatever is buffered and wait for every batch; returns the op count."""
+        self.flush()
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._pool.shutdown(wait=True)
+        return self.committed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(wait=True)
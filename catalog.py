@@ -0,0 +1,109 @@
+import hashlib
+import json
+import threading
+from fastapi.concurrency import run_in_threadpool
+from storage import get_stores
+
+# =====================================================
+# Exercise Catalog
+# =====================================================
+# The catalog only changes when the seeders run, so the API keeps it in memory
+# and follows the exercise store's change feed instead of streaming the
+# collection per request. Every effective change bumps `version` and rebuilds
+# the /exercises/ body once, grouped by primary muscle and already serialized;
+# its ETag is a hash of those bytes, so it survives restarts and is the same on
+# every worker. In steady state the endpoint costs no Firestore reads.
+
+FIRST_SNAPSHOT_TIMEOUT = 10  # seconds
+DEFAULTS = {"avg_duration": 10, "recommended_sets": 3, "recommended_reps": 8}
+
+
+def _entry(data):
+    return {
+        "exercise_name": data.get("exercise_name"),
+        "primary_muscle": data.get("primary_muscle"),
+        "equipment_type": data.get("equipment_type"),
+        **{field: data.get(field, default) for field, default in DEFAULTS.items()},
+    }
+
+
+class ExerciseCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self.started = False
+        self._exercises = {}
+        self.version = 0
+        self._build()
+
+    # -------------------- listener --------------------
+    def start(self, store):
+        """Watch the exercise store once; the first start waits for the first snapshot."""
+        with self._start_lock:
+            if self._watch is None:
+                self._watch = store.watch(self._on_changes)
+                self._ready.wait(FIRST_SNAPSHOT_TIMEOUT)
+            self.started = True
+
+    def stop(self):
+        with self._start_lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+                self._watch = None
+            self.started = False
+        self._ready.clear()
+
+    def _on_changes(self, changes):
+        with self._lock:
+            changed = False
+            for name, data in changes:
+                data = _entry(data) if data is not None else None
+                if self._exercises.get(name) != data:
+                    changed = True
+                    if data is None:
+                        self._exercises.pop(name, None)
+                    else:
+                        self._exercises[name] = data
+            if changed:
+                self.version += 1
+                self._build()
+        self._ready.set()
+
+    def _build(self):
+        """Regroup and re-serialize the catalog; called with the lock held."""
+        groups = {}
+        for name in sorted(self._exercises):
+            data = self._exercises[name]
+            groups.setdefault(data["primary_muscle"] or "Other", []).append(data)
+        self._groups = {muscle: groups[muscle] for muscle in sorted(groups)}
+        self._body = json.dumps({"groups": self._groups}, separators=(",", ":")).encode()
+        self._etag = '"' + hashlib.sha1(self._body).hexdigest() + '"'
+
+    # -------------------- reads --------------------
+    def groups(self):
+        """{primary muscle: [exercise, ...]}; shared, treat as read-only."""
+        with self._lock:
+            return self._groups
+
+    def response(self):
+        """(etag, serialized /exercises/ body) read atomically."""
+        with self._lock:
+            return self._etag, self._body
+
+
+catalog = ExerciseCatalog()
+
+
+def get_catalog():
+    """Shared catalog for this process, started on first use."""
+    catalog.start(get_stores().exercises)
+    return catalog
+
+
+async def start_catalog():
+    """get_catalog() for the event loop: a first start waits for its snapshot in a worker thread."""
+    if not catalog.started:
+        await run_in_threadpool(get_catalog)
+    return catalog
@@ -1,29 +1,47 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import logging
+from bulk_write import BulkWriter, log_progress
+from firebase_config import get_db
+from log_config import setup_logging
+from storage import FACILITIES
+from storage.base import PARTITIONED_COLLECTIONS, collection_path
 
-# Initialize Firebase
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
-
-# List of collections to clear
+# List of collections to clear; the partitioned ones are cleared for every
+# facility in UREC_FACILITIES (facilities/{id}/<collection>).
 collections_to_clear = [
     "equipments",
     "exercises",
     "usage_logs",
+    "usage_rollups",
+    "rollup_batches",
+    "active_sessions",
     "analytics"
 ]
 
+PAGE_SIZE = 5000
+log = logging.getLogger(__name__)
+
+
 def clear_collection(collection_name):
-    print(f"🧹 Clearing collection: {collection_name}")
-    docs = db.collection(collection_name).stream()
+    log.info(f"🧹 Clearing collection: {collection_name}")
     count = 0
-    for doc in docs:
-        doc.reference.delete()
-        count += 1
-    print(f"✅ Deleted {count} documents from {collection_name}\n")
+    db = get_db()
+    with BulkWriter(db, progress=log_progress(collection_name)) as writer:
+        # Page through ids only (no field data) so huge collections stay cheap to list
+        query = db.collection(collection_name).select([]).limit(PAGE_SIZE)
+        while True:
+            page = list(query.stream())
+            for doc in page:
+                writer.delete(doc.reference)
+            count += len(page)
+            if len(page) < PAGE_SIZE:
+                break
+            query = db.collection(collection_name).select([]).start_after(page[-1]).limit(PAGE_SIZE)
+    log.info(f"✅ Deleted {count} documents from {collection_name}\n")
 
 if __name__ == "__main__":
+    setup_logging(fmt="text")
     for c in collections_to_clear:
-        clear_collection(c)
-    print("🎯 All selected collections cleared successfully!")
+        paths = [collection_path(f, c) for f in FACILITIES] if c in PARTITIONED_COLLECTIONS else [c]
+        for path in dict.fromkeys(paths):
+            clear_collection(path)
+    log.info("🎯 All selected collections cleared successfully!")
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from occupancy import get_index
+from rollups import log_interval
+from storage import DEFAULT_FACILITY, get_stores
+
+# =====================================================
+# Wait-time Prediction
+# =====================================================
+# For a full zone, the wait is the soonest any in-use unit is expected to free
+# up. Each unit's expected remaining time is E[D - elapsed | D > elapsed], with
+# D drawn from the zone's session-length histogram, which is learned from the
+# daily usage rollups and updated as new sessions are checked out. Zone answers
+# are cached until that zone's occupancy changes or RESULT_TTL passes (elapsed
+# times keep moving even when nothing else does).
+
+HISTORY_DAYS = 14
+MODEL_TTL = 3600      # seconds before a zone's histogram is reloaded
+RESULT_TTL = 30       # seconds a zone's ETA is reused
+MIN_SAMPLES = 5       # below this a zone borrows the gym-wide histogram
+DEFAULT_SESSION = 20  # minutes, when there is no history at all
+
+
+def expected_remaining(histogram, elapsed):
+    """Mean minutes left for a session that has already run `elapsed` minutes."""
+    weight = remaining = 0
+    for minutes, count in histogram.items():
+        minutes = int(minutes)
+        if minutes > elapsed:
+            weight += count
+            remaining += (minutes - elapsed) * count
+    if weight:
+        return remaining / weight
+    # Longer than any session we have seen: it should end any moment.
+    return 1 if histogram else max(DEFAULT_SESSION - elapsed, 1)
+
+
+class EtaEngine:
+    def __init__(self, index, stores):
+        self.index = index
+        self.stores = stores
+        self._lock = threading.Lock()
+        self._models = {}
+        self._results = {}
+        index.subscribe(self._on_change)
+
+    # -------------------- duration model --------------------
+    async def _load_histogram(self, scope, key):
+        end = datetime.utcnow() + timedelta(days=1)
+        start = end - timedelta(days=HISTORY_DAYS + 1)
+        histogram = {}
+        for bucket in await self.stores.rollups.query("day", scope, key, start.isoformat(), end.isoformat()):
+            for minutes, count in bucket.get("durations", {}).items():
+                histogram[minutes] = histogram.get(minutes, 0) + count
+        return histogram
+
+    async def histogram(self, zone):
+        """Session-length histogram for `zone`, falling back to the whole gym."""
+        now = time.monotonic()
+        for scope, key in (("zone", zone), ("gym", "all")):
+            with self._lock:
+                cached = self._models.get((scope, key))
+            if cached is None or now - cached[1] > MODEL_TTL:
+                cached = (await self._load_histogram(scope, key), now)
+                with self._lock:
+                    self._models[(scope, key)] = cached
+            if sum(cached[0].values()) >= MIN_SAMPLES:
+                return cached[0]
+        return cached[0]
+
+    def observe(self, log):
+        """Fold a just-finished session into the cached histograms."""
+        interval = log_interval(log)
+        if interval is None:
+            return
+        minutes = str(interval[2])
+        zone = log.get("zone") or "unknown"
+        with self._lock:
+            for model_key in (("zone", zone), ("gym", "all")):
+                if model_key in self._models:
+                    histogram = self._models[model_key][0]
+                    histogram[minutes] = histogram.get(minutes, 0) + 1
+            self._results.pop(zone, None)
+
+    # -------------------- predictions --------------------
+    def _on_change(self, equipment_id, old, new):
+        with self._lock:
+            for doc in (old, new):
+                if doc is not None:
+                    self._results.pop(doc.get("zone") or "unknown", None)
+
+    async def zone_eta(self, zone):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(zone)
+        if cached is not None and now - cached[1] < RESULT_TTL:
+            return cached[0]
+
+        units = self.index.units(zone)
+        available = sum(1 for u in units if u.get("status") != "in_use")
+        result = {"eta_minutes": 0, "available": available, "next_free_equipment": None}
+        if not available and units:
+            remaining, equipment_id = (await self._freeing_order(zone, units))[0]
+            result = {"eta_minutes": round(remaining), "available": 0, "next_free_equipment": equipment_id}
+
+        with self._lock:
+            self._results[zone] = (result, now)
+        return result
+
+    async def _freeing_order(self, zone, units):
+        """(expected minutes left, equipment_id) for each in-use unit, soonest first."""
+        histogram = await self.histogram(zone)
+        utcnow = datetime.utcnow()
+        order = []
+        for unit in units:
+            if unit.get("status") != "in_use":
+                continue
+            started = unit.get("start_time")
+            elapsed = (utcnow - datetime.fromisoformat(started)).total_seconds() / 60 if started else 0
+            order.append((expected_remaining(histogram, max(elapsed, 0)), unit.get("equipment_id")))
+        return sorted(order)
+
+    async def queue_wait(self, zone, position):
+        """Minutes until the user at `position` (1 = head) of `zone`'s waitlist can expect a unit.
+
+        The n-th in line gets the n-th unit to free up; past the number of
+        units, a full session per lap around the zone is added.
+        """
+        freeing = await self._freeing_order(zone, self.index.units(zone))
+        if not freeing:
+            return 0
+        laps, i = divmod(position - 1, len(freeing))
+        return round(freeing[i][0] + laps * await self.expected_remaining(zone, 0))
+
+    async def expected_remaining(self, zone, elapsed):
+        """Minutes a session in `zone` that has run `elapsed` minutes is expected to last."""
+        return expected_remaining(await self.histogram(zone), max(elapsed, 0))
+
+    async def all_etas(self):
+        zones = list(self.index.zone_counts(by="zone"))
+        return dict(zip(zones, await asyncio.gather(*(self.zone_eta(zone) for zone in zones))))
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(facility=DEFAULT_FACILITY):
+    with _engines_lock:
+        engine = _engines.get(facility)
+        if engine is None:
+            engine = _engines[facility] = EtaEngine(get_index(facility), get_stores(facility))
+    return engine
@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from storage import DEFAULT_FACILITY, get_stores
+import rollups
+
+# =====================================================
+# Usage Log Export
+# =====================================================
+# Streams usage_logs out as Arrow record batches, one store page at a time,
+# for offline analysis:
+#
+#   python export_usage_logs.py --out exports/usage_logs                 # Parquet
+#   python export_usage_logs.py --out exports/usage_logs --format arrow  # Arrow IPC
+#
+# writes a hive-partitioned dataset
+# (facility=<id>/date=YYYY-MM-DD/zone=<zone>/part-*.ext) that pyarrow.dataset
+# and pandas.read_parquet load directly; the Arrow files can be
+# memory-mapped. Timestamps are timestamp[us] and durations duration[s].
+#
+# Runs are windowed on ingested_at, when a log reached the store, not on its
+# end_time: a log can be written long after it ended (a flush backing off, a
+# dead letter retried, a journal replayed after downtime), and would slip
+# behind an end_time watermark. Each run covers [since, until) with `until`
+# SETTLE_MINUTES ago by default, which leaves room for writes still
+# committing and for clock skew between writers, and saves `until` as the
+# facility's watermark (facility=<id>/_watermark.json); the next run starts
+# from there. A first run (no watermark) takes every log that ended before
+# `until`, which includes logs from before ingested_at existed. Delivery is
+# at least once: a log rewritten by a retry, or caught by both rules around
+# the first run, can appear twice and should be deduplicated by log_id.
+# GET /analytics/export streams the same batches as one Arrow IPC stream or
+# Parquet file.
+#
+# pyarrow is only needed here and is imported on first use.
+
+PAGE_SIZE = 5000
+SETTLE_MINUTES = 5
+WATERMARK_FILE = "_watermark.json"  # leading "_" keeps it out of dataset discovery
+FORMATS = {"parquet": ("parquet", "parquet"), "arrow": ("ipc", "arrow")}  # name -> (dataset format, extension)
+
+log = logging.getLogger(__name__)
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Exporting usage logs needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def schema():
+    pa = require_pyarrow()
+    return pa.schema([
+        ("facility", pa.string()),
+        ("log_id", pa.string()),
+        ("equipment_id", pa.string()),
+        ("zone", pa.string()),
+        ("user", pa.string()),
+        ("exercise", pa.string()),
+        ("start_time", pa.timestamp("us")),
+        ("end_time", pa.timestamp("us")),
+        ("duration", pa.duration("s")),
+        ("ingested_at", pa.timestamp("us")),
+        ("date", pa.date32()),
+    ])
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def record_batch(rows, facility=DEFAULT_FACILITY):
+    """One Arrow record batch from `facility`'s (log_id, log) pairs."""
+    pa = require_pyarrow()
+    intervals = [rollups.log_interval(log) for _, log in rows]
+    return pa.RecordBatch.from_pydict({
+        "facility": [facility] * len(rows),
+        "log_id": [log_id for log_id, _ in rows],
+        "equipment_id": [log.get("equipment_id") for _, log in rows],
+        "zone": [log.get("zone") for _, log in rows],
+        "user": [log.get("user") for _, log in rows],
+        "exercise": [log.get("exercise") for _, log in rows],
+        "start_time": [i and i[0] for i in intervals],
+        "end_time": [i and i[1] for i in intervals],
+        "duration": [i and timedelta(minutes=i[2]) for i in intervals],
+        "ingested_at": [_timestamp(log.get("ingested_at")) for _, log in rows],
+        "date": [i and i[1].date() for i in intervals],
+    }, schema=schema())
+
+
+def default_until():
+    return (datetime.utcnow() - timedelta(minutes=SETTLE_MINUTES)).isoformat()
+
+
+async def pages(stores, since=None, until=None, page_size=PAGE_SIZE):
+    """Pages of (log_id, log) with since <= ingested_at < until (ISO strings), newest first.
+
+    Without `since`, every log with end_time < until instead (a first export).
+    """
+    order = "end_time" if since is None else "ingested_at"
+    after = None
+    while True:
+        page = await stores.usage_logs.page(page_size, after, start=since, end=until, order=order)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        after = (page[-1][1].get(order) or "", page[-1][0])
+
+
+# -------------------- HTTP stream --------------------
+class _Chunks:
+    """Write-only file object that hands its bytes out as they arrive.
+
+    tell() keeps counting across drains, which the Parquet writer relies on
+    for the offsets in its footer.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+async def stream(stores, since=None, until=None, fmt="arrow"):
+    """The window as one Arrow IPC stream or Parquet file, yielded in byte chunks."""
+    pa = require_pyarrow()
+    chunks = _Chunks()
+    sink = pa.PythonFile(chunks, mode="w")
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema())
+    else:
+        writer = pa.ipc.new_stream(sink, schema())
+    async for page in pages(stores, since, until):
+        writer.write_batch(record_batch(page, stores.facility))
+        yield chunks.drain()
+    writer.close()
+    yield chunks.drain()
+
+
+# -------------------- partitioned dataset --------------------
+def _watermark_path(out, facility):
+    return os.path.join(out, f"facility={facility}", WATERMARK_FILE)
+
+
+def read_watermark(out, facility=DEFAULT_FACILITY):
+    path = _watermark_path(out, facility)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["until"]
+
+
+def write_watermark(out, facility, until, rows):
+    path = _watermark_path(out, facility)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"until": until, "rows": rows, "exported_at": datetime.utcnow().isoformat()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def export_dataset(stores, out, fmt="parquet", since=None, until=None):
+    """Append the stores' facility's window to the dataset at `out`; returns (rows, until).
+
+    `since` defaults to the facility's watermark (everything on the first
+    run). The watermark only moves once every batch has been written.
+    """
+    pa = require_pyarrow()
+    import pyarrow.dataset as ds
+    facility = stores.facility
+    since = since if since is not None else read_watermark(out, facility)
+    until = until or default_until()
+    dataset_format, ext = FORMATS[fmt]
+    rows = 0
+
+    def batches():
+        nonlocal rows
+        loop = asyncio.new_event_loop()
+        source = pages(stores, since, until)
+        try:
+            while True:
+                try:
+                    page = loop.run_until_complete(source.__anext__())
+                except StopAsyncIteration:
+                    return
+                rows += len(page)
+                yield record_batch(page, facility)
+        finally:
+            loop.run_until_complete(source.aclose())
+            loop.close()
+
+    # One file per partition per run, named after the window's end.
+    run = until.replace(":", "").replace("-", "")
+    partitions = pa.schema([("facility", pa.string()), ("date", pa.date32()), ("zone", pa.string())])
+    ds.write_dataset(
+        batches(), out, schema=schema(), format=dataset_format,
+        partitioning=ds.partitioning(partitions, flavor="hive"),
+        basename_template=f"part-{run}-{{i}}.{ext}",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    write_watermark(out, facility, until, rows)
+    return rows, until
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export usage logs to a partitioned Parquet/Arrow dataset")
+    parser.add_argument("--out", default="exports/usage_logs", help="dataset directory")
+    parser.add_argument("--facility", default=DEFAULT_FACILITY, help="facility whose usage logs to export")
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument("--since", default=None, help="ISO ingested_at to start from (default: the facility's watermark)")
+    parser.add_argument("--until", default=None, help=f"ISO ingested_at to stop at (default: {SETTLE_MINUTES} minutes ago)")
+    args = parser.parse_args()
+    from log_config import setup_logging
+    setup_logging(fmt="text")
+
+    since = args.since or read_watermark(args.out, args.facility)
+    log.info(f"⏳ Exporting {args.facility} usage logs ingested in [{since or 'the beginning'}, "
+             f"{args.until or 'now'}) to {args.out}...")
+    rows, until = export_dataset(get_stores(args.facility), args.out, args.format, since, args.until)
+    log.info(f"✅ {rows} usage logs exported; next run starts at {until}.")
@@ -0,0 +1,27 @@
+from fastapi import HTTPException
+from fastapi.requests import HTTPConnection
+from occupancy import start_index
+from storage import DEFAULT_FACILITY, FACILITIES
+
+# =====================================================
+# Facility Routing
+# =====================================================
+# Facility-scoped routers are mounted twice (see main.py): under
+# /facilities/{facility_id} and at their original paths, which address the
+# default facility so existing clients keep working. Handlers take
+# `facility: str = Depends(facility_id)` and pass it to get_stores(),
+# get_index() and friends, so each facility's requests only touch its own
+# partition, listener and caches.
+#
+# main.py starts every facility's index at startup; facility_id starts any
+# that isn't (yet) in a worker thread, so the get_index() calls in handlers
+# never wait for a first snapshot on the event loop.
+
+
+async def facility_id(connection: HTTPConnection):
+    """The facility a request addresses; 404 for one this deployment doesn't serve."""
+    facility = connection.path_params.get("facility_id", DEFAULT_FACILITY)
+    if facility not in FACILITIES:
+        raise HTTPException(status_code=404, detail=f"Unknown facility '{facility}'")
+    await start_index(facility)
+    return facility
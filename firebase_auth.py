@@ -11,6 +11,11 @@ API_KEY = os.getenv("FIREBASE_API_KEY")
 # Firebase REST API endpoints
 SIGNUP_URL = f"https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={API_KEY}"
 SIGNIN_URL = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={API_KEY}"
+REFRESH_URL = f"https://securetoken.googleapis.com/v1/token?key={API_KEY}"
+TIMEOUT = 10  # seconds
+
+# One keep-alive session for every call to Google's auth endpoints
+session = requests.Session()
 
 # -----------------------------------------------------
 # Authentication Helpers
@@ -19,7 +24,7 @@ def signup_user(email: str, password: str):
     """Create a new Firebase user account."""
     payload = {"email": email, "password": password, "returnSecureToken": True}
     try:
-        r = requests.post(SIGNUP_URL, json=payload)
+        r = session.post(SIGNUP_URL, json=payload, timeout=TIMEOUT)
         r.raise_for_status()
         return r.json()
     except requests.exceptions.RequestException as e:
@@ -29,8 +34,18 @@ def signin_user(email: str, password: str):
     """Sign in existing Firebase user."""
     payload = {"email": email, "password": password, "returnSecureToken": True}
     try:
-        r = requests.post(SIGNIN_URL, json=payload)
+        r = session.post(SIGNIN_URL, json=payload, timeout=TIMEOUT)
         r.raise_for_status()
         return r.json()
     except requests.exceptions.RequestException as e:
         raise Exception(f"Login failed: {r.text if 'r' in locals() else e}")
+
+def refresh_id_token(refresh_token: str):
+    """Exchange a refresh token for a new ID token (they last an hour)."""
+    payload = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+    try:
+        r = session.post(REFRESH_URL, data=payload, timeout=TIMEOUT)
+        r.raise_for_status()
+        return r.json()
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Token refresh failed: {r.text if 'r' in locals() else e}")
@@ -1,9 +1,60 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import os
+import threading
 
-# Initialize Firebase app (use your service account key)
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin.initialize_app(cred)
+# =====================================================
+# Firebase
+# =====================================================
+# Nothing happens at import. The Admin SDK app and the Firestore clients are
+# built on first use, once per process, so importing a route module doesn't
+# need serviceAccountKey.json and doesn't pay for loading the SDK or setting up
+# gRPC. The API builds them from its lifespan and then warms the async client's
+# channel in the background (Stores.warm_up), so the first request doesn't pay
+# for the TLS handshake and token fetch either.
+#
+# The async client's channel belongs to the event loop it is first used on,
+# which must be the API's loop: build it anywhere, but only call it from there.
+#
+# `from firebase_config import db` still works and builds the client then.
 
-# Create a Firestore client
-db = firestore.client()
+CREDENTIALS_PATH = os.getenv("UREC_FIREBASE_CREDENTIALS", "serviceAccountKey.json")
+
+_lock = threading.RLock()
+_app = None
+_clients = {}
+
+
+def get_app():
+    """The Firebase Admin app, initialized from CREDENTIALS_PATH on first use."""
+    global _app
+    with _lock:
+        if _app is None:
+            import firebase_admin
+            from firebase_admin import credentials
+            _app = firebase_admin.initialize_app(credentials.Certificate(CREDENTIALS_PATH))
+        return _app
+
+
+def get_db():
+    """Blocking Firestore client (listeners, bulk writes and scripts)."""
+    with _lock:
+        if "db" not in _clients:
+            from firebase_admin import firestore
+            _clients["db"] = firestore.client(get_app())
+        return _clients["db"]
+
+
+def get_async_db():
+    """Async Firestore client for the request path."""
+    with _lock:
+        if "async_db" not in _clients:
+            from firebase_admin import firestore_async
+            _clients["async_db"] = firestore_async.client(get_app())
+        return _clients["async_db"]
+
+
+def __getattr__(name):
+    if name == "db":
+        return get_db()
+    if name == "async_db":
+        return get_async_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
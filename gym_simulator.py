@@ -1,17 +1,60 @@
+"""
+Discrete-event gym simulator / load generator.
+
+Members arrive at each zone as a Poisson process whose rate follows a
+time-of-day curve, hold a unit for a session length drawn from the zone's
+distribution, then either move on to another zone or go home. Events sit in a
+heap keyed by simulated time, and the clock runs `--speed` times faster than
+real time (0 = as fast as the backend answers), so a whole evening can be
+replayed in minutes.
+
+Every check-in and check-out goes through the real API, or straight to the
+storage layer with `--target store`:
+
+    python auth.py keys keys.json
+    UREC_AUTH_KEYS=keys.json UREC_FACILITIES=main,simulation UREC_STORAGE=memory UREC_SEED_DEMO=1 uvicorn main:app
+    UREC_AUTH_KEYS=keys.json python gym_simulator.py --members 500 --hours 2 --speed 120
+
+A busy evening on a 2,000-unit gym:
+
+    python seed_full_gym_data.py --facility simulation --scale 16
+    UREC_FACILITIES=main,simulation uvicorn main:app
+    python gym_simulator.py --members 5000 --start 17:00 --hours 4 --speed 60 --rate 500
+
+Against the API, each virtual member signs its requests with a token minted
+from the stand-in keys in UREC_AUTH_KEYS (the server's, see auth.py); without
+them the server has to run with UREC_AUTH=optional.
+
+The simulator drives the "simulation" facility (the API's
+/facilities/simulation routes, or that facility's stores), never the real one
+by default. The server stamps check-in and check-out with its own clock, so at
+--speed 60 a 20-minute session is logged as 20 seconds long. Those logs would
+skew the real facility's rollups and the ETA engine's session lengths, and
+each facility keeps its own. `--facility` drives another facility. The
+simulator warns when that facility is a real one and the speed is not 1.
+
+Units that are already in use when the run starts are checked out at a
+plausible time, so seeded occupants free up like everyone else.
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import random
 import threading
 import time
-import random
 from datetime import datetime, timedelta
-from firebase_admin import firestore
-from firebase_config import db  # Ensure this file has firebase_admin initialized
+from storage.base import DEFAULT_FACILITY
 
+# Facility the simulator drives unless told otherwise; the server has to list
+# it in UREC_FACILITIES.
+SIM_FACILITY = "simulation"
 # ------------------------------------------
 # CONFIGURATION
 # ------------------------------------------
-UPDATE_INTERVAL = 10  # seconds
-USERS = ["alex", "mia", "tom", "ryan", "eva", "leo", "nora", "chris", "jen", "sam"]
-
-# Define zones and their typical activity levels (probability of being busy)
+# Relative popularity of each zone; unknown zones get DEFAULT_ACTIVITY.
 ZONE_ACTIVITY = {
     "bench": 0.6,
     "chest_machine": 0.5,
@@ -27,109 +70,394 @@ ZONE_ACTIVITY = {
     "treadmill": 0.9,
     "stair_master": 0.8,
 }
+DEFAULT_ACTIVITY = 0.5
+
+# Arrival rate through the day relative to the peak (1.0), one value per hour.
+ARRIVAL_CURVES = {
+    "strength": [0.02, 0.01, 0.01, 0.01, 0.02, 0.10, 0.30, 0.45, 0.40, 0.30, 0.30, 0.35,
+                 0.45, 0.40, 0.35, 0.45, 0.70, 0.95, 1.00, 0.90, 0.70, 0.45, 0.20, 0.05],
+    "cardio":   [0.02, 0.01, 0.01, 0.02, 0.10, 0.45, 0.85, 0.90, 0.60, 0.40, 0.35, 0.40,
+                 0.50, 0.45, 0.35, 0.40, 0.60, 0.90, 1.00, 0.80, 0.55, 0.35, 0.15, 0.05],
+}
+ZONE_CURVES = {"treadmill": "cardio", "stair_master": "cardio"}
+
+# Session length in minutes: lognormal (median, sigma), clipped to SESSION_RANGE.
+SESSION_MINUTES = {
+    "treadmill": (25, 0.4),
+    "stair_master": (20, 0.4),
+    "dumbbell_set": (15, 0.5),
+    "squat_rack": (18, 0.45),
+}
+DEFAULT_SESSION = (12, 0.45)
+SESSION_RANGE = (2, 120)
+
+CONTINUE_PROB = 0.7     # chance a member moves on to another zone after a session
+REST_MINUTES = (1, 4)   # pause between exercises
+RETRY_MINUTES = 2       # wait before trying a full zone again
+PATIENCE = 3            # attempts at a full zone before moving on
+REPORT_MINUTES = 15     # simulated minutes between progress lines
+
+# No handler schedules a follow-up sooner than this, so events up to LOOKAHEAD
+# past the oldest in-flight one can be dispatched without breaking time order.
+LOOKAHEAD = timedelta(minutes=min(REST_MINUTES[0], RETRY_MINUTES, SESSION_RANGE[0]))
+
+log = logging.getLogger(__name__)
+
+
+def curve_level(zone, when):
+    """Arrival rate for `zone` at `when`, relative to its peak."""
+    curve = ARRIVAL_CURVES[ZONE_CURVES.get(zone, "strength")]
+    hour = when.hour + when.minute / 60
+    lo = int(hour) % 24
+    frac = hour - int(hour)
+    return curve[lo] * (1 - frac) + curve[(lo + 1) % 24] * frac
+
+
+def session_length(zone, rng=random):
+    median, sigma = SESSION_MINUTES.get(zone, DEFAULT_SESSION)
+    minutes = rng.lognormvariate(math.log(median), sigma)
+    return min(max(minutes, SESSION_RANGE[0]), SESSION_RANGE[1])
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
 
 # ------------------------------------------
-# UTILITIES
+# DRIVERS
 # ------------------------------------------
-def random_user():
-    return random.choice(USERS)
-
-def update_heatmap():
-    """Updates the analytics/heatmap document in Firestore."""
-    heatmap_ref = db.collection("analytics").document("heatmap")
-    data = heatmap_ref.get().to_dict() or {"zones": {}}
-    zones = data.get("zones", {})
-
-    # Iterate through equipment zones
-    for zone, base_activity in ZONE_ACTIVITY.items():
-        utilization = round(random.uniform(base_activity * 40, base_activity * 100), 1)
-        zones[zone] = {
-            "utilization_percent": utilization,
-            "active_users": int(utilization / 20),
-            "last_updated": datetime.now().isoformat(),
-        }
+# check_in returns "ok", "full" (no free unit), "busy" (user already checked
+# in) or "error"; check_out returns whether the user was checked out.
+class ApiDriver:
+    def __init__(self, api, concurrency, facility=SIM_FACILITY):
+        import httpx
+        from auth import stand_in_headers
+        self.auth = stand_in_headers()
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        if facility != DEFAULT_FACILITY:
+            api = f"{api.rstrip('/')}/facilities/{facility}"
+        self.client = httpx.AsyncClient(base_url=api, limits=limits, timeout=60)
+
+    async def units(self):
+        r = await self.client.get("/equipments")
+        if r.status_code == 404:
+            raise RuntimeError(f"{self.client.base_url} not found; is the facility in the server's UREC_FACILITIES?")
+        r.raise_for_status()
+        return r.json()
+
+    async def check_in(self, zone, user):
+        r = await self.client.post(f"/checkin/{zone}", params={"user": user}, headers=self.auth(user))
+        return {200: "ok", 404: "full", 400: "busy"}.get(r.status_code, "error")
+
+    async def check_out(self, zone, user):
+        r = await self.client.post(f"/checkout/{zone}", params={"user": user}, headers=self.auth(user))
+        return r.status_code == 200
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class StoreDriver:
+    """Calls the storage layer selected by UREC_STORAGE, skipping HTTP.
+
+    Usage logs go through a write-behind buffer like the API's, journaled to
+    its own file so a simulator and a server can share a working directory.
+    """
+
+    JOURNAL = "gym_simulator.journal"
+
+    def __init__(self, facility=SIM_FACILITY):
+        from storage import get_stores
+        from usage_buffer import UsageLogBuffer
+        self.facility = facility
+        self.stores = get_stores(facility)
+        self.buffer = UsageLogBuffer(self.stores, self.JOURNAL)
+        self.buffer.start()
+
+    async def units(self):
+        return await self.stores.equipments.list()
+
+    async def check_in(self, zone, user):
+        from storage import AlreadyCheckedIn, NoAvailableEquipment
+        try:
+            await self.stores.equipments.check_in(zone, user)
+        except NoAvailableEquipment:
+            return "full"
+        except AlreadyCheckedIn:
+            return "busy"
+        return "ok"
 
-    heatmap_ref.set({
-        "zones": zones,
-        "updated_at": datetime.now().isoformat()
-    })
-    print(f"📊 Heatmap updated @ {datetime.now().strftime('%H:%M:%S')}")
-
-def simulate_equipment_activity():
-    """Simulate users checking in/out on equipment."""
-    equip_ref = db.collection("equipments")
-    all_equip = [e.to_dict() for e in equip_ref.stream()]
-    if not all_equip:
-        print("⚠️ No equipment found in Firestore. Did you seed the database?")
-        return
-
-    for eq in all_equip:
-        zone = eq.get("zone")
-        eq_id = eq.get("equipment_id")
-        if not zone or not eq_id:
-            continue
-
-        doc_ref = equip_ref.document(eq_id)
-        activity_prob = ZONE_ACTIVITY.get(zone, 0.5)
-
-        # Simulate check-in
-        if eq["status"] == "available" and random.random() < (activity_prob * 0.1):
-            user = random_user()
-            start_time = datetime.now().isoformat()
-            doc_ref.update({
-                "status": "in_use",
-                "current_user": user,
-                "start_time": start_time
-            })
-            db.collection("usage_logs").add({
-                "user": user,
-                "equipment_id": eq_id,
-                "zone": zone,
-                "status": "in_use",
-                "start_time": start_time
-            })
-            print(f"✅ {user} checked into {eq_id} ({zone})")
-
-        # Simulate check-out
-        elif eq["status"] == "in_use" and random.random() < (1 - activity_prob) * 0.2:
-            duration = random.randint(5, 20)
-            user = eq.get("current_user", "")
-            start_time = eq.get("start_time") or datetime.now().isoformat()
-            end_time = datetime.now().isoformat()
-
-            # Log completion
-            db.collection("usage_logs").add({
-                "user": user,
-                "equipment_id": eq_id,
-                "zone": zone,
-                "status": "completed",
-                "start_time": start_time,
-                "end_time": end_time,
-                "duration_mins": duration
-            })
-
-            # Reset equipment
-            doc_ref.update({
-                "status": "available",
-                "current_user": "",
-                "start_time": ""
-            })
-            print(f"🏁 {user} checked out from {eq_id} after {duration} min")
-
-def run_simulator():
-    """Main simulator loop."""
-    while True:
+    async def check_out(self, zone, user):
+        from storage import NotCheckedIn
         try:
-            simulate_equipment_activity()
-            update_heatmap()
-            print("🔁 Simulation cycle complete.\n")
-            time.sleep(UPDATE_INTERVAL)
+            _, _, log = await self.stores.equipments.check_out(zone, user)
+        except NotCheckedIn:
+            return False
+        await asyncio.to_thread(self.buffer.append, log, self.facility)
+        return True
+
+    async def close(self):
+        await asyncio.to_thread(self.buffer.close)
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart (rate 0 = unlimited)."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = 0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# ------------------------------------------
+# SIMULATION
+# ------------------------------------------
+class GymSimulation:
+    def __init__(self, driver, members=5000, peak_arrivals=None, start=None, hours=4,
+                 speed=60, rate=0, concurrency=200, seed=None):
+        self.driver = driver
+        self.members = [f"member_{i:05d}" for i in range(members)]
+        self.idle = list(self.members)
+        # Peak-hour visits to the whole gym; each visit chains ~1/(1-CONTINUE_PROB) sessions.
+        self.peak_arrivals = peak_arrivals if peak_arrivals is not None else members * 0.15
+        self.start = start or datetime.now()
+        self.end = self.start + timedelta(hours=hours)
+        self.speed = speed
+        self.limiter = RateLimiter(rate)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.random = random.Random(seed)
+
+        self.zones = []
+        self.peak_rates = {}  # arrivals per simulated minute at each zone's peak
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+        self._inflight = []  # simulated times of events being handled
+
+        self.in_use = 0
+        self.capacity = 0
+        self.latencies = []
+        self.max_lag = 0
+        self.counts = {k: 0 for k in ("arrivals", "no_member", "checkin", "full", "busy", "error", "checkout", "gave_up")}
+
+    # -------------------- event queue --------------------
+    def schedule(self, at, handler, *args):
+        heapq.heappush(self._heap, (at, next(self._seq), handler, args))
+        self._wakeup.set()
+
+    def _wall_deadline(self, at):
+        if not self.speed:
+            return 0
+        return self._wall_start + (at - self.start).total_seconds() / self.speed
+
+    async def run(self):
+        units = await self.driver.units()
+        self.capacity = len(units)
+        self.zones = sorted({u.get("zone") for u in units if u.get("zone")})
+        if not self.zones:
+            log.warning("⚠️ No equipment found. Did you seed the facility (seed_full_gym_data.py --facility)?")
+            return self.summary()
+        weights = {z: ZONE_ACTIVITY.get(z, DEFAULT_ACTIVITY) for z in self.zones}
+        total = sum(weights.values())
+        for zone in self.zones:
+            self.peak_rates[zone] = self.peak_arrivals / 60 * weights[zone] / total
+            self._schedule_arrival(zone, self.start)
+
+        # Units already in use free up part-way through a typical session.
+        members = set(self.members)
+        for unit in units:
+            user = unit.get("current_user")
+            if unit.get("status") == "in_use" and user:
+                self.in_use += 1
+                if user in members:
+                    self.idle.remove(user)
+                remaining = session_length(unit.get("zone"), self.random) * self.random.random()
+                self.schedule(self.start + timedelta(minutes=remaining), self._check_out, unit.get("zone"), user)
+
+        self.schedule(self.start, self._report)
+        log.info(f"🚀 Simulating {len(self.members):,} members on {self.capacity:,} units in {len(self.zones)} zones, "
+                 f"{self.start:%H:%M}-{self.end:%H:%M}, " + (f"{self.speed:g}x real time" if self.speed else "as fast as possible"),
+                 extra={"event": "simulator.start", "members": len(self.members), "units": self.capacity, "zones": len(self.zones)})
+
+        self._wall_start = time.perf_counter()
+        while self._heap or self._inflight:
+            if not self._heap or (self._inflight and self._heap[0][0] > min(self._inflight) + LOOKAHEAD):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._wall_deadline(self._heap[0][0]) - time.perf_counter()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            at, _, handler, args = heapq.heappop(self._heap)
+            self.max_lag = max(self.max_lag, -delay if self.speed else 0)
+            await self.slots.acquire()
+            self._inflight.append(at)
+            task = asyncio.create_task(self._dispatch(handler, at, args))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        await self.driver.close()
+        return self.summary()
+
+    async def _dispatch(self, handler, at, args):
+        try:
+            await handler(at, *args)
         except Exception as e:
-            print("⚠️ Simulator error:", e)
-            time.sleep(UPDATE_INTERVAL)
+            self.counts["error"] += 1
+            log.warning("⚠️ Simulator error: %s", e, extra={"event": "simulator.error", "handler": handler.__name__})
+        finally:
+            self._inflight.remove(at)
+            self.slots.release()
+            self._wakeup.set()
+
+    async def _call(self, method, *args):
+        await self.limiter.wait()
+        started = time.perf_counter()
+        result = await method(*args)
+        self.latencies.append(time.perf_counter() - started)
+        return result
+
+    # -------------------- behaviour --------------------
+    def _schedule_arrival(self, zone, after):
+        # Thinning: candidates at the peak rate, kept in proportion to the curve.
+        gap = self.random.expovariate(self.peak_rates[zone]) if self.peak_rates[zone] else float("inf")
+        if gap != float("inf"):
+            self.schedule(after + timedelta(minutes=gap), self._arrival, zone)
+
+    async def _arrival(self, at, zone):
+        if at >= self.end:
+            return
+        self._schedule_arrival(zone, at)
+        if self.random.random() >= curve_level(zone, at):
+            return
+        self.counts["arrivals"] += 1
+        if not self.idle:
+            self.counts["no_member"] += 1
+            return
+        i = self.random.randrange(len(self.idle))
+        self.idle[i], self.idle[-1] = self.idle[-1], self.idle[i]
+        await self._visit(at, zone, self.idle.pop(), 1)
 
-def start_background_simulator():
-    """Launch simulator in background thread."""
-    t = threading.Thread(target=run_simulator, daemon=True)
+    async def _visit(self, at, zone, member, attempt):
+        result = await self._call(self.driver.check_in, zone, member)
+        self.counts["checkin" if result == "ok" else result] += 1
+        if result == "ok":
+            self.in_use += 1
+            self.schedule(at + timedelta(minutes=session_length(zone, self.random)), self._check_out, zone, member)
+        elif result == "full" and attempt < PATIENCE:
+            self.schedule(at + timedelta(minutes=RETRY_MINUTES), self._visit, zone, member, attempt + 1)
+        else:
+            if result == "full":
+                self.counts["gave_up"] += 1
+            self._next_exercise(at, zone, member)
+
+    async def _check_out(self, at, zone, member):
+        if await self._call(self.driver.check_out, zone, member):
+            self.counts["checkout"] += 1
+            self.in_use -= 1
+        if member.startswith("member_"):
+            self._next_exercise(at, zone, member)
+
+    def _next_exercise(self, at, zone, member):
+        if at < self.end and self.random.random() < CONTINUE_PROB:
+            others = [z for z in self.zones if z != zone] or self.zones
+            weights = [ZONE_ACTIVITY.get(z, DEFAULT_ACTIVITY) for z in others]
+            nxt = self.random.choices(others, weights)[0]
+            rest = self.random.uniform(*REST_MINUTES)
+            self.schedule(at + timedelta(minutes=rest), self._visit, nxt, member, 1)
+        else:
+            self.idle.append(member)
+
+    async def _report(self, at):
+        recent = self.latencies[-2000:]
+        log.info(f"🕒 {at:%H:%M}  in use {self.in_use:,}/{self.capacity:,}  "
+                 f"in gym {len(self.members) - len(self.idle):,}  "
+                 f"check-ins {self.counts['checkin']:,}  full {self.counts['full']:,}  "
+                 f"p50 {percentile(recent, 0.5) * 1000:.0f} ms  p99 {percentile(recent, 0.99) * 1000:.0f} ms  "
+                 f"lag {self.max_lag:.1f}s",
+                 extra={"event": "simulator.report", "sim_time": at.isoformat(), "in_use": self.in_use, **self.counts})
+        if at < self.end:
+            self.schedule(at + timedelta(minutes=REPORT_MINUTES), self._report)
+
+    def summary(self):
+        elapsed = time.perf_counter() - getattr(self, "_wall_start", time.perf_counter())
+        return {
+            **self.counts,
+            "requests": len(self.latencies),
+            "wall_seconds": round(elapsed, 1),
+            "requests_per_sec": round(len(self.latencies) / elapsed, 1) if elapsed else 0,
+            "p50_ms": round(percentile(self.latencies, 0.5) * 1000, 1),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 1),
+            "max_lag_seconds": round(self.max_lag, 1),
+        }
+
+
+def run_simulator(target="api", api="http://127.0.0.1:8000", concurrency=200, facility=SIM_FACILITY, **kwargs):
+    """Run one simulation to completion and return its summary."""
+    if facility != SIM_FACILITY and kwargs.get("speed", 60) != 1:
+        log.warning(f"⚠️ Simulating facility '{facility}' faster than real time: its usage logs, "
+                    "rollups and ETA estimates will record compressed session lengths.",
+                    extra={"event": "simulator.real_facility", "facility": facility})
+
+    async def main():
+        driver = ApiDriver(api, concurrency, facility) if target == "api" else StoreDriver(facility)
+        return await GymSimulation(driver, concurrency=concurrency, **kwargs).run()
+    return asyncio.run(main())
+
+
+def start_background_simulator(**kwargs):
+    """Launch a real-time simulation of the current evening in a background thread."""
+    kwargs.setdefault("speed", 1)
+    kwargs.setdefault("members", 300)
+    t = threading.Thread(target=run_simulator, kwargs=kwargs, daemon=True)
     t.start()
-    print("🚀 Gym simulator started in background.")
+    log.info("🚀 Gym simulator started in background.")
+    return t
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discrete-event gym load generator")
+    parser.add_argument("--target", choices=["api", "store"], default="api")
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--facility", default=SIM_FACILITY, help="facility to simulate")
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--peak-arrivals", type=float, default=None, help="gym visits per hour at peak")
+    parser.add_argument("--start", default=None, help="simulated start time of day, HH:MM (default now)")
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--speed", type=float, default=60, help="simulated seconds per real second, 0 = max")
+    parser.add_argument("--rate", type=float, default=0, help="max requests/sec, 0 = unlimited")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    from log_config import setup_logging
+    setup_logging(fmt="text")
+
+    start = None
+    if args.start:
+        hour, minute = map(int, args.start.split(":"))
+        start = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    summary = run_simulator(
+        target=args.target, api=args.api, concurrency=args.concurrency, facility=args.facility, members=args.members,
+        peak_arrivals=args.peak_arrivals, start=start, hours=args.hours, speed=args.speed,
+        rate=args.rate, seed=args.seed,
+    )
+    log.info("🎉 Simulation complete:", extra={"event": "simulator.summary", **summary})
+    for key, value in summary.items():
+        log.info(f"   {key}: {value}")
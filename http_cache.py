@@ -0,0 +1,22 @@
+from fastapi import Request, Response
+
+# =====================================================
+# Conditional GET helpers
+# =====================================================
+# Versioned resources send an ETag; a client that sends it back in
+# If-None-Match gets an empty 304 while the version has not moved.
+
+
+def etag(*parts):
+    return '"' + "-".join(str(p) for p in parts) + '"'
+
+
+def not_modified(request: Request, tag):
+    """304 response if the request's If-None-Match covers `tag`, else None."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    candidates = {c.strip().removeprefix("W/") for c in header.split(",")}
+    if tag in candidates or "*" in candidates:
+        return Response(status_code=304, headers={"ETag": tag})
+    return None
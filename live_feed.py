@@ -0,0 +1,99 @@
+import asyncio
+import threading
+from occupancy import get_index, with_utilization
+from storage import DEFAULT_FACILITY
+
+# =====================================================
+# Live Change Feed
+# =====================================================
+# One subscription on the occupancy index feeds every connected SSE and
+# WebSocket client. Changes are coalesced for FLUSH_DELAY seconds so a burst of
+# check-ins turns into a single message carrying only the zones and equipment
+# that actually changed.
+
+FLUSH_DELAY = 0.2  # seconds
+QUEUE_SIZE = 100
+
+
+class LiveFeed:
+    def __init__(self, index):
+        self.index = index
+        self._loop = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._pending = {}
+        self._flush_scheduled = False
+
+    def snapshot(self):
+        """Full state message sent to a client when it first connects."""
+        return {
+            "type": "snapshot",
+            "zones": with_utilization(self.index.zone_counts(by="zone")),
+            "equipment": self.index.equipments(),
+        }
+
+    # -------------------- subscribers --------------------
+    def subscribe(self):
+        """Register a subscriber queue; must be called from the event loop."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self.index.subscribe(self._on_change)
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    # -------------------- upstream --------------------
+    def _on_change(self, equipment_id, old, new):
+        """Runs on whichever thread changed the index; hands off to the loop."""
+        with self._lock:
+            first = self._pending.get(equipment_id, (old, None))[0]
+            self._pending[equipment_id] = (first, new)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._loop.call_soon_threadsafe(self._loop.call_later, FLUSH_DELAY, self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flush_scheduled = False
+
+        zones, equipment, removed = set(), [], []
+        for equipment_id, (old, new) in pending.items():
+            for doc in (old, new):
+                if doc is not None:
+                    zones.add(doc.get("zone") or "unknown")
+            if new is None:
+                removed.append(equipment_id)
+            else:
+                equipment.append(new)
+
+        message = {
+            "type": "update",
+            "zones": with_utilization(self.index.zone_counts(by="zone", zones=zones)),
+            "equipment": equipment,
+            "removed": removed,
+        }
+        for queue in list(self._subscribers):
+            if queue.full():
+                # A client this far behind gets a fresh snapshot instead of a backlog.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.snapshot())
+            else:
+                queue.put_nowait(message)
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def get_feed(facility=DEFAULT_FACILITY):
+    with _feeds_lock:
+        feed = _feeds.get(facility)
+        if feed is None:
+            feed = _feeds[facility] = LiveFeed(get_index(facility))
+    return feed
@@ -0,0 +1,151 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+
+# =====================================================
+# Structured Logging
+# =====================================================
+# setup_logging() gives the root logger a single QueueHandler, so a log call
+# on the request path resolves its message and enqueues the record; a
+# QueueListener thread does the formatting and the stderr writes. The API logs
+# one JSON object per line; scripts pass fmt="text" and keep their plain
+# one-line messages (UREC_LOG_FORMAT overrides either).
+#
+# Every record carries the id of the request it was logged under, taken from
+# X-Request-ID or generated by RequestIdMiddleware and echoed back. Records
+# whose extras name an `event` listed in SAMPLE_RATES are kept at that rate
+# and tagged with sample_rate; ERROR and above are never sampled.
+# UREC_LOG_SAMPLE="event=rate,..." overrides the rates.
+#
+#   log = logging.getLogger(__name__)
+#   log.info("checked in", extra={"event": "checkin", "zone": zone, "user": user})
+
+LOG_LEVEL = os.getenv("UREC_LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("UREC_LOG_FORMAT")  # json | text
+SAMPLE_RATES = {
+    "usage_log.update": 0.1,
+    "usage_log.rejected": 0.1,
+    "auth.missing_token": 0.01,
+    "simulator.error": 0.01,
+}
+SAMPLE_RATES.update(
+    (event, float(rate))
+    for event, rate in (item.split("=") for item in os.getenv("UREC_LOG_SAMPLE", "").split(",") if item)
+)
+
+# Chatty at INFO (httpx logs every request the simulator and benchmarks make).
+QUIET_LOGGERS = ("httpx", "httpcore")
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class _ContextFilter(logging.Filter):
+    """Stamps the request id and applies event sampling, on the thread that logs."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        rate = SAMPLE_RATES.get(getattr(record, "event", None))
+        if rate is not None and rate < 1 and record.levelno < logging.ERROR:
+            if random.random() >= rate:
+                return False
+            record.sample_rate = rate
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Resolve args and tracebacks now, while they are still valid; the
+        # listener only serializes.
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(fmt="json", level=None):
+    """Route the root logger through a queue to stderr; later calls are no-ops."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter() if (LOG_FORMAT or fmt) == "json" else logging.Formatter("%(message)s"))
+        records = queue.SimpleQueue()
+        queue_handler = _QueueHandler(records)
+        queue_handler.addFilter(_ContextFilter())
+        root = logging.getLogger()
+        root.handlers[:] = [queue_handler]
+        root.setLevel(level or LOG_LEVEL)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        _listener = logging.handlers.QueueListener(records, handler)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write out everything still queued."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class RequestIdMiddleware:
+    """Pure ASGI middleware: binds X-Request-ID (or a new id) for the request and echoes it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        rid = next((v.decode("latin-1")[:128] for k, v in scope["headers"] if k == b"x-request-id"), None) or uuid.uuid4().hex
+        token = request_id.set(rid)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
@@ -1,8 +1,41 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from routes import equipment, exercises, analytics
+from fastapi.concurrency import run_in_threadpool
+from routes import equipment, exercises, analytics, live, users, recommendations, waitlist, metrics as metrics_routes
 from fastapi.middleware.cors import CORSMiddleware
+from log_config import RequestIdMiddleware, setup_logging
+from metrics import MetricsMiddleware
+from catalog import get_catalog
+from occupancy import get_index
+from storage import FACILITIES, get_stores
+from usage_buffer import get_usage_buffer
 
-app = FastAPI(title="UREC Live API")
+
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing connects at import. Build the stores here, off the event loop,
+    # and open the request-path channel in the background while every
+    # facility's first equipment snapshot, the exercise catalog and the
+    # usage-log journal load; none of them depend on each other, so they run
+    # side by side.
+    stores = await run_in_threadpool(get_stores)
+    warm_up = asyncio.create_task(stores.warm_up())
+    *_, buffer = await asyncio.gather(
+        *(run_in_threadpool(get_index, facility) for facility in FACILITIES),
+        run_in_threadpool(get_catalog),
+        run_in_threadpool(get_usage_buffer),
+    )
+    yield
+    warm_up.cancel()
+    # Commit buffered usage logs before the process goes away.
+    await run_in_threadpool(buffer.close)
+
+
+app = FastAPI(title="UREC Live API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -11,10 +44,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last so they are outermost: metrics time the whole stack, CORS
+# included, and the request id is bound for all of it.
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
-app.include_router(equipment.router)
+# Facility-scoped routers answer under /facilities/{facility_id} and, for the
+# default facility, at their original paths.
+FACILITY_ROUTERS = (
+    equipment.router, analytics.router, live.router, users.router, recommendations.router, waitlist.router,
+)
+for router in FACILITY_ROUTERS:
+    app.include_router(router)
+    app.include_router(router, prefix="/facilities/{facility_id}")
 app.include_router(exercises.router)
-app.include_router(analytics.router)
+app.include_router(metrics_routes.router)
 
 @app.get("/")
 def root():
@@ -0,0 +1,275 @@
+import bisect
+import collections
+import contextvars
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from log_config import request_id
+
+# =====================================================
+# Request Metrics
+# =====================================================
+# MetricsMiddleware times every HTTP request and files it under its route
+# template (/checkin/{zone_name}, not /checkin/bench), together with the
+# document reads, writes, deletes and queries it caused. Those come from the
+# databases themselves: the local backends count in _LocalDatabase, and
+# instrument_firestore() wraps a Firestore client's RPC layer so every
+# get, query and commit is counted the way Firestore bills it (a query costs
+# at least one read). A context variable carries the current request's
+# counters down to the database, so work in threads started elsewhere (the
+# snapshot listener, the usage-log flusher) lands under "background".
+#
+# Requests slower than UREC_SLOW_REQUEST_MS (default 500) are logged and the
+# last SLOW_TRACES of them kept, with their op counts and request id so they
+# can be matched to the request's log lines. GET /metrics renders everything
+# in the Prometheus text format and GET /metrics/slow lists the slow traces.
+#
+# All updates happen on the event loop, so the per-route tables need no lock;
+# the background counters are updated from other threads and take one.
+
+OPS = ("reads", "writes", "deletes", "queries")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+SLOW_REQUEST_SECONDS = int(os.getenv("UREC_SLOW_REQUEST_MS", "500")) / 1000
+SLOW_TRACES = 100
+# Their "latency" is the connection's lifetime; never traced
+LONG_LIVED_ROUTES = {"/live/stream", "/facilities/{facility_id}/live/stream"}
+
+_OP_INDEX = {op: i for i, op in enumerate(OPS)}
+_request_ops = contextvars.ContextVar("request_ops", default=None)
+log = logging.getLogger(__name__)
+
+
+class RouteStats:
+    __slots__ = ("buckets", "total", "count", "statuses", "ops")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.statuses = collections.Counter()
+        self.ops = [0] * len(OPS)
+
+
+class Registry:
+    def __init__(self):
+        self.routes = {}
+        self.background = [0] * len(OPS)
+        self.slow = collections.deque(maxlen=SLOW_TRACES)
+        self._background_lock = threading.Lock()
+
+    def count(self, op, n=1):
+        """Add `n` database operations of kind `op` to the current request."""
+        ops = _request_ops.get()
+        if ops is not None:
+            ops[_OP_INDEX[op]] += n
+        else:
+            with self._background_lock:
+                self.background[_OP_INDEX[op]] += n
+
+    def observe(self, method, route, status, seconds, ops, path):
+        stats = self.routes.get((method, route))
+        if stats is None:
+            stats = self.routes[(method, route)] = RouteStats()
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        stats.total += seconds
+        stats.count += 1
+        stats.statuses[status] += 1
+        for i, n in enumerate(ops):
+            stats.ops[i] += n
+        if seconds >= SLOW_REQUEST_SECONDS and route not in LONG_LIVED_ROUTES:
+            trace = {
+                "at": datetime.utcnow().isoformat(),
+                "request_id": request_id.get(),
+                "method": method,
+                "route": route,
+                "path": path,
+                "status": status,
+                "ms": round(seconds * 1000, 1),
+                **dict(zip(OPS, ops)),
+            }
+            self.slow.append(trace)
+            log.warning("slow request: %s %s took %.0f ms", method, path, seconds * 1000,
+                        extra={"event": "http.slow", **{k: v for k, v in trace.items() if k not in ("at", "request_id")}})
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = [
+            "# HELP urec_http_request_duration_seconds HTTP request latency by route.",
+            "# TYPE urec_http_request_duration_seconds histogram",
+        ]
+        routes = sorted(self.routes.items())
+        for (method, route), stats in routes:
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), stats.buckets):
+                cumulative += n
+                lines.append(f'urec_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"urec_http_request_duration_seconds_sum{{{labels}}} {stats.total:.6f}")
+            lines.append(f"urec_http_request_duration_seconds_count{{{labels}}} {stats.count}")
+
+        lines += ["# HELP urec_http_requests_total HTTP responses by route and status.",
+                  "# TYPE urec_http_requests_total counter"]
+        for (method, route), stats in routes:
+            for status, n in sorted(stats.statuses.items()):
+                lines.append(f'urec_http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {n}')
+
+        lines += ["# HELP urec_db_operations_total Billed database operations by route (route=\"background\" outside requests).",
+                  "# TYPE urec_db_operations_total counter"]
+        for (method, route), stats in routes:
+            for op, n in zip(OPS, stats.ops):
+                lines.append(f'urec_db_operations_total{{method="{method}",route="{_escape(route)}",op="{op}"}} {n}')
+        with self._background_lock:
+            background = list(self.background)
+        for op, n in zip(OPS, background):
+            lines.append(f'urec_db_operations_total{{method="",route="background",op="{op}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+registry = Registry()
+count = registry.count
+
+
+# -------------------- HTTP --------------------
+class MetricsMiddleware:
+    """Pure ASGI middleware: one timer and one small counter list per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        ops = [0] * len(OPS)
+        token = _request_ops.set(ops)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_ops.reset(token)
+            route = scope.get("route")
+            registry.observe(
+                scope["method"], getattr(route, "path", "unmatched"), status,
+                time.perf_counter() - start, ops, scope["path"],
+            )
+
+
+# -------------------- Firestore --------------------
+# Firestore bills a read per document returned or looked up (missing ones
+# included), at least one per query, and a write per document written. The
+# wrappers below sit between the client library and its generated RPC client.
+# Snapshot listener reads are not counted.
+def _commit_ops(request):
+    writes = request["writes"] if isinstance(request, dict) else request.writes
+    deletes = sum(1 for w in writes if "delete" in w)
+    count("writes", len(writes) - deletes)
+    count("deletes", deletes)
+
+
+class _FirestoreApi:
+    def __init__(self, api):
+        self._api = api
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    def batch_get_documents(self, *args, **kwargs):
+        for response in self._api.batch_get_documents(*args, **kwargs):
+            count("reads")
+            yield response
+
+    def run_query(self, *args, **kwargs):
+        count("queries")
+        found = 0
+        for response in self._api.run_query(*args, **kwargs):
+            if "document" in response:
+                found += 1
+                count("reads")
+            yield response
+        if not found:
+            count("reads")
+
+    def run_aggregation_query(self, *args, **kwargs):
+        count("queries")
+        count("reads")
+        return self._api.run_aggregation_query(*args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        _commit_ops(kwargs.get("request", args[0] if args else None))
+        return self._api.commit(*args, **kwargs)
+
+    def batch_write(self, *args, **kwargs):
+        _commit_ops(kwargs.get("request", args[0] if args else None))
+        return self._api.batch_write(*args, **kwargs)
+
+
+class _AsyncFirestoreApi(_FirestoreApi):
+    async def batch_get_documents(self, *args, **kwargs):
+        return self._counted_reads(await self._api.batch_get_documents(*args, **kwargs))
+
+    async def run_query(self, *args, **kwargs):
+        count("queries")
+        return self._counted_query(await self._api.run_query(*args, **kwargs))
+
+    async def run_aggregation_query(self, *args, **kwargs):
+        count("queries")
+        count("reads")
+        return await self._api.run_aggregation_query(*args, **kwargs)
+
+    async def commit(self, *args, **kwargs):
+        _commit_ops(kwargs.get("request", args[0] if args else None))
+        return await self._api.commit(*args, **kwargs)
+
+    @staticmethod
+    async def _counted_reads(responses):
+        async for response in responses:
+            count("reads")
+            yield response
+
+    @staticmethod
+    async def _counted_query(responses):
+        found = 0
+        async for response in responses:
+            if "document" in response:
+                found += 1
+                count("reads")
+            yield response
+        if not found:
+            count("reads")
+
+
+def instrument_firestore(client):
+    """Count `client`'s billed operations (sync or async client); returns it.
+
+    The RPC client is wrapped when the library first builds it rather than
+    here: an async client's channel has to be created on the event loop that
+    will use it, and this may run on a worker thread.
+    """
+    build = client._firestore_api_helper
+    if getattr(build, "instrumented", False):
+        return client
+    wrapper = _AsyncFirestoreApi if type(client).__name__.startswith("Async") else _FirestoreApi
+
+    def build_counted(*args):
+        api = build(*args)
+        if not isinstance(api, _FirestoreApi):
+            api = client._firestore_api_internal = wrapper(api)
+        return api
+
+    build_counted.instrumented = True
+    client._firestore_api_helper = build_counted
+    return client
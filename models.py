@@ -1,4 +1,17 @@
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from typing import Annotated
+from pydantic import AfterValidator, BaseModel
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Stored times are naive UTC ISO strings; time bounds in requests may carry an
+# offset ("...Z", "+02:00") and are converted to match before any comparison.
+UtcDatetime = Annotated[datetime, AfterValidator(_naive_utc)]
 
 class Equipment(BaseModel):
     equipment_id: str
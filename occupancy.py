@@ -0,0 +1,259 @@
+import threading
+import uuid
+from fastapi.concurrency import run_in_threadpool
+from storage import DEFAULT_FACILITY, get_stores
+
+# =====================================================
+# Live Occupancy Index
+# =====================================================
+# Keeps a process-local copy of the "equipments" collection together with
+# per-zone in_use/available/total counters, so the heatmap and equipment list
+# can be served from memory instead of streaming the whole collection per
+# request. It follows the equipment store's change feed (a Firestore
+# on_snapshot listener, or in-process notifications for the local backends),
+# which also delivers this process's own writes as soon as they commit.
+#
+# Every effective change bumps `version`, and the index remembers the version
+# at which each equipment id and each zone last changed (removed ids included),
+# so readers can ask for just what moved since a version they already hold.
+# Clients see versions as "<epoch>-<version>" tokens (ETags and ?since=),
+# where the epoch is random per index: a token from another worker or from
+# before a restart never matches, and gets a full answer instead of a delta
+# against a history this index never had.
+#
+# Each facility has its own index, listener and counters.
+
+GROUP_FIELDS = ("zone", "equipment_type")
+FIRST_SNAPSHOT_TIMEOUT = 10  # seconds
+
+
+def with_utilization(zones, digits=1):
+    """Add utilization_percent to each zone's counters (in place)."""
+    for v in zones.values():
+        total = v["total"]
+        v["utilization_percent"] = round((v["in_use"] / total) * 100 if total else 0, digits)
+    return zones
+
+
+class OccupancyIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self.started = False
+        self._equipment = {}
+        self._counters = {field: {} for field in GROUP_FIELDS}
+        self._members = {}
+        self._subscribers = []
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        # id -> version of its last change, kept in version order
+        self._changed = {}
+        self._zone_changed = {field: {} for field in GROUP_FIELDS}
+
+    # -------------------- listener --------------------
+    def start(self, store):
+        """Watch the equipment store once; the first start waits for the first snapshot."""
+        with self._start_lock:
+            if self._watch is None:
+                self._watch = store.watch(self._on_changes)
+                self._ready.wait(FIRST_SNAPSHOT_TIMEOUT)
+            self.started = True
+
+    def stop(self):
+        with self._start_lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+                self._watch = None
+            self.started = False
+        self._ready.clear()
+
+    def _on_changes(self, changes):
+        for equipment_id, data in changes:
+            if data is None:
+                self.remove(equipment_id)
+            else:
+                self.apply(equipment_id, data)
+        self._ready.set()
+
+    # -------------------- updates --------------------
+    def apply(self, equipment_id, data):
+        """Insert or replace one equipment document and adjust the zone counters."""
+        data = dict(data)
+        with self._lock:
+            old = self._equipment.get(equipment_id)
+            if old == data:
+                return
+            if old is not None:
+                self._count(equipment_id, old, -1)
+            self._equipment[equipment_id] = data
+            self._count(equipment_id, data, +1)
+            self._bump(equipment_id, old, data)
+        self._notify(equipment_id, old, data)
+
+    def remove(self, equipment_id):
+        with self._lock:
+            old = self._equipment.pop(equipment_id, None)
+            if old is None:
+                return
+            self._count(equipment_id, old, -1)
+            self._bump(equipment_id, old, None)
+        self._notify(equipment_id, old, None)
+
+    def _count(self, equipment_id, data, sign):
+        zone = data.get("zone") or "unknown"
+        members = self._members.setdefault(zone, set())
+        if sign > 0:
+            members.add(equipment_id)
+        else:
+            members.discard(equipment_id)
+            if not members:
+                del self._members[zone]
+
+        in_use = data.get("status", "available") == "in_use"
+        for field in GROUP_FIELDS:
+            key = data.get(field) or "unknown"
+            stats = self._counters[field].setdefault(key, {"in_use": 0, "available": 0, "total": 0})
+            stats["total"] += sign
+            stats["in_use" if in_use else "available"] += sign
+            if stats["total"] == 0:
+                del self._counters[field][key]
+
+    def _bump(self, equipment_id, old, new):
+        self.version += 1
+        self._changed.pop(equipment_id, None)
+        self._changed[equipment_id] = self.version
+        for field in GROUP_FIELDS:
+            changed = self._zone_changed[field]
+            for doc in (old, new):
+                if doc is not None:
+                    key = doc.get(field) or "unknown"
+                    changed.pop(key, None)
+                    changed[key] = self.version
+
+    @staticmethod
+    def _since(changed, version):
+        """Keys of a version-ordered {key: version} dict changed after `version`."""
+        keys = []
+        for key in reversed(changed):
+            if changed[key] <= version:
+                break
+            keys.append(key)
+        return keys
+
+    def token(self, version=None):
+        """The client-facing token for `version` (default: the current one)."""
+        return f"{self.epoch}-{self.version if version is None else version}"
+
+    def _parse(self, token):
+        """The version a token of this index stands for, else None."""
+        epoch, _, version = (token or "").rpartition("-")
+        if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+            return None
+        return int(version)
+
+    # -------------------- change feed --------------------
+    def subscribe(self, callback):
+        """Call `callback(equipment_id, old, new)` after every effective change.
+
+        Callbacks run on the thread that applied the change (the Firestore
+        listener thread or a request worker) and must not block.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _notify(self, equipment_id, old, new):
+        for callback in list(self._subscribers):
+            callback(equipment_id, old, new)
+
+    # -------------------- reads --------------------
+    def get(self, equipment_id):
+        with self._lock:
+            data = self._equipment.get(equipment_id)
+            return dict(data) if data is not None else None
+
+    def equipments(self):
+        """All equipment documents, ordered by document id like a Firestore stream."""
+        return self.versioned_equipments()[1]
+
+    def versioned_equipments(self):
+        """(version token, equipments()) read atomically."""
+        with self._lock:
+            return self.token(), [dict(self._equipment[k]) for k in sorted(self._equipment)]
+
+    def equipment_changes(self, since):
+        """(version token, changed documents, removed ids) after the token `since`.
+
+        Returns None when `since` is not a token this index can answer from
+        (from another process or before a restart); send everything then.
+        """
+        with self._lock:
+            since = self._parse(since)
+            if since is None:
+                return None
+            changed, removed = [], []
+            for equipment_id in sorted(self._since(self._changed, since)):
+                data = self._equipment.get(equipment_id)
+                if data is None:
+                    removed.append(equipment_id)
+                else:
+                    changed.append(dict(data))
+            return self.token(), changed, removed
+
+    def units(self, zone):
+        """Equipment documents whose `zone` field is `zone`."""
+        with self._lock:
+            return [dict(self._equipment[i]) for i in self._members.get(zone, ()) if i in self._equipment]
+
+    def zone_counts(self, by="zone", zones=None):
+        """Per-zone {in_use, available, total} counters grouped by `by`.
+
+        Pass `zones` to read only those keys; zones that no longer have any
+        equipment come back with zeroed counters.
+        """
+        return self.versioned_zone_counts(by, zones)[1]
+
+    def versioned_zone_counts(self, by="zone", zones=None, since=None):
+        """(version token, counters, is_delta) read atomically.
+
+        With a `since` token this index can answer from, only zones whose
+        counters changed after it are returned and is_delta is True.
+        """
+        with self._lock:
+            counters = self._counters[by]
+            since = self._parse(since)
+            delta = since is not None
+            if delta:
+                zones = self._since(self._zone_changed[by], since)
+            if zones is None:
+                return self.token(), {zone: dict(stats) for zone, stats in counters.items()}, False
+            empty = {"in_use": 0, "available": 0, "total": 0}
+            return self.token(), {zone: dict(counters.get(zone, empty)) for zone in zones}, delta
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(facility=DEFAULT_FACILITY):
+    """Shared index for `facility` in this process, started on first use."""
+    with _indexes_lock:
+        index = _indexes.get(facility)
+        if index is None:
+            index = _indexes[facility] = OccupancyIndex()
+    index.start(get_stores(facility).equipments)
+    return index
+
+
+async def start_index(facility=DEFAULT_FACILITY):
+    """get_index() for the event loop: a first start waits for its snapshot in a worker thread."""
+    index = _indexes.get(facility)
+    if index is None or not index.started:
+        index = await run_in_threadpool(get_index, facility)
+    return index
@@ -0,0 +1,99 @@
+import asyncio
+import itertools
+import threading
+import time
+from catalog import get_catalog
+from eta import RESULT_TTL, get_engine
+from occupancy import get_index, with_utilization
+from storage import DEFAULT_FACILITY, get_stores
+
+# =====================================================
+# Workout Recommendations
+# =====================================================
+# Ranks a muscle group's exercises by predicted wait, then utilization, using
+# a muscle -> exercise -> zone index built from the exercise catalog and
+# rebuilt when the catalog's version moves. A group's ranking is computed once
+# per occupancy version (and at most every RESULT_TTL seconds, since waits move
+# with elapsed time) and shared by every user who asks for that group;
+# per-user filtering walks the shared list.
+
+
+class Recommender:
+    def __init__(self, index, engine, stores, catalog):
+        self.index = index
+        self.engine = engine
+        self.stores = stores
+        self.catalog = catalog
+        self._groups = (None, {})
+        self._rankings = {}
+
+    def groups(self):
+        """{lowercased group: (group name, [(exercise, zone), ...])}."""
+        version = self.catalog.version
+        if self._groups[0] != version:
+            groups = {
+                name.lower(): (name, [(ex["exercise_name"], (ex["equipment_type"] or "").lower()) for ex in exercises])
+                for name, exercises in self.catalog.groups().items()
+            }
+            self._groups = (version, groups)
+            self._rankings = {}
+        return self._groups[1]
+
+    async def ranking(self, group):
+        """(group name, every exercise ranked), or None for an unknown group."""
+        entry = self.groups().get(group.lower())
+        if entry is None:
+            return None
+        version, now = self.index.version, time.monotonic()
+        cached = self._rankings.get(group.lower())
+        if cached and cached[0] == version and now - cached[1] < RESULT_TTL:
+            return entry[0], cached[2]
+
+        name, exercises = entry
+        zones = sorted({zone for _, zone in exercises})
+        counts = with_utilization(self.index.zone_counts(zones=zones))
+        etas = dict(zip(zones, await asyncio.gather(*(self.engine.zone_eta(z) for z in zones))))
+        ranked = [
+            {
+                "exercise": exercise,
+                "zone": zone,
+                "eta_minutes": etas[zone]["eta_minutes"],
+                "available": counts[zone]["available"],
+                "utilization_percent": counts[zone]["utilization_percent"],
+            }
+            for exercise, zone in exercises
+        ]
+        # Zones with no equipment at all go last rather than looking free.
+        ranked.sort(key=lambda r: (not counts[r["zone"]]["total"], r["eta_minutes"], r["utilization_percent"]))
+        self._rankings[group.lower()] = (version, now, ranked)
+        return name, ranked
+
+    async def recommend(self, group, user=None, k=None, current_zone=None):
+        """Top `k` picks for `group`, skipping `current_zone`, else the zone `user` is checked into.
+
+        Clients that already know their zone should pass it: looking it up
+        costs a session read per call.
+        """
+        result = await self.ranking(group)
+        if result is None:
+            return None
+        name, ranked = result
+        current = current_zone
+        if current is None and user:
+            session = await self.stores.equipments.active_session(user)
+            current = session and session.get("zone")
+        return name, list(itertools.islice((r for r in ranked if r["zone"] != current), k))
+
+
+_recommenders = {}
+_recommenders_lock = threading.Lock()
+
+
+def get_recommender(facility=DEFAULT_FACILITY):
+    with _recommenders_lock:
+        recommender = _recommenders.get(facility)
+        if recommender is None:
+            recommender = _recommenders[facility] = Recommender(
+                get_index(facility), get_engine(facility), get_stores(facility), get_catalog(),
+            )
+    return recommender
@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta
+from storage.base import MAX_APPLY_INCREMENTS
+
+# =====================================================
+# Usage Rollups
+# =====================================================
+# Each usage log is folded into fixed time buckets as it is written, so trend
+# charts read O(buckets) documents instead of scanning every log. Buckets exist
+# for the whole gym, each zone and each piece of equipment, at three
+# granularities. A bucket stores
+#   sessions      sessions that started in the bucket
+#   busy_minutes  minutes of use overlapping the bucket
+#   durations     {minutes: count} histogram of those sessions' lengths
+# and the p50/p90 durations are read off the histogram.
+
+GRANULARITIES = {
+    "5min": timedelta(minutes=5),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+SCOPES = ("gym", "zone", "equipment")
+
+
+def bucket_start(ts, granularity):
+    step = int(GRANULARITIES[granularity].total_seconds())
+    midnight = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = int((ts - midnight).total_seconds()) // step * step
+    return midnight + timedelta(seconds=offset)
+
+
+def log_interval(log):
+    """(start, end, duration_minutes) for a usage log, or None if it has no times."""
+    duration = log.get("duration", log.get("duration_mins"))
+    start = datetime.fromisoformat(log["start_time"]) if log.get("start_time") else None
+    end = datetime.fromisoformat(log["end_time"]) if log.get("end_time") else None
+    if start is None and end is None:
+        return None
+    if duration is None:
+        duration = int(((end or start) - (start or end)).total_seconds() // 60)
+    start = start or end - timedelta(minutes=duration)
+    end = end or start + timedelta(minutes=duration)
+    return start, end, int(duration)
+
+
+def _contributions(log):
+    """(granularity, bucket_iso, sessions, busy_minutes, duration or None, keys) per bucket a log touches."""
+    interval = log_interval(log)
+    if interval is None:
+        return
+    start, end, duration = interval
+    keys = [("gym", "all"), ("zone", log.get("zone") or "unknown")]
+    if log.get("equipment_id"):
+        keys.append(("equipment", log["equipment_id"]))
+
+    for granularity, step in GRANULARITIES.items():
+        first = bucket_start(start, granularity)
+        bucket = first
+        while bucket < end or bucket == first:
+            overlap = (min(end, bucket + step) - max(start, bucket)).total_seconds() / 60
+            is_first = bucket == first
+            yield granularity, bucket.isoformat(), int(is_first), max(overlap, 0), duration if is_first else None, keys
+            bucket += step
+
+
+def _increment(granularity, scope, key, bucket, sessions, busy_minutes, durations):
+    return {
+        "id": f"{granularity}_{scope}_{key}_{bucket}",
+        "granularity": granularity,
+        "scope": scope,
+        "key": key,
+        "bucket_start": bucket,
+        "sessions": sessions,
+        "busy_minutes": round(busy_minutes, 2),
+        "durations": durations,
+    }
+
+
+def increments_for_log(log):
+    """Bucket increments one usage log contributes, across every scope and granularity."""
+    return [
+        _increment(granularity, scope, key, bucket, sessions, busy, {str(duration): 1} if duration is not None else {})
+        for granularity, bucket, sessions, busy, duration, keys in _contributions(log)
+        for scope, key in keys
+    ]
+
+
+def increments_for_logs(logs):
+    """Increments for a batch of logs, collapsed so each touched bucket appears once."""
+    merged = {}
+    for log in logs:
+        for granularity, bucket, sessions, busy, duration, keys in _contributions(log):
+            for scope, key in keys:
+                acc = merged.get((granularity, scope, key, bucket))
+                if acc is None:
+                    acc = merged[(granularity, scope, key, bucket)] = [0, 0.0, {}]
+                acc[0] += sessions
+                acc[1] += busy
+                if duration is not None:
+                    minutes = str(duration)
+                    acc[2][minutes] = acc[2].get(minutes, 0) + 1
+    return [_increment(*bucket_key, *acc) for bucket_key, acc in merged.items()]
+
+
+def percentile(histogram, q):
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for minutes in sorted(histogram, key=int):
+        seen += histogram[minutes]
+        if seen >= q * total:
+            return int(minutes)
+
+
+def summarize(bucket, capacity=None):
+    """API view of one stored bucket; `capacity` is the number of units in scope."""
+    durations = bucket.get("durations", {})
+    summary = {
+        "bucket_start": bucket["bucket_start"],
+        "sessions": bucket.get("sessions", 0),
+        "busy_minutes": round(bucket.get("busy_minutes", 0), 1),
+        "p50_duration": percentile(durations, 0.5),
+        "p90_duration": percentile(durations, 0.9),
+    }
+    if capacity:
+        minutes = GRANULARITIES[bucket["granularity"]].total_seconds() / 60
+        summary["utilization_percent"] = round(min(100, summary["busy_minutes"] / (minutes * capacity) * 100), 1)
+    return summary
+
+
+async def series(stores, granularity, scope, key, start, end, capacity=None):
+    """Summaries for every bucket in [start, end), zero-filling the quiet ones."""
+    step = GRANULARITIES[granularity]
+    first = bucket_start(start, granularity)
+    buckets = await stores.rollups.query(granularity, scope, key, first.isoformat(), end.isoformat())
+    stored = {b["bucket_start"]: b for b in buckets}
+    result = []
+    bucket = first
+    while bucket < end:
+        data = stored.get(bucket.isoformat()) or {"granularity": granularity, "bucket_start": bucket.isoformat()}
+        result.append(summarize(data, capacity))
+        bucket += step
+    return result
+
+
+async def record(stores, log):
+    """Fold one freshly written usage log into the rollup buckets."""
+    await stores.rollups.apply(increments_for_log(log))
+
+
+def record_many(stores, logs, progress=None):
+    """Fold a batch of usage logs in, writing each touched bucket once."""
+    stores.rollups.apply_many(increments_for_logs(logs), progress)
+
+
+def record_once(stores, batch_id, logs):
+    """record_many() that a retry with the same `batch_id` and logs won't count twice.
+
+    The increments go out in chunks of MAX_APPLY_INCREMENTS, each marked as
+    "<batch_id>.<n>"; only a batch that fits in one chunk is all-or-nothing.
+    """
+    increments = increments_for_logs(logs)
+    for n in range(0, max(len(increments), 1), MAX_APPLY_INCREMENTS):
+        stores.rollups.apply_once(f"{batch_id}.{n // MAX_APPLY_INCREMENTS}", increments[n:n + MAX_APPLY_INCREMENTS])
+
+
+def recorded(stores, batch_id):
+    """Whether record_once() has committed (the first chunk of) `batch_id`."""
+    return stores.rollups.applied(f"{batch_id}.0")
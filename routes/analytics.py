@@ -1,35 +1,99 @@
-from fastapi import APIRouter
-from firebase_admin import firestore
+from datetime import datetime
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from eta import get_engine
+import export_usage_logs
+from facilities import facility_id
+from models import UtcDatetime
+from occupancy import get_index, with_utilization
+from storage import get_stores
+import rollups
 
 router = APIRouter(prefix="/analytics", tags=["Analytics"])
-db = firestore.client()
 
-@router.get("/heatmap")
-def get_heatmap():
+# /analytics/heatmap itself (zones) is served by the equipment router.
+@router.get("/heatmap/equipment_types")
+async def get_equipment_type_heatmap(facility: str = Depends(facility_id)):
     """
-    Returns a simple utilization summary per equipment type.
+    Returns a simple utilization summary per equipment type,
+    served from the in-memory occupancy index.
     """
-    equipments_ref = db.collection("equipments").stream()
-    zone_stats = {}
+    return {"equipment_types": with_utilization(get_index(facility).zone_counts(by="equipment_type"), digits=2)}
 
-    for doc in equipments_ref:
-        data = doc.to_dict()
-        zone = data.get("equipment_type", "unknown")
-        status = data.get("status", "available")
+MAX_HISTORY_BUCKETS = 2000
 
-        if zone not in zone_stats:
-            zone_stats[zone] = {"in_use": 0, "available": 0, "total": 0}
 
-        zone_stats[zone]["total"] += 1
-        if status == "in_use":
-            zone_stats[zone]["in_use"] += 1
-        else:
-            zone_stats[zone]["available"] += 1
+@router.get("/history")
+async def get_history(
+    zone: str | None = None,
+    equipment_id: str | None = None,
+    start: UtcDatetime | None = Query(None, alias="from"),
+    end: UtcDatetime | None = Query(None, alias="to"),
+    granularity: str = "hour",
+    facility: str = Depends(facility_id),
+):
+    """
+    Usage trend from the pre-aggregated rollup buckets, for the whole gym,
+    one zone or one piece of equipment. Defaults to the last 24 buckets.
+    """
+    if granularity not in rollups.GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {list(rollups.GRANULARITIES)}")
+
+    step = rollups.GRANULARITIES[granularity]
+    end = end or datetime.utcnow()
+    start = start or end - 24 * step
+    if (end - start) / step > MAX_HISTORY_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range spans more than {MAX_HISTORY_BUCKETS} buckets")
+
+    zones = get_index(facility).zone_counts(by="zone")
+    if equipment_id:
+        scope, key, capacity = "equipment", equipment_id, 1
+    elif zone:
+        scope, key, capacity = "zone", zone, zones.get(zone, {}).get("total")
+    else:
+        scope, key, capacity = "gym", "all", sum(v["total"] for v in zones.values())
 
-    # Calculate utilization percentage
-    for z, v in zone_stats.items():
-        total = v["total"]
-        in_use = v["in_use"]
-        v["utilization_percent"] = round((in_use / total) * 100, 2) if total > 0 else 0
+    buckets = await rollups.series(get_stores(facility), granularity, scope, key, start, end, capacity)
+    return {"scope": scope, "key": key, "granularity": granularity, "buckets": buckets}
 
-    return {"zones": zone_stats}
+
+@router.get("/eta")
+async def get_eta(facility: str = Depends(facility_id)):
+    """
+    Predicted wait per zone in one batch: 0 when a unit is free, otherwise the
+    expected minutes until the first in-use unit frees up.
+    """
+    return {"zones": await get_engine(facility).all_etas()}
+
+
+EXPORT_MEDIA_TYPES = {"arrow": "application/vnd.apache.arrow.stream", "parquet": "application/vnd.apache.parquet"}
+
+
+@router.get("/export")
+async def export_usage(
+    since: UtcDatetime | None = None,
+    until: UtcDatetime | None = None,
+    format: Literal["arrow", "parquet"] = "arrow",
+    facility: str = Depends(facility_id),
+):
+    """
+    Usage logs with since <= ingested_at < until as one Arrow IPC stream or
+    Parquet file, streamed a page at a time (without `since`, every log that
+    ended before `until`). `until` defaults to a few minutes ago;
+    X-Export-Watermark is the `since` for the next call.
+    """
+    try:
+        export_usage_logs.require_pyarrow()
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    since = since and since.isoformat()
+    until = until.isoformat() if until else export_usage_logs.default_until()
+    return StreamingResponse(
+        export_usage_logs.stream(get_stores(facility), since, until, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={
+            "X-Export-Watermark": until,
+            "Content-Disposition": f'attachment; filename="usage_logs.{facility}.{format}"',
+        },
+    )
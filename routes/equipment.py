@@ -1,149 +1,255 @@
-from fastapi import APIRouter, HTTPException
-from firebase_config import db
-from models import Equipment
-from datetime import datetime
+import base64
+import json
+import logging
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from auth import verified_user
+from facilities import facility_id
+from models import Equipment, UtcDatetime
+from eta import get_engine
+from http_cache import etag, not_modified
+from occupancy import get_index, with_utilization
+from storage import (
+    AlreadyCheckedIn, EquipmentNotFound, NoAvailableEquipment, NotCheckedIn, get_stores,
+)
+from usage_buffer import get_usage_buffer
+from waitlist import get_waitlist
 
 router = APIRouter()
+log = logging.getLogger(__name__)
 
 # =====================================================
 # 1. Get all equipment
 # =====================================================
+# Sends an ETag of the occupancy version token, so an unchanged fleet costs a
+# 304. With ?since=<version> only the units that changed after that version
+# come back: {"version", "full", "changed", "removed"}; "full" is true when the
+# version was unknown (another worker's, or from before a restart) and
+# "changed" holds everything.
 @router.get("/equipments")
-def get_all_equipment():
-    docs = db.collection("equipments").stream()
-    return [doc.to_dict() for doc in docs]
+async def get_all_equipment(request: Request, response: Response, since: str | None = None,
+                            facility: str = Depends(facility_id)):
+    index = get_index(facility)
+    cached = not_modified(request, etag(index.token()))
+    if cached:
+        return cached
+
+    delta = index.equipment_changes(since) if since is not None else None
+    if delta:
+        version, changed, removed = delta
+        body = {"version": version, "full": False, "changed": changed, "removed": removed}
+    else:
+        version, equipments = index.versioned_equipments()
+        body = equipments if since is None else {"version": version, "full": True, "changed": equipments, "removed": []}
+    response.headers["ETag"] = etag(version)
+    return body
 
 # =====================================================
 # 2. Add new equipment
 # =====================================================
 @router.post("/equipments")
-def add_equipment(equipment: Equipment):
-    db.collection("equipments").document(equipment.equipment_id).set(equipment.dict())
+async def add_equipment(equipment: Equipment, facility: str = Depends(facility_id)):
+    await get_stores(facility).equipments.put(equipment.equipment_id, equipment.dict())
     return {"message": "Equipment added successfully", "equipment_id": equipment.equipment_id}
 
 # =====================================================
 # 3. Update equipment
 # =====================================================
 @router.patch("/equipments/{equipment_id}")
-def update_equipment(equipment_id: str, data: dict):
-    doc_ref = db.collection("equipments").document(equipment_id)
-    if not doc_ref.get().exists:
+async def update_equipment(equipment_id: str, data: dict, facility: str = Depends(facility_id)):
+    try:
+        await get_stores(facility).equipments.update(equipment_id, data)
+    except EquipmentNotFound:
         raise HTTPException(status_code=404, detail="Equipment not found")
-    doc_ref.update(data)
     return {"message": f"Equipment {equipment_id} updated", "updated_fields": data}
 
 # =====================================================
 # 4. Check In
 # =====================================================
+# The store claims the unit and records active_sessions/{user} atomically,
+# retrying on contention, so concurrent check-ins never share a unit. With a
+# bearer token the caller is the token's Firebase uid, whatever `user` says.
+# Units held for the zone's waitlist (see waitlist.py) only go to the user
+# they're held for; everyone else gets the same 404 as for a full zone, and
+# should join the waitlist rather than retry.
 @router.post("/checkin/{zone_name}")
-def check_in(zone_name: str, user: str = "demo_user"):
-    active_ref = db.collection("equipments").where("current_user", "==", user).where("status", "==", "in_use").stream()
-    for d in active_ref:
-        existing = d.to_dict()
-        raise HTTPException(
-            status_code=400,
-            detail=f"User '{user}' already checked into {existing.get('zone')} ({existing.get('equipment_id')})"
-        )
-
-    docs = db.collection("equipments").where("zone", "==", zone_name).where("status", "==", "available").stream()
-    target = next(docs, None)
-    if not target:
-        raise HTTPException(status_code=404, detail=f"No available equipment found in '{zone_name}'")
-
-    doc_ref = db.collection("equipments").document(target.id)
-    start_time = datetime.utcnow().isoformat()
-    doc_ref.update({"status": "in_use", "current_user": user, "start_time": start_time})
-
-    return {"message": f"{target.id} checked in under {zone_name} by {user}", "start_time": start_time}
+async def check_in(zone_name: str, user: str = "demo_user", caller: str | None = Depends(verified_user),
+                   facility: str = Depends(facility_id)):
+    user = caller or user
+    waitlist = get_waitlist(facility)
+    try:
+        if not waitlist.admit(zone_name, user):
+            raise NoAvailableEquipment(zone_name)
+        equipment_id, data = await get_stores(facility).equipments.check_in(zone_name, user)
+    except AlreadyCheckedIn as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NoAvailableEquipment as e:
+        raise HTTPException(status_code=404, detail=f"{e}; join the waitlist at /waitlist/{zone_name}")
+    waitlist.claimed(zone_name, user)
+    return {
+        "message": f"{equipment_id} checked in under {zone_name} by {user}",
+        "equipment_id": equipment_id,
+        "start_time": data["start_time"],
+    }
 
 # =====================================================
 # 5. Check Out
 # =====================================================
+# Only the equipment update is on the request path; the usage log and its
+# rollups are journaled locally and written in batches (see usage_buffer.py).
+# The freed unit is offered to the head of the zone's waitlist.
 @router.post("/checkout/{zone_name}")
-def check_out(zone_name: str, user: str):
-    # The query now also checks for the correct user
-    docs = db.collection("equipments").where("zone", "==", zone_name).where("status", "==", "in_use").where("current_user", "==", user).stream()
-    target = next(docs, None)
-    if not target:
-        # More specific error message
-        raise HTTPException(status_code=404, detail=f"User '{user}' not found in any in-use equipment in '{zone_name}'")
-
-    data = target.to_dict()
-    doc_ref = db.collection("equipments").document(target.id)
-    start_time = datetime.fromisoformat(data.get("start_time")) if data.get("start_time") else datetime.utcnow()
-    duration = (datetime.utcnow() - start_time).seconds // 60
-
-    db.collection("usage_logs").add({
-        "equipment_id": target.id,
-        "zone": zone_name,
-        "user": data.get("current_user", ""),
-        "start_time": data.get("start_time"),
-        "end_time": datetime.utcnow().isoformat(),
-        "duration": duration
-    })
-
-    doc_ref.update({"status": "available", "current_user": "", "start_time": ""})
-    return {"message": f"{target.id} checked out from {zone_name}, duration {duration} mins"}
+async def check_out(zone_name: str, user: str | None = None, caller: str | None = Depends(verified_user),
+                    facility: str = Depends(facility_id)):
+    user = caller or user
+    if not user:
+        raise HTTPException(status_code=422, detail="Missing 'user'")
+    try:
+        equipment_id, _, log = await get_stores(facility).equipments.check_out(zone_name, user)
+    except NotCheckedIn as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    get_waitlist(facility).released(zone_name, equipment_id)
+    await run_in_threadpool(get_usage_buffer().append, log, facility)
+    get_engine(facility).observe(log)
+    return {"message": f"{equipment_id} checked out from {zone_name}, duration {log['duration']} mins"}
 
 # =====================================================
 # 6. Get Usage Logs
 # =====================================================
+# Newest first, a page at a time: send next_cursor back as ?cursor= for the
+# next page. Filters are user, zone and an end_time range (start <= end_time
+# < end). format=ndjson streams every matching log as one JSON object per
+# line, fetching `limit` at a time, so memory stays flat however long the
+# history is. Logs still waiting in the write-behind buffer aren't in the
+# store yet; they are merged into every page in the same (end_time, id)
+# order, so a cursor carries on across both.
+MAX_PAGE = 500
+
+
+def _encode_cursor(end_time, log_id):
+    return base64.urlsafe_b64encode(json.dumps([end_time, log_id]).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        end_time, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return end_time, log_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _key(row):
+    return (row[1].get("end_time") or "", row[0])
+
+
+def _merge(pending, page):
+    """Buffered rows and a store page in one newest-first list; a log already flushed is listed once."""
+    stored = {log_id for log_id, _ in page}
+    return sorted(page + [row for row in pending if row[0] not in stored], key=_key, reverse=True)
+
+
+def _ndjson(rows):
+    return "".join(json.dumps({"log_id": log_id, **log}) + "\n" for log_id, log in rows)
+
+
+@router.get("/usage_logs")
 @router.get("/usage_logs/{equipment_id}")
-def get_usage_logs(equipment_id: str):
-    logs = db.collection("usage_logs").where("equipment_id", "==", equipment_id).stream()
-    result = [log.to_dict() for log in logs]
-    result.sort(key=lambda x: x.get("end_time", ""), reverse=True)
-    return {"equipment_id": equipment_id, "total_sessions": len(result), "logs": result}
+async def get_usage_logs(
+    equipment_id: str | None = None,
+    user: str | None = None,
+    zone: str | None = None,
+    start: UtcDatetime | None = None,
+    end: UtcDatetime | None = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE),
+    cursor: str | None = None,
+    format: Literal["json", "ndjson"] = "json",
+    facility: str = Depends(facility_id),
+):
+    filters = {k: v for k, v in (("equipment_id", equipment_id), ("user", user), ("zone", zone)) if v is not None}
+    start, end = start and start.isoformat(), end and end.isoformat()
+    after = _decode_cursor(cursor) if cursor else None
+    pending = [
+        row for row in get_usage_buffer().pending(facility, **filters)
+        if (start is None or row[1].get("end_time", "") >= start) and (end is None or row[1].get("end_time", "") < end)
+        and (after is None or _key(row) < after)
+    ]
+    logs = get_stores(facility).usage_logs
+
+    if format == "ndjson":
+        async def lines():
+            rest, after_row = pending, after
+            while True:
+                page = await logs.page(limit, after_row, start=start, end=end, **filters)
+                if len(page) < limit:
+                    rows = _merge(rest, page)
+                    if rows:
+                        yield _ndjson(rows)
+                    return
+                after_row = _key(page[-1])
+                yield _ndjson(_merge([row for row in rest if _key(row) >= after_row], page))
+                rest = [row for row in rest if _key(row) < after_row]
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    page = await logs.page(limit, after, start=start, end=end, **filters)
+    rows = _merge(pending, page)
+    next_cursor = None
+    if len(rows) > limit or len(page) == limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(*_key(rows[-1]))
+    return {
+        "equipment_id": equipment_id,
+        "logs": [{"log_id": log_id, **log} for log_id, log in rows],
+        "next_cursor": next_cursor,
+    }
 
 # =====================================================
 # 7. Streamlit Compatibility Endpoint
 # =====================================================
 @router.post("/usage_logs/update")
-def update_usage_log(payload: dict):
-    print("🔥 Incoming payload:", payload)
+async def update_usage_log(payload: dict, caller: str | None = Depends(verified_user),
+                           facility: str = Depends(facility_id)):
     zone = payload.get("zone")
     status = payload.get("status")
-    user = payload.get("user", "demo_user")
+    user = caller or payload.get("user", "demo_user")
+    log.info("usage log update", extra={"event": "usage_log.update", "zone": zone, "status": status, "user": user})
 
     if not zone or not status:
         raise HTTPException(status_code=400, detail="Missing 'zone' or 'status'")
 
     try:
         if status == "in_use":
-            return check_in(zone, user)
+            return await check_in(zone, user, caller, facility)
         else:
             # Pass the 'user' variable to the check_out function
-            return check_out(zone, user)
+            return await check_out(zone, user, caller, facility)
     except HTTPException as e:
-        print("⚠️ HTTP Exception:", e.detail)
+        log.info("usage log update rejected: %s", e.detail,
+                 extra={"event": "usage_log.rejected", "zone": zone, "status": status, "user": user, "status_code": e.status_code})
         raise
     except Exception as e:
-        print("💥 General Exception:", str(e))
+        log.exception("usage log update failed", extra={"zone": zone, "status": status, "user": user})
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # =====================================================
 # 8. Analytics Heatmap
 # =====================================================
+# Same ETag and ?since= scheme as /equipments; a delta lists only the zones
+# whose counters moved, with a zone that lost all its units at total 0. Also
+# served as /heatmap, i.e. /facilities/{facility_id}/heatmap.
 @router.get("/analytics/heatmap")
-def get_heatmap():
-    docs = db.collection("equipments").stream()
-    zones = {}
-    for doc in docs:
-        data = doc.to_dict()
-        zone = data.get("zone", "Unknown")
-        status = data.get("status", "available")
-        if zone not in zones:
-            zones[zone] = {"available": 0, "in_use": 0}
-        if status == "in_use":
-            zones[zone]["in_use"] += 1
-        else:
-            zones[zone]["available"] += 1
-            
-    for zone, v in zones.items():
-        total = v["available"] + v["in_use"]
-        v["total"] = total # <-- THIS IS THE FIX
-        v["utilization_percent"] = round((v["in_use"] / total) * 100 if total else 0, 1)
-        
-    return {"zones": zones}
+@router.get("/heatmap")
+async def get_heatmap(request: Request, response: Response, since: str | None = None,
+                      facility: str = Depends(facility_id)):
+    index = get_index(facility)
+    cached = not_modified(request, etag(index.token()))
+    if cached:
+        return cached
+
+    version, zones, is_delta = index.versioned_zone_counts(by="zone", since=since)
+    response.headers["ETag"] = etag(version)
+    return {"zones": with_utilization(zones), "version": version, "full": not is_delta}
 
@@ -1,24 +1,23 @@
-from fastapi import APIRouter
-from firebase_admin import firestore
+from fastapi import APIRouter, Request, Response
+from catalog import start_catalog
+from http_cache import not_modified
 
 router = APIRouter(prefix="/exercises", tags=["Exercises"])
-db = firestore.client()
+
+# The ETag changes whenever the catalog does, so clients may hold on to it for
+# a while and then revalidate for an empty 304.
+CACHE_CONTROL = "public, max-age=3600, stale-while-revalidate=86400"
+
 
 @router.get("/")
-def get_exercises():
+async def get_exercises(request: Request):
     """
-    Fetch all exercises from Firestore collection 'exercises'
+    Every exercise grouped by primary muscle, from the in-memory catalog
     """
-    exercises_ref = db.collection("exercises").stream()
-    exercises = []
-    for doc in exercises_ref:
-        data = doc.to_dict()
-        exercises.append({
-            "exercise_name": data.get("exercise_name"),
-            "primary_muscle": data.get("primary_muscle"),
-            "equipment_type": data.get("equipment_type"),
-            "avg_duration": data.get("avg_duration", 10),
-            "recommended_sets": data.get("recommended_sets", 3),
-            "recommended_reps": data.get("recommended_reps", 8),
-        })
-    return {"exercises": exercises}
+    tag, body = (await start_catalog()).response()
+    headers = {"ETag": tag, "Cache-Control": CACHE_CONTROL}
+    cached = not_modified(request, tag)
+    if cached is not None:
+        cached.headers.update(headers)
+        return cached
+    return Response(content=body, media_type="application/json", headers=headers)
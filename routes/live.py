@@ -0,0 +1,76 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from facilities import facility_id
+from live_feed import get_feed
+
+router = APIRouter(prefix="/live", tags=["Live"])
+
+HEARTBEAT_INTERVAL = 15  # seconds
+
+
+# =====================================================
+# 1. Server-Sent Events
+# =====================================================
+@router.get("/stream")
+async def stream_updates(request: Request, facility: str = Depends(facility_id)):
+    """
+    Pushes a snapshot on connect, then only the zones and equipment that change.
+    """
+    feed = await run_in_threadpool(get_feed, facility)
+    queue = feed.subscribe()
+
+    async def events():
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(feed.snapshot())}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            feed.unsubscribe(queue)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+# =====================================================
+# 2. WebSocket
+# =====================================================
+# Client messages are read (and ignored) alongside the feed, so a client that
+# goes away is noticed at once rather than on the next change; a quiet feed
+# sends {"type": "ping"} every HEARTBEAT_INTERVAL so a dead peer surfaces as
+# a failed send.
+async def _closed(websocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+
+@router.websocket("/ws")
+async def websocket_updates(websocket: WebSocket, facility: str = Depends(facility_id)):
+    await websocket.accept()
+    feed = await run_in_threadpool(get_feed, facility)
+    queue = feed.subscribe()
+    closed = asyncio.create_task(_closed(websocket))
+    try:
+        await websocket.send_json(feed.snapshot())
+        while not closed.done():
+            message = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({message, closed}, timeout=HEARTBEAT_INTERVAL,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if message in done:
+                await websocket.send_json(message.result())
+                continue
+            message.cancel()
+            if not done:
+                await websocket.send_json({"type": "ping"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.cancel()
+        feed.unsubscribe(queue)
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from metrics import registry
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Per-route latency histograms, status counts and database operations in
+    the Prometheus text format
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/slow")
+async def get_slow_requests():
+    """
+    The most recent requests slower than UREC_SLOW_REQUEST_MS, newest first
+    """
+    return {"requests": list(reversed(registry.slow))}
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from catalog import start_catalog
+from facilities import facility_id
+from recommendations import get_recommender
+
+router = APIRouter(tags=["Recommendations"])
+
+@router.get("/recommendations")
+async def get_recommendations(
+    muscle_group: str,
+    user: str | None = None,
+    current_zone: str | None = None,
+    k: int | None = Query(None, ge=1),
+    facility: str = Depends(facility_id),
+):
+    """
+    Exercises for a muscle group ranked by predicted wait, then utilization.
+    `current_zone` (or, at the cost of a session read, the zone `user` is
+    checked into) is skipped; `k` keeps only the top picks.
+    """
+    await start_catalog()  # so get_recommender() never waits for it on the loop
+    result = await get_recommender(facility).recommend(muscle_group, user, k, current_zone)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Unknown muscle group '{muscle_group}'")
+    name, picks = result
+    return {"muscle_group": name, "recommendations": picks}
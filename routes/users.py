@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException
+from auth import verified_user
+from eta import get_engine
+from facilities import facility_id
+from occupancy import get_index
+from storage import get_stores
+from waitlist import get_waitlist, with_eta
+
+router = APIRouter(prefix="/users", tags=["Users"])
+
+@router.get("/{user}/session")
+async def get_user_session(user: str, caller: str | None = Depends(verified_user),
+                           facility: str = Depends(facility_id)):
+    """
+    The user's active session from active_sessions/{user} (one document read),
+    with elapsed minutes and a projected end from the zone's session lengths.
+    "waitlist" is the user's place in a zone's waitlist, or the unit on hold
+    for them, if any. A caller with a bearer token can only read their own.
+    """
+    if caller is not None and caller != user:
+        raise HTTPException(status_code=403, detail="Not your session")
+    waitlist = get_waitlist(facility)
+    zone = waitlist.zone_of(user)
+    queued = await with_eta(waitlist.status(zone, user), facility) if zone else None
+    session = await get_stores(facility).equipments.active_session(user)
+    if not session:
+        return {"user": user, "checked_in": False, "waitlist": queued}
+
+    zone = session.get("zone")
+    start = datetime.fromisoformat(session["start_time"])
+    elapsed = max((datetime.utcnow() - start).total_seconds() / 60, 0)
+    remaining = await get_engine(facility).expected_remaining(zone, elapsed)
+    equipment = get_index(facility).get(session["equipment_id"]) or {}
+    return {
+        "user": user,
+        "checked_in": True,
+        "equipment_id": session["equipment_id"],
+        "zone": zone,
+        "equipment_type": equipment.get("equipment_type"),
+        "start_time": session["start_time"],
+        "elapsed_minutes": round(elapsed, 1),
+        "expected_remaining_minutes": round(remaining, 1),
+        "projected_end": (datetime.utcnow() + timedelta(minutes=remaining)).isoformat(),
+        "waitlist": queued,
+    }
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, HTTPException
+from auth import verified_user
+from facilities import facility_id
+from occupancy import get_index
+from waitlist import get_waitlist, with_eta
+
+router = APIRouter(prefix="/waitlist", tags=["Waitlist"])
+
+
+def _known_zone(zone_name, facility):
+    if not get_index(facility).zone_counts(by="zone", zones=[zone_name])[zone_name]["total"]:
+        raise HTTPException(status_code=404, detail=f"Unknown zone '{zone_name}'")
+
+
+# =====================================================
+# Join / Leave
+# =====================================================
+# Joining again keeps the user's place. With a free unit the answer is an
+# offer straight away: check in within hold_seconds to take it. Same bearer
+# token rule as check-in.
+@router.post("/{zone_name}")
+async def join_waitlist(zone_name: str, user: str = "demo_user", caller: str | None = Depends(verified_user),
+                        facility: str = Depends(facility_id)):
+    user = caller or user
+    _known_zone(zone_name, facility)
+    status = get_waitlist(facility).join(zone_name, user)
+    return {"user": user, **await with_eta(status, facility)}
+
+
+@router.delete("/{zone_name}")
+async def leave_waitlist(zone_name: str, user: str = "demo_user", caller: str | None = Depends(verified_user),
+                         facility: str = Depends(facility_id)):
+    user = caller or user
+    if not get_waitlist(facility).leave(zone_name, user):
+        raise HTTPException(status_code=404, detail=f"User '{user}' is not on the '{zone_name}' waitlist")
+    return {"message": f"{user} left the {zone_name} waitlist"}
+
+# =====================================================
+# Status
+# =====================================================
+@router.get("/{zone_name}")
+async def get_waitlist_status(zone_name: str, user: str | None = None, facility: str = Depends(facility_id)):
+    """The queue's length, plus `user`'s place in it (or their offer) when given."""
+    _known_zone(zone_name, facility)
+    waitlist = get_waitlist(facility)
+    waiting, held = waitlist.size(zone_name)
+    body = {"zone": zone_name, "waiting": waiting, "held": held}
+    if user is not None:
+        body["user"] = user
+        body["status"] = await with_eta(waitlist.status(zone_name, user), facility)
+    return body
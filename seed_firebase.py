@@ -1,5 +1,9 @@
-from firebase_config import db
+import logging
+from firebase_config import get_db
 from datetime import datetime
+from log_config import setup_logging
+
+log = logging.getLogger(__name__)
 
 # =====================================================
 # Mock Equipment Data
@@ -21,11 +25,13 @@ mock_equipments = [
 # Push to Firestore
 # =====================================================
 def seed_equipments():
-    print("🔥 Seeding mock gym equipments into Firebase...")
+    log.info("🔥 Seeding mock gym equipments into Firebase...")
+    db = get_db()
     for eq in mock_equipments:
         db.collection("equipments").document(eq["equipment_id"]).set(eq)
-        print(f"✅ Added {eq['equipment_id']} in {eq['zone']}")
-    print("🎉 All mock equipments added successfully!")
+        log.info(f"✅ Added {eq['equipment_id']} in {eq['zone']}")
+    log.info("🎉 All mock equipments added successfully!")
 
 if __name__ == "__main__":
+    setup_logging(fmt="text")
     seed_equipments()
@@ -1,16 +1,13 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import argparse
+import logging
 from datetime import datetime, timedelta
 import random
+from storage import DEFAULT_FACILITY, get_stores
+import rollups
 
-# Initialize Firebase
-# Make sure the serviceAccountKey.json file is in the same directory
-try:
-    cred = credentials.Certificate("serviceAccountKey.json")
-    firebase_admin.initialize_app(cred)
-except ValueError:
-    print("Firebase app already initialized.")
-db = firestore.client()
+# Seeds whichever backend UREC_STORAGE selects (Firestore by default; make sure
+# serviceAccountKey.json is in the same directory for that).
+log = logging.getLogger(__name__)
 
 
 # ----------------------------------------------------
@@ -91,75 +88,108 @@ USERS = ["alex", "mia", "tom", "ryan", "eva", "leo", "nora", "chris", "jen", "sa
 # ----------------------------------------------------
 # SEED EQUIPMENTS
 # ----------------------------------------------------
-print("⏳ Seeding equipments...")
-equip_ref = db.collection("equipments")
-equip_ref_list = []
-
-for zone, count in EQUIPMENT_ZONES.items():
-    for i in range(1, count + 1):
-        eq_id = f"{zone}_{i:02d}"
-        status = random.choice(["available", "in_use"])
-        current_user = random.choice(USERS) if status == "in_use" else ""
-        start_time = (
-            datetime.now() - timedelta(minutes=random.randint(5, 40))
-        ).isoformat() if current_user else ""
-        data = {
-            "equipment_id": eq_id,
-            "zone": zone,
-            "equipment_type": zone,
-            "status": status,
-            "current_user": current_user,
-            "start_time": start_time,
-            "avg_duration": random.randint(10, 25),
-            "usage_count": random.randint(10, 100)
-        }
-        equip_ref.document(eq_id).set(data)
-        equip_ref_list.append(eq_id)
-
-print(f"✅ {len(equip_ref_list)} equipments added.")
+def seed_equipments(stores, scale=1, progress=None):
+    log.info("⏳ Seeding equipments...")
+    equipments = []
+    sessions = {}
+
+    for zone, count in EQUIPMENT_ZONES.items():
+        for i in range(1, count * scale + 1):
+            eq_id = f"{zone}_{i:02d}"
+            status = random.choice(["available", "in_use"])
+            current_user = ""
+            if status == "in_use":
+                # One active session per user, like the check-in route enforces
+                idle = [u for u in USERS if u not in sessions]
+                current_user = random.choice(idle) if idle else f"guest_{eq_id}"
+            start_time = (
+                datetime.now() - timedelta(minutes=random.randint(5, 40))
+            ).isoformat() if current_user else ""
+            equipments.append((eq_id, {
+                "equipment_id": eq_id,
+                "zone": zone,
+                "equipment_type": zone,
+                "status": status,
+                "current_user": current_user,
+                "start_time": start_time,
+                "avg_duration": random.randint(10, 25),
+                "usage_count": random.randint(10, 100)
+            }))
+            if current_user:
+                sessions[current_user] = {"equipment_id": eq_id, "zone": zone, "start_time": start_time}
+
+    stores.equipments.put_many(equipments, progress=progress and progress("equipments"))
+    stores.equipments.put_sessions(sessions, progress=progress and progress("active_sessions"))
+    log.info(f"✅ {len(equipments)} equipments added.")
+    return [eq_id for eq_id, _ in equipments]
 
 # ----------------------------------------------------
 # SEED EXERCISES
 # ----------------------------------------------------
-print("⏳ Seeding exercises...")
-ex_ref = db.collection("exercises")
-for muscle, exs in EXERCISES.items():
-    for ex, eq_type in exs:
-        ex_ref.document(ex).set({
-            "exercise_name": ex,
-            "primary_muscle": muscle,
-            "equipment_type": eq_type,
-            "recommended_sets": random.randint(3, 5),
-            "recommended_reps": random.choice([8, 10, 12]),
-            "avg_duration": random.randint(10, 20)
-        })
-print(f"✅ {sum(len(v) for v in EXERCISES.values())} exercises added.")
+def seed_exercises(stores, progress=None):
+    log.info("⏳ Seeding exercises...")
+    stores.exercises.put_many(
+        [
+            (ex, {
+                "exercise_name": ex,
+                "primary_muscle": muscle,
+                "equipment_type": eq_type,
+                "recommended_sets": random.randint(3, 5),
+                "recommended_reps": random.choice([8, 10, 12]),
+                "avg_duration": random.randint(10, 20)
+            })
+            for muscle, exs in EXERCISES.items()
+            for ex, eq_type in exs
+        ],
+        progress=progress and progress("exercises"),
+    )
+    log.info(f"✅ {sum(len(v) for v in EXERCISES.values())} exercises added.")
 
 # ----------------------------------------------------
 # SEED USER ACTIVITY LOGS
 # ----------------------------------------------------
-print("⏳ Seeding usage logs...")
-logs_ref = db.collection("usage_logs")
-for _ in range(200):
-    user = random.choice(USERS)
-    eq = random.choice(equip_ref_list)
-    zone = eq.split("_")[0]
-    exercise = random.choice(random.choice(list(EXERCISES.values())))[0]
-    start = datetime.now() - timedelta(minutes=random.randint(10, 90))
-    duration = random.randint(8, 25)
-    end = start + timedelta(minutes=duration)
-
-    logs_ref.add({
-        "user": user,
-        "exercise": exercise,
-        "equipment_id": eq,
-        "zone": zone,
-        "start_time": start.isoformat(),
-        "end_time": end.isoformat(),
-        "duration_mins": duration,
-        "status": "completed"
-    })
-
-print("✅ 200 user workout logs added.")
-print("🎉 Firebase seeding complete!")
+def seed_usage_logs(stores, equip_ref_list, count=200, progress=None):
+    log.info("⏳ Seeding usage logs...")
+    logs = []
+    for _ in range(count):
+        user = random.choice(USERS)
+        eq = random.choice(equip_ref_list)
+        zone = eq.rsplit("_", 1)[0]
+        exercise = random.choice(random.choice(list(EXERCISES.values())))[0]
+        start = datetime.now() - timedelta(minutes=random.randint(10, 90))
+        duration = random.randint(8, 25)
+        end = start + timedelta(minutes=duration)
+
+        logs.append({
+            "user": user,
+            "exercise": exercise,
+            "equipment_id": eq,
+            "zone": zone,
+            "start_time": start.isoformat(),
+            "end_time": end.isoformat(),
+            "duration_mins": duration,
+            "status": "completed"
+        })
+
+    stores.usage_logs.add_many(logs, progress=progress and progress("usage_logs"))
+    rollups.record_many(stores, logs, progress=progress and progress("usage_rollups"))
+    log.info(f"✅ {count} user workout logs added.")
+
+
+def seed(stores, scale=1, logs=200, progress=None):
+    equip_ref_list = seed_equipments(stores, scale, progress)
+    seed_exercises(stores, progress)
+    seed_usage_logs(stores, equip_ref_list, logs, progress)
+    log.info("🎉 Seeding complete!")
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the UREC Live database with a demo gym")
+    parser.add_argument("--scale", type=int, default=1, help="multiply every zone's unit count")
+    parser.add_argument("--logs", type=int, default=200, help="number of usage logs to generate")
+    parser.add_argument("--facility", default=DEFAULT_FACILITY, help="facility to seed")
+    args = parser.parse_args()
+    from bulk_write import log_progress
+    from log_config import setup_logging
+    setup_logging(fmt="text")
+    seed(get_stores(args.facility), scale=args.scale, logs=args.logs, progress=log_progress)
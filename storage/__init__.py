@@ -0,0 +1,55 @@
+import os
+import threading
+from storage.base import (
+    DEFAULT_FACILITY, AlreadyCheckedIn, EquipmentNotFound, EquipmentStore, ExerciseStore,
+    NoAvailableEquipment, NotCheckedIn, RollupStore, StoreError, Stores, UsageLogStore,
+)
+
+# =====================================================
+# Backend selection
+# =====================================================
+# UREC_STORAGE picks the backend for this process:
+#   firestore (default)  the shared Firebase project
+#   memory               plain dicts, gone on restart; set UREC_SEED_DEMO=1 to
+#                        start with the seeded demo gym (or =N for N times
+#                        the equipment)
+#   sqlite               one local file (UREC_SQLITE_PATH, default urec.db)
+# The in-process backends assume a single API worker per database.
+#
+# UREC_FACILITIES lists the facilities this deployment serves (default: just
+# the default facility); get_stores(facility) returns one facility's stores.
+
+FACILITIES = [f.strip() for f in os.getenv("UREC_FACILITIES", DEFAULT_FACILITY).split(",") if f.strip()]
+
+_stores = None
+_stores_lock = threading.Lock()
+
+
+def create_stores(backend=None):
+    backend = backend or os.getenv("UREC_STORAGE", "firestore")
+    if backend == "firestore":
+        from firebase_config import get_async_db, get_db
+        from metrics import instrument_firestore
+        from storage.firestore_store import firestore_stores
+        return firestore_stores(instrument_firestore(get_db()), instrument_firestore(get_async_db()))
+
+    from storage.local import MemoryDatabase, SqliteDatabase, local_stores
+    if backend == "memory":
+        stores = local_stores(MemoryDatabase())
+        if os.getenv("UREC_SEED_DEMO"):
+            from seed_full_gym_data import seed
+            for facility in FACILITIES:
+                seed(stores.for_facility(facility), scale=int(os.getenv("UREC_SEED_DEMO")))
+        return stores
+    if backend == "sqlite":
+        return local_stores(SqliteDatabase(os.getenv("UREC_SQLITE_PATH", "urec.db")))
+    raise ValueError(f"Unknown UREC_STORAGE backend '{backend}'")
+
+
+def get_stores(facility=DEFAULT_FACILITY):
+    """The process-wide store set for `facility`, created on first use."""
+    global _stores
+    with _stores_lock:
+        if _stores is None:
+            _stores = create_stores()
+    return _stores if facility == DEFAULT_FACILITY else _stores.for_facility(facility)
@@ -0,0 +1,250 @@
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+# =====================================================
+# Facilities
+# =====================================================
+# Equipment, sessions, usage logs and rollups are partitioned by facility:
+# each facility's documents live in facilities/{id}/<collection>, so its
+# queries, listeners and caches only ever see that facility. The default
+# facility keeps the original top-level collections, which is where
+# everything written before facilities existed lives. The exercise catalog is
+# shared by every facility.
+DEFAULT_FACILITY = "main"
+PARTITIONED_COLLECTIONS = ("equipments", "active_sessions", "usage_logs", "usage_rollups", "rollup_batches")
+
+
+def collection_path(facility, name):
+    """Where collection `name` lives for `facility`."""
+    if facility == DEFAULT_FACILITY or name not in PARTITIONED_COLLECTIONS:
+        return name
+    return f"facilities/{facility}/{name}"
+
+
+# =====================================================
+# Errors
+# =====================================================
+class StoreError(Exception):
+    pass
+
+
+class EquipmentNotFound(StoreError):
+    pass
+
+
+class AlreadyCheckedIn(StoreError):
+    def __init__(self, user, session):
+        self.user = user
+        self.session = session
+        super().__init__(f"User '{user}' already checked into {session.get('zone')} ({session.get('equipment_id')})")
+
+
+class NoAvailableEquipment(StoreError):
+    def __init__(self, zone):
+        self.zone = zone
+        super().__init__(f"No available equipment found in '{zone}'")
+
+
+class NotCheckedIn(StoreError):
+    def __init__(self, zone, user):
+        self.zone = zone
+        self.user = user
+        super().__init__(f"User '{user}' not found in any in-use equipment in '{zone}'")
+
+
+def build_usage_log(equipment_id, zone, equipment):
+    """The usage_logs record written when `equipment` is checked out."""
+    start_time = datetime.fromisoformat(equipment.get("start_time")) if equipment.get("start_time") else datetime.utcnow()
+    duration = (datetime.utcnow() - start_time).seconds // 60
+    return {
+        "equipment_id": equipment_id,
+        "zone": zone,
+        "user": equipment.get("current_user", ""),
+        "start_time": equipment.get("start_time"),
+        "end_time": datetime.utcnow().isoformat(),
+        "duration": duration,
+    }
+
+
+# =====================================================
+# Store interfaces
+# =====================================================
+# Request-path methods are coroutines. Bulk methods and watch() block; they are
+# for scripts, listeners and startup code, never for a route handler.
+# Bulk methods take an optional `progress(done, total)` callback.
+class EquipmentStore(ABC):
+    """The equipments collection plus the active_sessions/{user} lookup."""
+
+    @abstractmethod
+    async def list(self):
+        """All equipment documents ordered by id."""
+
+    @abstractmethod
+    async def get(self, equipment_id):
+        """One equipment document, or None."""
+
+    @abstractmethod
+    async def put(self, equipment_id, data):
+        """Create or overwrite an equipment document."""
+
+    @abstractmethod
+    async def update(self, equipment_id, fields):
+        """Merge `fields` into a document and return the result; raises EquipmentNotFound."""
+
+    @abstractmethod
+    async def check_in(self, zone, user):
+        """Atomically claim an available unit in `zone` for `user`.
+
+        Returns (equipment_id, equipment). Raises AlreadyCheckedIn or
+        NoAvailableEquipment.
+        """
+
+    @abstractmethod
+    async def check_out(self, zone, user):
+        """Atomically free the user's unit in `zone` and end their session.
+
+        Returns (equipment_id, equipment, log). The usage log is not written
+        here; callers hand it to the write-behind buffer (usage_buffer.py).
+        Raises NotCheckedIn.
+        """
+
+    async def warm_up(self):
+        """Make the first request-path call cheap; the local backends have nothing to do."""
+
+    @abstractmethod
+    async def active_session(self, user):
+        """The user's active_sessions document, or None."""
+
+    @abstractmethod
+    def put_many(self, items, progress=None):
+        """Bulk create-or-overwrite of (equipment_id, data) pairs."""
+
+    @abstractmethod
+    def put_sessions(self, sessions, progress=None):
+        """Bulk write of {user: session} into active_sessions (seeding and simulation only)."""
+
+    @abstractmethod
+    def watch(self, callback):
+        """Stream changes to `callback(changes)`, a list of (equipment_id, data or None).
+
+        The first call carries every existing document. Changes made through
+        this store are delivered as soon as they commit. Returns a handle with
+        an unsubscribe() method.
+        """
+
+
+def ingested(log):
+    """`log` stamped with ingested_at, when it reached the store (UTC ISO; exports follow it)."""
+    return {**log, "ingested_at": datetime.utcnow().isoformat()}
+
+
+class UsageLogStore(ABC):
+    """Usage logs; every write stamps each log's ingested_at (see ingested())."""
+
+    @abstractmethod
+    async def add(self, log):
+        """Append a usage log and return its id."""
+
+    @abstractmethod
+    def add_many(self, logs, progress=None):
+        """Bulk append of usage logs."""
+
+    @abstractmethod
+    def put_many(self, items, progress=None):
+        """Bulk create-or-overwrite of (log_id, log) pairs; replaying a batch is harmless."""
+
+    @abstractmethod
+    async def page(self, limit, after=None, equipment_id=None, user=None, zone=None, start=None, end=None,
+                   order="end_time"):
+        """Up to `limit` (log_id, log) pairs, newest `order` ("end_time" or "ingested_at") first, ties by id.
+
+        `after` is the (value, log_id) of the previous page's last row.
+        Other arguments filter by equality, and start <= value < end (ISO
+        strings).
+        """
+
+
+class ExerciseStore(ABC):
+    @abstractmethod
+    async def list(self):
+        """Every exercise document."""
+
+    @abstractmethod
+    async def put(self, name, data):
+        """Create or overwrite an exercise keyed by name."""
+
+    @abstractmethod
+    def put_many(self, items, progress=None):
+        """Bulk create-or-overwrite of (name, data) pairs."""
+
+    @abstractmethod
+    def watch(self, callback):
+        """Stream changes to `callback(changes)`, a list of (name, data or None).
+
+        Same contract as EquipmentStore.watch().
+        """
+
+
+# A Firestore batch holds 500 writes; apply_once() needs one for its marker.
+MAX_APPLY_INCREMENTS = 499
+
+
+class RollupStore(ABC):
+    """Pre-aggregated usage buckets (see rollups.py)."""
+
+    @abstractmethod
+    async def apply(self, increments):
+        """Add a batch of bucket increments from rollups.increments_for_log()."""
+
+    @abstractmethod
+    def apply_many(self, increments, progress=None):
+        """Bulk version of apply() for backfills and seeding."""
+
+    @abstractmethod
+    def apply_once(self, batch_id, increments):
+        """apply_many() that happens at most once per `batch_id`.
+
+        Commits up to MAX_APPLY_INCREMENTS increments together with a
+        rollup_batches/{batch_id} marker; a batch_id already marked is skipped.
+        Returns whether the increments were applied.
+        """
+
+    @abstractmethod
+    def applied(self, batch_id):
+        """Whether apply_once() has committed `batch_id`."""
+
+    @abstractmethod
+    async def query(self, granularity, scope, key, start, end):
+        """Stored buckets with start <= bucket_start < end (ISO strings), oldest first."""
+
+
+class Stores:
+    """One facility's store set; for_facility() reaches the others on the same backend."""
+
+    def __init__(self, equipments, usage_logs, exercises, rollups, facility=DEFAULT_FACILITY, partition=None,
+                 backend=None):
+        self.equipments = equipments
+        self.usage_logs = usage_logs
+        self.exercises = exercises
+        self.rollups = rollups
+        self.facility = facility
+        # Which database this is ("firestore:<project>", "sqlite:<path>",
+        # "memory"); the usage-log journal is tied to it.
+        self.backend = backend
+        self._partition = partition
+        self._siblings = {facility: self}
+        self._siblings_lock = threading.Lock()
+
+    def for_facility(self, facility):
+        """The store set for `facility`, created once and shared by every sibling."""
+        with self._siblings_lock:
+            stores = self._siblings.get(facility)
+            if stores is None:
+                stores = self._siblings[facility] = self._partition(facility)
+                stores._siblings, stores._siblings_lock = self._siblings, self._siblings_lock
+        return stores
+
+    async def warm_up(self):
+        """Open the backend's connections ahead of the first request; call from the API's event loop."""
+        await self.equipments.warm_up()
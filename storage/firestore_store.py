@@ -0,0 +1,392 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from firebase_admin import firestore
+from google.api_core import exceptions as gexc
+from google.cloud.firestore_v1.async_transaction import async_transactional
+from bulk_write import MAX_BATCH_OPS, BulkWriter
+from storage.base import (
+    DEFAULT_FACILITY, AlreadyCheckedIn, EquipmentNotFound, EquipmentStore, ExerciseStore,
+    NoAvailableEquipment, NotCheckedIn, RollupStore, Stores, UsageLogStore, build_usage_log, collection_path, ingested,
+)
+
+# Request-path methods go through the AsyncClient (`adb`), so a handler waiting
+# on Firestore does not tie up a worker thread. The blocking client (`db`) is
+# kept for the on_snapshot listener and the bulk writers.
+#
+# Check-in and check-out each run as one Firestore transaction. The
+# active_sessions/{user} document answers "is this user already checked in?"
+# with a single document read, and the transaction retries on contention so two
+# concurrent check-ins can never claim the same unit.
+MAX_TXN_ATTEMPTS = 20
+WARM_UP_TIMEOUT = 10  # seconds
+# rollup_batches markers only need to outlive a flush's retries; with a TTL
+# policy on expire_at, Firestore deletes them after this.
+BATCH_MARKER_TTL = timedelta(days=7)
+
+log = logging.getLogger(__name__)
+
+
+async def _first(results):
+    async for snapshot in results:
+        return snapshot
+    return None
+
+
+async def _first_in(transaction, query):
+    return await _first(await transaction.get(query))
+
+
+@async_transactional
+async def _check_in_txn(transaction, equipments, sessions, zone, user):
+    session_ref = sessions.document(user)
+    query = equipments.where("zone", "==", zone).where("status", "==", "available").limit(1)
+    # The session read and the free-unit query don't depend on each other, so
+    # both round trips are in flight at once.
+    session, target = await asyncio.gather(
+        session_ref.get(transaction=transaction),
+        _first_in(transaction, query),
+    )
+    if session.exists:
+        raise AlreadyCheckedIn(user, session.to_dict())
+    if not target:
+        raise NoAvailableEquipment(zone)
+
+    start_time = datetime.utcnow().isoformat()
+    fields = {"status": "in_use", "current_user": user, "start_time": start_time}
+    transaction.update(target.reference, fields)
+    transaction.set(session_ref, {"equipment_id": target.id, "zone": zone, "start_time": start_time})
+    return target.id, {**target.to_dict(), **fields}
+
+
+@async_transactional
+async def _check_out_txn(transaction, equipments, sessions, zone, user):
+    session_ref = sessions.document(user)
+    session = await session_ref.get(transaction=transaction)
+    if session.exists:
+        equipment_ref = equipments.document(session.get("equipment_id"))
+        target = await equipment_ref.get(transaction=transaction)
+    else:
+        # Units checked in before active_sessions existed have no session doc.
+        query = equipments.where("zone", "==", zone).where("status", "==", "in_use").where("current_user", "==", user).limit(1)
+        target = await _first_in(transaction, query)
+
+    data = target.to_dict() if target and target.exists else {}
+    if data.get("zone") != zone or data.get("status") != "in_use" or data.get("current_user") != user:
+        raise NotCheckedIn(zone, user)
+
+    log = build_usage_log(target.id, zone, data)
+
+    fields = {"status": "available", "current_user": "", "start_time": ""}
+    transaction.update(target.reference, fields)
+    transaction.delete(session_ref)
+    return target.id, {**data, **fields}, log
+
+
+# =====================================================
+# Equipment
+# =====================================================
+class _Watch:
+    def __init__(self, feed, callback, listener):
+        self._feed = feed
+        self._callback = callback
+        self._listener = listener
+
+    def unsubscribe(self):
+        self._listener.unsubscribe()
+        with self._feed.lock:
+            self._feed.callbacks.discard(self._callback)
+
+
+class _ChangeFeed:
+    """Watchers of one collection, fed by our own writes and the on_snapshot listener.
+
+    A local write reaches watchers as soon as it commits, and the listener
+    delivers it again later, possibly after an older change it was still
+    holding. Each document keeps the newest update_time handed out, and
+    listener events older than that are dropped, so an echo can't roll a unit
+    back. Writes without a known commit time (bulk writes) leave the mark alone.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.callbacks = set()
+        self.lock = threading.RLock()  # held while watchers run; they may write back
+        self._applied = {}  # document id -> newest update_time emitted
+
+    def watch(self, callback):
+        def on_snapshot(col_snapshot, changes, read_time):
+            with self.lock:
+                fresh = []
+                for change in changes:
+                    removed = change.type.name == "REMOVED"
+                    doc = change.document
+                    if not self._advance(doc.id, read_time if removed else doc.update_time):
+                        continue
+                    fresh.append((doc.id, None if removed else doc.to_dict()))
+                if fresh:
+                    for cb in list(self.callbacks):
+                        cb(fresh)
+
+        with self.lock:
+            self.callbacks.add(callback)
+        return _Watch(self, callback, self.collection.on_snapshot(on_snapshot))
+
+    def emit(self, changes, update_time=None):
+        # Our own commits reach watchers now rather than after the listener round trip.
+        with self.lock:
+            if update_time is not None:
+                for doc_id, _ in changes:
+                    self._advance(doc_id, update_time)
+            for callback in list(self.callbacks):
+                callback(changes)
+
+    def _advance(self, doc_id, update_time):
+        # Called with the lock held; False if `doc_id` already has a newer state.
+        if update_time is None:
+            return True
+        applied = self._applied.get(doc_id)
+        if applied is not None and update_time < applied:
+            return False
+        self._applied[doc_id] = update_time
+        return True
+
+
+class FirestoreEquipmentStore(EquipmentStore):
+    def __init__(self, db, adb, facility=DEFAULT_FACILITY):
+        self.db = db
+        self.adb = adb
+        self.path = collection_path(facility, "equipments")
+        self.sessions_path = collection_path(facility, "active_sessions")
+        self.collection = adb.collection(self.path)
+        self.sessions = adb.collection(self.sessions_path)
+        self._feed = _ChangeFeed(db.collection(self.path))
+
+    async def list(self):
+        return [doc.to_dict() async for doc in self.collection.stream()]
+
+    async def get(self, equipment_id):
+        snapshot = await self.collection.document(equipment_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    async def put(self, equipment_id, data):
+        result = await self.collection.document(equipment_id).set(data)
+        self._feed.emit([(equipment_id, data)], result.update_time)
+
+    async def update(self, equipment_id, fields):
+        doc_ref = self.collection.document(equipment_id)
+        snapshot = await doc_ref.get()
+        if not snapshot.exists:
+            raise EquipmentNotFound(equipment_id)
+        result = await doc_ref.update(fields)
+        data = {**snapshot.to_dict(), **fields}
+        self._feed.emit([(equipment_id, data)], result.update_time)
+        return data
+
+    async def check_in(self, zone, user):
+        transaction = self.adb.transaction(max_attempts=MAX_TXN_ATTEMPTS)
+        equipment_id, data = await _check_in_txn(transaction, self.collection, self.sessions, zone, user)
+        self._feed.emit([(equipment_id, data)], transaction.commit_time)
+        return equipment_id, data
+
+    async def check_out(self, zone, user):
+        transaction = self.adb.transaction(max_attempts=MAX_TXN_ATTEMPTS)
+        equipment_id, data, log = await _check_out_txn(transaction, self.collection, self.sessions, zone, user)
+        self._feed.emit([(equipment_id, data)], transaction.commit_time)
+        return equipment_id, data, log
+
+    async def warm_up(self):
+        # One small query opens the async channel (TLS, auth token) on this loop.
+        try:
+            await self.collection.limit(1).get(retry=None, timeout=WARM_UP_TIMEOUT)
+        except Exception:
+            log.warning("Firestore warm-up failed; the first request will connect instead", exc_info=True)
+
+    async def active_session(self, user):
+        snapshot = await self.sessions.document(user).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def put_many(self, items, progress=None):
+        items = list(items)
+        collection = self.db.collection(self.path)
+        with BulkWriter(self.db, progress=progress) as writer:
+            for equipment_id, data in items:
+                writer.set(collection.document(equipment_id), data)
+        self._feed.emit(items)
+
+    def put_sessions(self, sessions, progress=None):
+        sessions_ref = self.db.collection(self.sessions_path)
+        with BulkWriter(self.db, progress=progress) as writer:
+            for user, session in sessions.items():
+                writer.set(sessions_ref.document(user), session)
+
+    # -------------------- change feed --------------------
+    def watch(self, callback):
+        return self._feed.watch(callback)
+
+
+# =====================================================
+# Usage logs / exercises
+# =====================================================
+class FirestoreUsageLogStore(UsageLogStore):
+    def __init__(self, db, adb, facility=DEFAULT_FACILITY):
+        self.db = db
+        self.path = collection_path(facility, "usage_logs")
+        self.collection = adb.collection(self.path)
+
+    async def add(self, log):
+        _, doc_ref = await self.collection.add(ingested(log))
+        return doc_ref.id
+
+    def add_many(self, logs, progress=None):
+        collection = self.db.collection(self.path)
+        with BulkWriter(self.db, progress=progress) as writer:
+            for log in logs:
+                writer.set(collection.document(), ingested(log))
+
+    def put_many(self, items, progress=None):
+        collection = self.db.collection(self.path)
+        with BulkWriter(self.db, progress=progress) as writer:
+            for log_id, log in items:
+                writer.set(collection.document(log_id), ingested(log))
+
+    async def page(self, limit, after=None, equipment_id=None, user=None, zone=None, start=None, end=None,
+                   order="end_time"):
+        # Each combination of equality filters used needs a composite index
+        # ending in (<order> DESC, __name__ DESC).
+        query = self.collection
+        for field, value in (("equipment_id", equipment_id), ("user", user), ("zone", zone)):
+            if value is not None:
+                query = query.where(field, "==", value)
+        if start is not None:
+            query = query.where(order, ">=", start)
+        if end is not None:
+            query = query.where(order, "<", end)
+        query = (
+            query
+            .order_by(order, direction=firestore.Query.DESCENDING)
+            .order_by("__name__", direction=firestore.Query.DESCENDING)
+        )
+        if after is not None:
+            query = query.start_after({order: after[0], "__name__": self.collection.document(after[1])})
+        return [(doc.id, doc.to_dict()) async for doc in query.limit(limit).stream()]
+
+
+class FirestoreExerciseStore(ExerciseStore):
+    def __init__(self, db, adb):
+        self.db = db
+        self.collection = adb.collection("exercises")
+        self._feed = _ChangeFeed(db.collection("exercises"))
+
+    async def list(self):
+        return [doc.to_dict() async for doc in self.collection.stream()]
+
+    async def put(self, name, data):
+        result = await self.collection.document(name).set(data)
+        self._feed.emit([(name, dict(data))], result.update_time)
+
+    def put_many(self, items, progress=None):
+        items = [(name, dict(data)) for name, data in items]
+        collection = self.db.collection("exercises")
+        with BulkWriter(self.db, progress=progress) as writer:
+            for name, data in items:
+                writer.set(collection.document(name), data)
+        self._feed.emit(items)
+
+    def watch(self, callback):
+        return self._feed.watch(callback)
+
+
+# =====================================================
+# Usage rollups
+# =====================================================
+class FirestoreRollupStore(RollupStore):
+    """One usage_rollups document per bucket, updated with server-side increments.
+
+    query() needs a composite index on (granularity, scope, key, bucket_start);
+    indexes are per collection id, so one covers every facility's buckets.
+    apply_once() creates the rollup_batches marker in the same batch as its
+    increments: a replay (a second flusher, or a retry after an ambiguous
+    failure) fails on the marker's precondition and counts nothing.
+    apply_many() only retries errors that mean nothing was written.
+    """
+
+    def __init__(self, db, adb, facility=DEFAULT_FACILITY):
+        self.db = db
+        self.adb = adb
+        self.path = collection_path(facility, "usage_rollups")
+        self.batches_path = collection_path(facility, "rollup_batches")
+        self.collection = adb.collection(self.path)
+
+    def apply_once(self, batch_id, increments):
+        marker = self.db.collection(self.batches_path).document(batch_id)
+        if marker.get().exists:
+            return False
+        collection = self.db.collection(self.path)
+        batch = self.db.batch()
+        for inc in increments:
+            batch.set(collection.document(inc["id"]), self._fields(inc), merge=True)
+        batch.create(marker, {"applied_at": firestore.SERVER_TIMESTAMP, "expire_at": datetime.utcnow() + BATCH_MARKER_TTL})
+        try:
+            batch.commit()
+        except gexc.AlreadyExists:
+            return False
+        return True
+
+    def applied(self, batch_id):
+        return self.db.collection(self.batches_path).document(batch_id).get().exists
+
+    async def apply(self, increments):
+        # A single check-out touches a few dozen buckets: plain batches will do.
+        for i in range(0, len(increments), MAX_BATCH_OPS):
+            batch = self.adb.batch()
+            for inc in increments[i:i + MAX_BATCH_OPS]:
+                batch.set(self.collection.document(inc["id"]), self._fields(inc), merge=True)
+            await batch.commit()
+
+    def apply_many(self, increments, progress=None):
+        collection = self.db.collection(self.path)
+        with BulkWriter(self.db, progress=progress, idempotent=False) as writer:
+            for inc in increments:
+                writer.set(collection.document(inc["id"]), self._fields(inc), merge=True)
+
+    @staticmethod
+    def _fields(inc):
+        fields = {
+            "granularity": inc["granularity"],
+            "scope": inc["scope"],
+            "key": inc["key"],
+            "bucket_start": inc["bucket_start"],
+            "sessions": firestore.Increment(inc["sessions"]),
+            "busy_minutes": firestore.Increment(inc["busy_minutes"]),
+        }
+        if inc["durations"]:
+            fields["durations"] = {m: firestore.Increment(n) for m, n in inc["durations"].items()}
+        return fields
+
+    async def query(self, granularity, scope, key, start, end):
+        docs = (
+            self.collection
+            .where("granularity", "==", granularity)
+            .where("scope", "==", scope)
+            .where("key", "==", key)
+            .where("bucket_start", ">=", start)
+            .where("bucket_start", "<", end)
+            .order_by("bucket_start")
+            .stream()
+        )
+        return [doc.to_dict() async for doc in docs]
+
+
+def firestore_stores(db, adb, facility=DEFAULT_FACILITY, exercises=None):
+    exercises = exercises or FirestoreExerciseStore(db, adb)
+    return Stores(
+        equipments=FirestoreEquipmentStore(db, adb, facility),
+        usage_logs=FirestoreUsageLogStore(db, adb, facility),
+        exercises=exercises,
+        rollups=FirestoreRollupStore(db, adb, facility),
+        facility=facility,
+        partition=lambda other: firestore_stores(db, adb, other, exercises),
+        backend=f"firestore:{db.project}",
+    )
@@ -0,0 +1,562 @@
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+import metrics
+from storage.base import (
+    DEFAULT_FACILITY, AlreadyCheckedIn, EquipmentNotFound, EquipmentStore, ExerciseStore,
+    NoAvailableEquipment, NotCheckedIn, RollupStore, Stores, UsageLogStore, build_usage_log, collection_path, ingested,
+)
+
+# =====================================================
+# In-process backends
+# =====================================================
+# Both backends are small document stores keyed by (collection, id) with the
+# same surface, so the stores below work unchanged on either. Every read and
+# write goes through `transaction()`, which serialises access within the
+# process; SQLite additionally takes a write lock on the file. Pure reads go
+# through `read()` instead, which on SQLite is a deferred transaction on the
+# thread's own connection, so readers run side by side (and beside a writer,
+# in WAL mode) rather than queueing on the lock. Hooks registered with
+# `after_commit()` are queued in commit order when the outermost transaction
+# commits and run once the lock is released, one at a time in that order, so
+# watchers see changes in commit order and a failing hook is logged without
+# failing a write that already committed. `ops` counts document reads and
+# writes the way Firestore would bill them (a query costs at least one read),
+# so benchmarks can report reads per request; every count is also reported to
+# metrics.py for the current request.
+
+log = logging.getLogger(__name__)
+
+
+class _LocalDatabase:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._hooks = []
+        self._committed = deque()  # hooks of committed transactions, in commit order
+        self._hooks_lock = threading.RLock()
+        self._owner = None  # thread inside transaction()
+        self.ops = Counter()
+
+    def _count(self, op, n=1):
+        self.ops[op] += n
+        metrics.count(op, n)
+
+    def get(self, collection, doc_id):
+        self._count("reads")
+        return self._get(collection, doc_id)
+
+    def put(self, collection, doc_id, data):
+        self._count("writes")
+        self._put(collection, doc_id, data)
+
+    def delete(self, collection, doc_id):
+        self._count("deletes")
+        self._delete(collection, doc_id)
+
+    def scan(self, collection, **equals):
+        """(id, data) pairs in id order whose fields match `equals`."""
+        self._count("queries")
+        self._count("reads")
+        for n, doc in enumerate(self._scan(collection, **equals)):
+            if n:
+                self._count("reads")
+            yield doc
+
+    def page(self, collection, order, limit, after=None, lower=None, upper=None, **equals):
+        """Up to `limit` (id, data) pairs matching `equals`, by (data[order], id) descending.
+
+        Only rows below the (value, id) cursor `after` and with
+        lower <= data[order] < upper are returned; a missing value sorts as "".
+        """
+        self._count("queries")
+        rows = list(self._page(collection, order, limit, after, lower, upper, equals))
+        self._count("reads", max(len(rows), 1))
+        return rows
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            outermost = self._depth == 0
+            self._depth += 1
+            if outermost:
+                self._owner = threading.get_ident()
+                self._begin()
+            try:
+                yield self
+            except BaseException:
+                if outermost:
+                    self._hooks.clear()
+                    self._rollback()
+                raise
+            else:
+                if outermost:
+                    self._commit()
+                    self._committed.extend(self._hooks)
+                    self._hooks.clear()
+            finally:
+                self._depth -= 1
+                if outermost:
+                    self._owner = None
+        if outermost:
+            self._run_hooks()
+
+    def read(self):
+        """A transaction for reads only."""
+        return self.transaction()
+
+    def after_commit(self, hook):
+        self._hooks.append(hook)
+
+    def _run_hooks(self):
+        # Whoever holds _hooks_lock runs every queued hook, so once this
+        # returns the caller's own hooks have run.
+        with self._hooks_lock:
+            while self._committed:
+                hook = self._committed.popleft()
+                try:
+                    hook()
+                except Exception:
+                    log.exception("after-commit hook failed", extra={"event": "local_db.hook_failed"})
+
+    def _begin(self):
+        pass
+
+    def _commit(self):
+        pass
+
+    def _rollback(self):
+        pass
+
+
+class MemoryDatabase(_LocalDatabase):
+    """Plain dicts; state lives and dies with the process.
+
+    Writes are applied in place, so a failed transaction is not rolled back;
+    the stores only raise before their first write.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._collections = {}
+        # collection -> {field: sorted [(value or "", id)]}, built by the first
+        # page() over that field and kept up to date by every write after it
+        self._sorted = {}
+
+    def _get(self, collection, doc_id):
+        data = self._collections.get(collection, {}).get(doc_id)
+        return dict(data) if data is not None else None
+
+    def _put(self, collection, doc_id, data):
+        docs = self._collections.setdefault(collection, {})
+        self._unindex(collection, doc_id, docs.get(doc_id))
+        docs[doc_id] = dict(data)
+        for field, keys in self._sorted.get(collection, {}).items():
+            bisect.insort(keys, (data.get(field) or "", doc_id))
+
+    def _delete(self, collection, doc_id):
+        self._unindex(collection, doc_id, self._collections.get(collection, {}).pop(doc_id, None))
+
+    def _unindex(self, collection, doc_id, data):
+        if data is None:
+            return
+        for field, keys in self._sorted.get(collection, {}).items():
+            i = bisect.bisect_left(keys, (data.get(field) or "", doc_id))
+            del keys[i]
+
+    def _scan(self, collection, **equals):
+        docs = self._collections.get(collection, {})
+        for doc_id in sorted(docs):
+            data = docs[doc_id]
+            if all(data.get(k) == v for k, v in equals.items()):
+                yield doc_id, dict(data)
+
+    def _page(self, collection, order, limit, after, lower, upper, equals):
+        docs = self._collections.get(collection, {})
+        indexes = self._sorted.setdefault(collection, {})
+        keys = indexes.get(order)
+        if keys is None:
+            keys = indexes[order] = sorted((data.get(order) or "", doc_id) for doc_id, data in docs.items())
+
+        # Walk down from just below the cursor (or `upper`), so a page costs
+        # what it returns plus the rows the filters skip, not a full scan.
+        i = len(keys)
+        if upper is not None:
+            i = bisect.bisect_left(keys, (upper,))
+        if after is not None:
+            i = min(i, bisect.bisect_left(keys, tuple(after)))
+        found = 0
+        while i > 0 and found < limit:
+            i -= 1
+            value, doc_id = keys[i]
+            if lower is not None and value < lower:
+                return
+            data = docs[doc_id]
+            if all(data.get(k) == v for k, v in equals.items()):
+                found += 1
+                yield doc_id, dict(data)
+
+
+class SqliteDatabase(_LocalDatabase):
+    """One `docs` table holding JSON documents, in WAL mode so readers don't wait for writers."""
+
+    INDEXED_FIELDS = {
+        "equipments": ("zone", "status"),
+        "usage_logs": ("equipment_id", "end_time"),
+        "usage_rollups": ("granularity", "scope", "key", "bucket_start"),
+    }
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.name = f"sqlite:{os.path.abspath(path)}"
+        self._local = threading.local()  # .reader: this thread's read connection, .reading: inside read()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL,"
+            " PRIMARY KEY (collection, id))"
+        )
+        for collection, fields in self.INDEXED_FIELDS.items():
+            columns = ", ".join(f"json_extract(data, '$.{f}')" for f in fields)
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{collection} ON docs (collection, {columns})"
+                f" WHERE collection = '{collection}'"
+            )
+
+    @contextmanager
+    def read(self):
+        # Inside a transaction on this thread, read through it (and see its
+        # writes); a private in-memory database has only the one connection.
+        if self._owner == threading.get_ident() or self.path == ":memory:":
+            with self.transaction():
+                yield self
+            return
+        if getattr(self._local, "reading", False):
+            yield self
+            return
+        reader = getattr(self._local, "reader", None)
+        if reader is None:
+            reader = self._local.reader = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        reader.execute("BEGIN")  # deferred: a snapshot, no write lock
+        self._local.reading = True
+        try:
+            yield self
+        finally:
+            self._local.reading = False
+            reader.execute("COMMIT")
+
+    def _conn(self):
+        if getattr(self._local, "reading", False) and self._owner != threading.get_ident():
+            return self._local.reader
+        return self.conn
+
+    def _begin(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def _commit(self):
+        self.conn.execute("COMMIT")
+
+    def _rollback(self):
+        self.conn.execute("ROLLBACK")
+
+    def _get(self, collection, doc_id):
+        row = self._conn().execute("SELECT data FROM docs WHERE collection = ? AND id = ?", (collection, doc_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, collection, doc_id, data):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO docs (collection, id, data) VALUES (?, ?, ?)",
+            (collection, doc_id, json.dumps(data)),
+        )
+
+    def _delete(self, collection, doc_id):
+        self.conn.execute("DELETE FROM docs WHERE collection = ? AND id = ?", (collection, doc_id))
+
+    def _scan(self, collection, **equals):
+        sql = "SELECT id, data FROM docs WHERE collection = ?"
+        params = [collection]
+        for field, value in equals.items():
+            sql += f" AND json_extract(data, '$.{field}') = ?"
+            params.append(value)
+        for doc_id, data in self._conn().execute(sql + " ORDER BY id", params).fetchall():
+            yield doc_id, json.loads(data)
+
+    def _page(self, collection, order, limit, after, lower, upper, equals):
+        value = f"COALESCE(json_extract(data, '$.{order}'), '')"
+        sql = "SELECT id, data FROM docs WHERE collection = ?"
+        params = [collection]
+        for field, v in equals.items():
+            sql += f" AND json_extract(data, '$.{field}') = ?"
+            params.append(v)
+        if lower is not None:
+            sql += f" AND {value} >= ?"
+            params.append(lower)
+        if upper is not None:
+            sql += f" AND {value} < ?"
+            params.append(upper)
+        if after is not None:
+            sql += f" AND ({value} < ? OR ({value} = ? AND id < ?))"
+            params += [after[0], after[0], after[1]]
+        sql += f" ORDER BY {value} DESC, id DESC LIMIT ?"
+        for doc_id, data in self._conn().execute(sql, params + [limit]).fetchall():
+            yield doc_id, json.loads(data)
+
+
+# =====================================================
+# Stores
+# =====================================================
+# The request-path methods are coroutines only to satisfy the store interface;
+# their work is in-process and finishes in well under a millisecond, so they
+# run inline on the event loop.
+class _Watch:
+    def __init__(self, callbacks, callback):
+        self._callbacks = callbacks
+        self._callback = callback
+
+    def unsubscribe(self):
+        self._callbacks.discard(self._callback)
+
+
+class LocalEquipmentStore(EquipmentStore):
+    def __init__(self, db, facility=DEFAULT_FACILITY):
+        self.db = db
+        self.equipments = collection_path(facility, "equipments")
+        self.sessions = collection_path(facility, "active_sessions")
+        self._callbacks = set()
+
+    async def list(self):
+        with self.db.read():
+            return [data for _, data in self.db.scan(self.equipments)]
+
+    async def get(self, equipment_id):
+        with self.db.read():
+            return self.db.get(self.equipments, equipment_id)
+
+    async def put(self, equipment_id, data):
+        with self.db.transaction():
+            self.db.put(self.equipments, equipment_id, data)
+            self._emit([(equipment_id, dict(data))])
+
+    async def update(self, equipment_id, fields):
+        with self.db.transaction():
+            current = self.db.get(self.equipments, equipment_id)
+            if current is None:
+                raise EquipmentNotFound(equipment_id)
+            data = {**current, **fields}
+            self.db.put(self.equipments, equipment_id, data)
+            self._emit([(equipment_id, data)])
+        return data
+
+    async def check_in(self, zone, user):
+        with self.db.transaction():
+            session = self.db.get(self.sessions, user)
+            if session is not None:
+                raise AlreadyCheckedIn(user, session)
+            target = next(self.db.scan(self.equipments, zone=zone, status="available"), None)
+            if target is None:
+                raise NoAvailableEquipment(zone)
+
+            equipment_id, data = target
+            start_time = datetime.utcnow().isoformat()
+            data.update({"status": "in_use", "current_user": user, "start_time": start_time})
+            self.db.put(self.equipments, equipment_id, data)
+            self.db.put(self.sessions, user, {"equipment_id": equipment_id, "zone": zone, "start_time": start_time})
+            self._emit([(equipment_id, data)])
+        return equipment_id, data
+
+    async def check_out(self, zone, user):
+        with self.db.transaction():
+            session = self.db.get(self.sessions, user)
+            if session is not None:
+                equipment_id = session["equipment_id"]
+                data = self.db.get(self.equipments, equipment_id) or {}
+            else:
+                equipment_id, data = next(self.db.scan(self.equipments, zone=zone, status="in_use", current_user=user), (None, {}))
+            if data.get("zone") != zone or data.get("status") != "in_use" or data.get("current_user") != user:
+                raise NotCheckedIn(zone, user)
+
+            log = build_usage_log(equipment_id, zone, data)
+            data.update({"status": "available", "current_user": "", "start_time": ""})
+            self.db.put(self.equipments, equipment_id, data)
+            self.db.delete(self.sessions, user)
+            self._emit([(equipment_id, data)])
+        return equipment_id, data, log
+
+    async def active_session(self, user):
+        with self.db.read():
+            return self.db.get(self.sessions, user)
+
+    def put_many(self, items, progress=None):
+        items = [(equipment_id, dict(data)) for equipment_id, data in items]
+        with self.db.transaction():
+            for equipment_id, data in items:
+                self.db.put(self.equipments, equipment_id, data)
+            self._emit(items)
+        if progress:
+            progress(len(items), len(items))
+
+    def put_sessions(self, sessions, progress=None):
+        with self.db.transaction():
+            for user, session in sessions.items():
+                self.db.put(self.sessions, user, session)
+        if progress:
+            progress(len(sessions), len(sessions))
+
+    def watch(self, callback):
+        with self.db.transaction():
+            callback(list(self.db.scan(self.equipments)))
+            self._callbacks.add(callback)
+        return _Watch(self._callbacks, callback)
+
+    def _emit(self, changes):
+        """Deliver `changes` to watchers once the current transaction commits."""
+        def deliver():
+            for callback in list(self._callbacks):
+                callback(changes)
+        self.db.after_commit(deliver)
+
+
+class LocalUsageLogStore(UsageLogStore):
+    def __init__(self, db, facility=DEFAULT_FACILITY):
+        self.db = db
+        self.collection = collection_path(facility, "usage_logs")
+
+    async def add(self, log):
+        log_id = uuid.uuid4().hex
+        with self.db.transaction():
+            self.db.put(self.collection, log_id, ingested(log))
+        return log_id
+
+    def add_many(self, logs, progress=None):
+        count = 0
+        with self.db.transaction():
+            for log in logs:
+                self.db.put(self.collection, uuid.uuid4().hex, ingested(log))
+                count += 1
+        if progress:
+            progress(count, count)
+
+    def put_many(self, items, progress=None):
+        items = list(items)
+        with self.db.transaction():
+            for log_id, log in items:
+                self.db.put(self.collection, log_id, ingested(log))
+        if progress:
+            progress(len(items), len(items))
+
+    async def page(self, limit, after=None, equipment_id=None, user=None, zone=None, start=None, end=None,
+                   order="end_time"):
+        equals = {k: v for k, v in (("equipment_id", equipment_id), ("user", user), ("zone", zone)) if v is not None}
+        with self.db.read():
+            return self.db.page(self.collection, order, limit, after, start, end, **equals)
+
+
+class LocalExerciseStore(ExerciseStore):
+    def __init__(self, db):
+        self.db = db
+        self._callbacks = set()
+
+    async def list(self):
+        with self.db.read():
+            return [data for _, data in self.db.scan("exercises")]
+
+    async def put(self, name, data):
+        with self.db.transaction():
+            self.db.put("exercises", name, data)
+            self._emit([(name, dict(data))])
+
+    def put_many(self, items, progress=None):
+        items = [(name, dict(data)) for name, data in items]
+        with self.db.transaction():
+            for name, data in items:
+                self.db.put("exercises", name, data)
+            self._emit(items)
+        if progress:
+            progress(len(items), len(items))
+
+    def watch(self, callback):
+        with self.db.transaction():
+            callback(list(self.db.scan("exercises")))
+            self._callbacks.add(callback)
+        return _Watch(self._callbacks, callback)
+
+    def _emit(self, changes):
+        def deliver():
+            for callback in list(self._callbacks):
+                callback(changes)
+        self.db.after_commit(deliver)
+
+
+class LocalRollupStore(RollupStore):
+    def __init__(self, db, facility=DEFAULT_FACILITY):
+        self.db = db
+        self.collection = collection_path(facility, "usage_rollups")
+        self.batches = collection_path(facility, "rollup_batches")
+
+    async def apply(self, increments):
+        self.apply_many(increments)
+
+    def apply_once(self, batch_id, increments):
+        with self.db.transaction():
+            if self.db.get(self.batches, batch_id) is not None:
+                return False
+            self.apply_many(increments)
+            self.db.put(self.batches, batch_id, {"applied_at": datetime.utcnow().isoformat()})
+        return True
+
+    def applied(self, batch_id):
+        with self.db.read():
+            return self.db.get(self.batches, batch_id) is not None
+
+    def apply_many(self, increments, progress=None):
+        with self.db.transaction():
+            for inc in increments:
+                bucket = self.db.get(self.collection, inc["id"]) or {
+                    "granularity": inc["granularity"],
+                    "scope": inc["scope"],
+                    "key": inc["key"],
+                    "bucket_start": inc["bucket_start"],
+                    "sessions": 0,
+                    "busy_minutes": 0,
+                    "durations": {},
+                }
+                bucket["sessions"] += inc["sessions"]
+                bucket["busy_minutes"] += inc["busy_minutes"]
+                for minutes, count in inc["durations"].items():
+                    bucket["durations"][minutes] = bucket["durations"].get(minutes, 0) + count
+                self.db.put(self.collection, inc["id"], bucket)
+        if progress:
+            progress(len(increments), len(increments))
+
+    async def query(self, granularity, scope, key, start, end):
+        with self.db.read():
+            buckets = [
+                data for _, data in self.db.scan(self.collection, granularity=granularity, scope=scope, key=key)
+                if start <= data["bucket_start"] < end
+            ]
+        return sorted(buckets, key=lambda b: b["bucket_start"])
+
+
+def local_stores(db, facility=DEFAULT_FACILITY, exercises=None):
+    exercises = exercises or LocalExerciseStore(db)
+    return Stores(
+        equipments=LocalEquipmentStore(db, facility),
+        usage_logs=LocalUsageLogStore(db, facility),
+        exercises=exercises,
+        rollups=LocalRollupStore(db, facility),
+        facility=facility,
+        partition=lambda other: local_stores(db, other, exercises),
+        backend=db.name,
+    )
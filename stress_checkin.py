@@ -0,0 +1,132 @@
+"""
+Concurrency stress check for check-in/check-out.
+
+With no arguments it runs in-process: the app is served over httpx's ASGI
+transport (no sockets, no server to start) on the memory backend seeded with
+demo data, so it is a self-contained test:
+
+    python stress_checkin.py
+
+UREC_STORAGE picks another backend for the in-process run, e.g. the Firestore
+emulator:
+
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python seed_full_gym_data.py
+    FIRESTORE_EMULATOR_HOST=localhost:8080 UREC_STORAGE=firestore python stress_checkin.py
+
+`--api` targets a running server instead:
+
+    UREC_STORAGE=memory UREC_SEED_DEMO=1 UREC_AUTH=optional uvicorn main:app
+    python stress_checkin.py --api http://127.0.0.1:8000 --zone squat_rack --users 300
+
+With UREC_AUTH_KEYS set (for both), each user's requests carry a token minted
+from those stand-in keys instead, so the API can keep requiring auth.
+
+Fires hundreds of simultaneous check-ins at one zone and asserts that no unit
+was handed to two users, then fires many check-ins for a single user across
+zones and asserts at most one succeeds. Exits non-zero on a failed check.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from collections import Counter
+import httpx
+
+
+async def run(client, auth, zone, n_users, workers):
+    limit = asyncio.Semaphore(workers)
+
+    async def zone_units(zone):
+        r = await client.get("/equipments")
+        return [e for e in r.json() if e.get("zone") == zone]
+
+    async def check_in(zone, user):
+        async with limit:
+            r = await client.post(f"/checkin/{zone}", params={"user": user}, headers=auth(user))
+        body = r.json() if r.headers.get("content-type", "").startswith("application/json") else {}
+        return user, r.status_code, body
+
+    async def check_out(zone, user):
+        async with limit:
+            return (await client.post(f"/checkout/{zone}", params={"user": user}, headers=auth(user))).status_code
+
+    # ----------------------------------------------------
+    # 1. Many users, one zone
+    # ----------------------------------------------------
+    available = sum(1 for e in await zone_units(zone) if e.get("status") == "available")
+    users = [f"stress_{i:04d}" for i in range(n_users)]
+    print(f"⏳ {len(users)} concurrent check-ins into '{zone}' ({available} units available)...")
+
+    results = await asyncio.gather(*(check_in(zone, u) for u in users))
+
+    winners = {user: body["equipment_id"] for user, status, body in results if status == 200}
+    errors = Counter(status for _, status, _ in results if status != 200)
+    duplicates = [eq for eq, n in Counter(winners.values()).items() if n > 1]
+    print(f"   {len(winners)} succeeded, failures by status: {dict(errors)}")
+
+    assert not duplicates, f"Units assigned to more than one user: {duplicates}"
+    assert len(winners) <= available, f"{len(winners)} check-ins succeeded with only {available} units free"
+    assert set(errors) <= {404}, f"Unexpected failures: {dict(errors)}"
+
+    holders = {e["equipment_id"]: e.get("current_user") for e in await zone_units(zone)}
+    for user, eq_id in winners.items():
+        assert holders.get(eq_id) == user, f"{eq_id} is held by {holders.get(eq_id)!r}, expected {user!r}"
+    print("✅ No double assignments.")
+
+    await asyncio.gather(*(check_out(zone, u) for u in winners))
+
+    # ----------------------------------------------------
+    # 2. One user, many zones
+    # ----------------------------------------------------
+    zones = sorted({e.get("zone") for e in (await client.get("/equipments")).json()})
+    attempts = [z for z in zones for _ in range(max(1, n_users // max(1, len(zones))))]
+    print(f"⏳ {len(attempts)} concurrent check-ins for one user across {len(zones)} zones...")
+
+    results = await asyncio.gather(*(check_in(z, "stress_solo") for z in attempts))
+
+    solo = [attempt for attempt, (_, status, _) in zip(attempts, results) if status == 200]
+    assert len(solo) <= 1, f"User checked into {len(solo)} units at once"
+    print(f"✅ {len(solo)} check-in succeeded for the same user.")
+
+    for zone in solo:
+        await check_out(zone, "stress_solo")
+
+
+async def run_remote(api, args):
+    from auth import stand_in_headers
+    limits = httpx.Limits(max_connections=args.workers)
+    async with httpx.AsyncClient(base_url=api, limits=limits, timeout=60) as client:
+        await run(client, stand_in_headers(), args.zone, args.users, args.workers)
+
+
+async def run_in_process(args):
+    with tempfile.TemporaryDirectory(prefix="urec-stress-") as scratch:
+        os.environ.setdefault("UREC_STORAGE", "memory")
+        os.environ.setdefault("UREC_SEED_DEMO", "1")
+        os.environ.setdefault("UREC_AUTH", "optional")
+        os.environ["UREC_USAGE_JOURNAL"] = os.path.join(scratch, "usage_logs.journal")
+        import main
+        from auth import stand_in_headers
+        # ASGITransport doesn't run the lifespan; run it around the test.
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://stress", timeout=60) as client:
+                await run(client, stand_in_headers(), args.zone, args.users, args.workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent check-in stress test")
+    parser.add_argument("--api", default=None, help="running server to test (default: in-process)")
+    parser.add_argument("--zone", default="squat_rack")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=100)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_remote(args.api, args) if args.api else run_in_process(args))
+    except AssertionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print("🎉 Stress test passed.")
@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+import rollups
+from storage import DEFAULT_FACILITY, get_stores
+from storage.base import MAX_APPLY_INCREMENTS
+
+# =====================================================
+# Write-behind Usage Logs
+# =====================================================
+# Check-out only pays for the equipment update; the usage log it produces is
+# appended to a local journal and committed later in batches, together with
+# its rollup increments (one write per touched bucket per group of logs
+# instead of one per log). A background thread flushes whenever FLUSH_SIZE
+# logs are waiting or FLUSH_INTERVAL seconds have passed.
+#
+# Journal: a header line {"journal", "backend"}, then one JSON line
+# {"seq", "id", "facility", "log"} per log, flushed to the OS (and fsynced
+# unless UREC_JOURNAL_FSYNC=0) before append() returns. A journal belongs to
+# the database named in its header: starting against another backend raises
+# JournalMismatch instead of replaying its logs there. The default path,
+# usage_logs.<backend>.journal, keeps backends apart; UREC_USAGE_JOURNAL
+# overrides it, and each process needs its own.
+#
+# Before a batch is written its last seq goes into the journal as
+# {"batch": seq}, so a retry, even after a restart, resends exactly that
+# batch. After it commits, the seq is written to "<journal>.ckpt", and the
+# journal is truncated once nothing is waiting. On start, lines past the
+# checkpoint are replayed. Logs are written under their journal id, and rollup
+# increments go through rollups.record_once() with ids derived from the
+# journal and batch, so replaying a batch counts nothing twice.
+#
+# A failed flush is retried with exponential backoff (up to MAX_BACKOFF). From
+# the ISOLATE_AFTER-th attempt on, the batch is written a log at a time; a log
+# that still fails while others get through (or after DEAD_LETTER_AFTER
+# attempts) is moved to "<journal>.dead" so it stops holding up the rest.
+# `python usage_buffer.py retry-dead-letters` puts them back in the queue.
+#
+# One buffer serves every facility: a batch is split by facility at flush time
+# and each part goes to that facility's stores. Logs still waiting in the
+# buffer are visible through pending().
+
+JOURNAL_PATH = os.getenv("UREC_USAGE_JOURNAL")
+FSYNC = os.getenv("UREC_JOURNAL_FSYNC", "1") != "0"
+FLUSH_SIZE = 200
+FLUSH_INTERVAL = 2.0  # seconds
+MAX_BACKOFF = 60.0  # seconds
+ISOLATE_AFTER = 3
+DEAD_LETTER_AFTER = 20
+
+log = logging.getLogger(__name__)
+
+
+class JournalMismatch(RuntimeError):
+    pass
+
+
+def default_journal_path(backend):
+    return f"usage_logs.{(backend or 'unknown').split(':')[0]}.journal"
+
+
+def _group_size(log):
+    try:
+        return len(rollups.increments_for_log(log))
+    except Exception:
+        return MAX_APPLY_INCREMENTS  # a log rollups can't handle goes in a group of its own
+
+
+def _groups(entries):
+    """Split entries into runs whose rollup increments fit in one apply_once()."""
+    group, size = [], 0
+    for entry in entries:
+        n = _group_size(entry[3])
+        if group and size + n > MAX_APPLY_INCREMENTS:
+            yield group
+            group, size = [], 0
+        group.append(entry)
+        size += n
+    if group:
+        yield group
+
+
+class UsageLogBuffer:
+    def __init__(self, stores, path=JOURNAL_PATH, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, fsync=FSYNC):
+        self.stores = stores
+        self.path = path or default_journal_path(stores.backend)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._journal = None
+        self._thread = None
+        self._stopping = False
+        self._pending = []  # (seq, log_id, facility, log) in journal order
+        self._seq = 0
+        self._journal_id = None
+        self._batch_end = None  # last seq of the batch being written, until it commits
+        self._attempts = 0  # failed attempts at that batch
+        self._retry_at = 0.0
+        self.stats = Counter()
+
+    # -------------------- lifecycle --------------------
+    def start(self):
+        """Replay anything the journal holds past its checkpoint and start flushing."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._recover()
+            self._journal = open(self.path, "a", encoding="utf-8")
+            if self._journal_id is None:
+                # New journal (or only a header torn by a crash): start it afresh.
+                self._journal_id = uuid.uuid4().hex
+                self._journal.truncate(0)
+                self._write_header()
+            self._thread = threading.Thread(target=self._run, name="usage-log-flusher", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the flusher after a final flush; unflushed logs stay journaled."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping = True
+            self._wakeup.notify()
+        thread.join()
+        with self._lock:
+            self._journal.close()
+            self._journal = None
+            self._thread = None
+            self._stopping = False
+
+    def _recover(self):
+        checkpoint = 0
+        if os.path.exists(self.path + ".ckpt"):
+            with open(self.path + ".ckpt", encoding="utf-8") as f:
+                checkpoint = int(f.read().strip() or 0)
+        self._seq = checkpoint
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for n, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn final line from a crash mid-append
+                if n == 0:
+                    self._check_header(entry)
+                elif "batch" in entry:
+                    if entry["batch"] > checkpoint:
+                        self._batch_end = entry["batch"]
+                elif "seq" in entry:
+                    self._seq = max(self._seq, entry["seq"])
+                    if entry["seq"] > checkpoint:
+                        self._pending.append((entry["seq"], entry["id"], entry.get("facility", DEFAULT_FACILITY), entry["log"]))
+        if self._pending:
+            log.info("replaying %d journaled usage logs", len(self._pending), extra={"journal": self.path})
+
+    def _check_header(self, header):
+        if header.get("backend") != self.stores.backend:
+            raise JournalMismatch(
+                f"{self.path} holds usage logs for {header.get('backend') or 'an unknown backend'}, "
+                f"not {self.stores.backend}; point UREC_USAGE_JOURNAL elsewhere or move the file"
+            )
+        self._journal_id = header["journal"]
+
+    def _write_header(self):
+        self._write_line({"journal": self._journal_id, "backend": self.stores.backend})
+
+    def _write_line(self, entry):
+        self._journal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    # -------------------- writes --------------------
+    def append(self, log, facility=DEFAULT_FACILITY, log_id=None):
+        """Journal one usage log of `facility` for the next flush and return its id. Blocks on disk."""
+        if self._thread is None:
+            self.start()
+        log_id = log_id or uuid.uuid4().hex
+        with self._lock:
+            self._seq += 1
+            self._write_line({"seq": self._seq, "id": log_id, "facility": facility, "log": log})
+            self._pending.append((self._seq, log_id, facility, log))
+            if len(self._pending) >= self.flush_size:
+                self._wakeup.notify()
+        return log_id
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadline = max(time.monotonic() + self.flush_interval, self._retry_at)
+                while not self._stopping:
+                    now = time.monotonic()
+                    if now >= deadline or (now >= self._retry_at and len(self._pending) >= self.flush_size):
+                        break
+                    self._wakeup.wait(deadline - now)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self):
+        """Commit the current batch; returns the number of logs written."""
+        with self._flush_lock:
+            with self._lock:
+                if self._batch_end is None:
+                    if not self._pending:
+                        return 0
+                    self._batch_end = self._pending[-1][0]
+                    self._write_line({"batch": self._batch_end})
+                # Appends only ever extend the list, so the batch is its prefix.
+                batch = [entry for entry in self._pending if entry[0] <= self._batch_end]
+            try:
+                dead = self._commit(batch, isolate=self._attempts >= ISOLATE_AFTER)
+            except Exception:
+                # Everything stays journaled and pending; the same batch is retried.
+                self._attempts += 1
+                with self._lock:
+                    self._retry_at = time.monotonic() + min(self.flush_interval * 2 ** self._attempts, MAX_BACKOFF)
+                self.stats["failed_flushes"] += 1
+                log.warning("usage log flush of %d failed (attempt %d), will retry", len(batch), self._attempts,
+                            exc_info=True)
+                return 0
+
+            if dead:
+                self._dead_letter(dead)
+            self._checkpoint(self._batch_end)
+            with self._lock:
+                del self._pending[:len(batch)]
+                self._batch_end = None
+                self._attempts = 0
+                self._retry_at = 0.0
+                if not self._pending:
+                    self._journal.truncate(0)
+                    self._write_header()
+            self.stats["flushes"] += 1
+            self.stats["logs"] += len(batch) - len(dead)
+            return len(batch) - len(dead)
+
+    def _commit(self, batch, isolate=False):
+        """Write a batch; returns the (entry, error) pairs given up on (isolate mode only)."""
+        batch_id = f"{self._journal_id}-{batch[-1][0]}" if batch else None
+        by_facility = {}
+        for entry in batch:
+            by_facility.setdefault(entry[2], []).append(entry)
+        written, failed = 0, []
+        for facility, entries in by_facility.items():
+            stores = self.stores.for_facility(facility)
+            for n, group in enumerate(_groups(entries)):
+                group_id = f"{batch_id}-{facility}-{n}"
+                if not isolate:
+                    self._write(stores, group_id, group)
+                    continue
+                # A group is either committed whole under group_id or log by
+                # log under group_id-seq, never both.
+                if len(group) > 1 and rollups.recorded(stores, group_id):
+                    continue
+                for entry in group:
+                    try:
+                        self._write(stores, group_id if len(group) == 1 else f"{group_id}-{entry[0]}", [entry])
+                        written += 1
+                    except Exception as e:
+                        failed.append((entry, e))
+        if failed and not written and self._attempts + 1 < DEAD_LETTER_AFTER:
+            raise failed[0][1]
+        return failed
+
+    @staticmethod
+    def _write(stores, batch_id, entries):
+        stores.usage_logs.put_many([(log_id, usage_log) for _, log_id, _, usage_log in entries])
+        rollups.record_once(stores, batch_id, [usage_log for *_, usage_log in entries])
+
+    def _dead_letter(self, dead):
+        with open(self.path + ".dead", "a", encoding="utf-8") as f:
+            for (seq, log_id, facility, usage_log), error in dead:
+                entry = {"id": log_id, "facility": facility, "log": usage_log, "error": repr(error)}
+                f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats["dead_letters"] += len(dead)
+        log.error("%d usage logs failed repeatedly and were moved to %s", len(dead), self.path + ".dead",
+                  extra={"log_ids": [entry[1] for entry, _ in dead]})
+
+    def retry_dead_letters(self):
+        """Queue the dead-lettered logs again and empty the file; returns how many."""
+        path = self.path + ".dead"
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        for entry in entries:
+            self.append(entry["log"], entry["facility"], entry["id"])
+        os.remove(path)
+        return len(entries)
+
+    def _checkpoint(self, seq):
+        tmp = self.path + ".ckpt.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path + ".ckpt")
+
+    # -------------------- reads --------------------
+    def pending(self, facility=DEFAULT_FACILITY, **equals):
+        """(log_id, log) pairs of `facility` journaled but not yet committed whose fields match `equals`."""
+        with self._lock:
+            return [
+                (log_id, dict(log)) for _, log_id, log_facility, log in self._pending
+                if log_facility == facility and all(log.get(k) == v for k, v in equals.items())
+            ]
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_usage_buffer():
+    """Shared buffer for this process (every facility), started on first use."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = UsageLogBuffer(get_stores())
+    _buffer.start()
+    return _buffer
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Usage-log journal maintenance")
+    parser.add_argument("command", choices=["retry-dead-letters"])
+    args = parser.parse_args()
+    from log_config import setup_logging
+    setup_logging(fmt="text")
+
+    buffer = get_usage_buffer()
+    count = buffer.retry_dead_letters()
+    buffer.close()
+    log.info(f"✅ {count} dead-lettered usage logs queued again.")
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+from eta import get_engine
+from occupancy import get_index
+from storage import DEFAULT_FACILITY
+
+# =====================================================
+# Zone Waitlists
+# =====================================================
+# A full zone keeps a FIFO of users waiting for a unit instead of having every
+# client retry check-ins until one happens to land. When a unit frees up it is
+# offered to the head of the queue and held for HOLD_SECONDS: during the hold
+# only that user's check-in can take it, and if they don't show up the hold
+# lapses and the unit goes to the next in line.
+#
+# Free units come from the occupancy index, so the queue also notices units
+# freed some other way (an edit, another process); a check-out offers its unit
+# right away rather than waiting for the index to see it. A user waits in at
+# most one zone per facility: joining another zone moves them.
+#
+# Like the index, a waitlist lives in this process, one per facility.
+
+HOLD_SECONDS = 120
+
+
+class Waitlist:
+    def __init__(self, index, hold_seconds=HOLD_SECONDS):
+        self.index = index
+        self.hold_seconds = hold_seconds
+        self._lock = threading.Lock()
+        self._queues = {}  # zone -> deque of waiting users, head first
+        self._holds = {}   # zone -> {user: hold expiry (monotonic)}
+        self._zones = {}   # user -> zone they wait in or hold a unit in
+
+    # -------------------- queue changes --------------------
+    def join(self, zone, user):
+        """Queue `user` for `zone` (a no-op if they already are) and return their status()."""
+        with self._lock:
+            self._settle(zone)
+            if self._zones.get(user) != zone:
+                self._remove(user)
+                self._queues.setdefault(zone, deque()).append(user)
+                self._zones[user] = zone
+                self._settle(zone)
+            return self._status(zone, user)
+
+    def leave(self, zone, user):
+        """Take `user` out of `zone`'s queue or give up their hold; False if they had neither."""
+        with self._lock:
+            if self._zones.get(user) != zone:
+                return False
+            self._remove(user)
+            self._settle(zone)
+            return True
+
+    def admit(self, zone, user):
+        """Whether a check-in by `user` may take a unit in `zone` without jumping the queue."""
+        with self._lock:
+            self._settle(zone)
+            holds = self._holds.get(zone, {})
+            return user in holds or self._free(zone) > len(holds)
+
+    def claimed(self, zone, user):
+        """`user` checked into `zone`: their hold, or their place in line, is used up."""
+        with self._lock:
+            if self._zones.get(user) == zone:
+                self._remove(user)
+
+    def released(self, zone, equipment_id):
+        """`equipment_id` in `zone` was just freed: offer it to the head of the queue."""
+        with self._lock:
+            self._settle(zone)
+            # Once the index has seen the unit free, _settle already offered it.
+            unit = self.index.get(equipment_id)
+            queue = self._queues.get(zone)
+            if queue and unit is not None and unit.get("status") == "in_use":
+                self._offer(zone, queue.popleft())
+
+    # -------------------- reads --------------------
+    def status(self, zone, user):
+        """{"state": "waiting", "position"} or {"state": "offered", "hold_seconds"}, or None."""
+        with self._lock:
+            self._settle(zone)
+            return self._status(zone, user)
+
+    def zone_of(self, user):
+        with self._lock:
+            return self._zones.get(user)
+
+    def size(self, zone):
+        """(users waiting, units held) for `zone`."""
+        with self._lock:
+            self._settle(zone)
+            return len(self._queues.get(zone, ())), len(self._holds.get(zone, {}))
+
+    # -------------------- internals (under _lock) --------------------
+    def _free(self, zone):
+        return self.index.zone_counts(by="zone", zones=[zone])[zone]["available"]
+
+    def _settle(self, zone):
+        """Drop lapsed holds, then offer any free, unheld units to the front of the queue."""
+        now = time.monotonic()
+        holds = self._holds.get(zone, {})
+        for user, expires in list(holds.items()):
+            if expires <= now:
+                del holds[user]
+                del self._zones[user]
+        queue = self._queues.get(zone)
+        spare = self._free(zone) - len(holds) if queue else 0
+        while queue and spare > 0:
+            self._offer(zone, queue.popleft())
+            spare -= 1
+
+    def _offer(self, zone, user):
+        self._holds.setdefault(zone, {})[user] = time.monotonic() + self.hold_seconds
+
+    def _remove(self, user):
+        zone = self._zones.pop(user, None)
+        if zone is None:
+            return
+        if self._holds.get(zone, {}).pop(user, None) is None:
+            self._queues[zone].remove(user)
+
+    def _status(self, zone, user):
+        if self._zones.get(user) != zone:
+            return None
+        expires = self._holds.get(zone, {}).get(user)
+        if expires is not None:
+            return {"zone": zone, "state": "offered", "hold_seconds": max(round(expires - time.monotonic()), 0)}
+        return {"zone": zone, "state": "waiting", "position": self._queues[zone].index(user) + 1}
+
+
+async def with_eta(status, facility=DEFAULT_FACILITY):
+    """Add eta_minutes to a waiting user's status() (in place)."""
+    if status is not None and status["state"] == "waiting":
+        status["eta_minutes"] = await get_engine(facility).queue_wait(status["zone"], status["position"])
+    return status
+
+
+_waitlists = {}
+_waitlists_lock = threading.Lock()
+
+
+def get_waitlist(facility=DEFAULT_FACILITY):
+    with _waitlists_lock:
+        waitlist = _waitlists.get(facility)
+        if waitlist is None:
+            waitlist = _waitlists[facility] = Waitlist(get_index(facility))
+    return waitlist